@@ -1 +1,2 @@
-from .aplpy import *
\ No newline at end of file
+from .aplpy import *
+from .channel_maps import ChannelMaps
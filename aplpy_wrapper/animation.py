@@ -0,0 +1,210 @@
+from __future__ import absolute_import, print_function, division
+
+import os
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+import numpy as np
+from astropy import log
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from . import cube_stats
+from . import image_util
+
+LIMITS = ['global', 'frame', 'current']
+
+
+def cube_limits(slicer, slices, pmin, pmax):
+    '''
+    Return the values at two percentiles of several slices of a cube, from
+    which the limits of a stretch shared by the slices are set.
+
+    The slices are read one at a time, and a bounded sample of the values
+    of each is kept, so the memory used does not depend on the size of the
+    cube.
+    '''
+    n_samples = max(1000, cube_stats.CUBE_SAMPLES // max(1, len(slices)))
+    values = np.hstack([cube_stats.sample(slicer.view(s), n_samples) for s in slices])
+    if len(values) == 0:
+        return None
+    return tuple(np.percentile(values, [pmin, pmax]))
+
+
+def _frame_slices(figure, axis=0):
+    # All the slices along one of the sliced dimensions, keeping the other
+    # slices at their current values
+    slices = []
+    for value in range(figure._slicer.sizes[axis]):
+        s = list(figure._slices)
+        s[axis] = value
+        slices.append(s)
+    return slices
+
+
+def save_animation(figure, filename, slices=None, limits='global',
+                   pmin=0.25, pmax=99.75, duration=100, loop=0, dpi=None,
+                   threads=None):
+    '''
+    Save an animation stepping through the slices of a cube.
+
+    See `~aplpy_wrapper.FITSFigure.save_animation` for a description of the
+    arguments.
+
+    The frames are drawn one at a time by the same figure, so all the
+    artists are re-used, and only the image data (and the stretch, if it
+    changes) are updated between frames. Each frame is rendered by Agg and
+    copied from the renderer buffer into one of a fixed set of RGBA
+    buffers, which are handed to a pool of threads that convert them with
+    PIL. Drawing waits for a buffer to be released, so the memory used for
+    the RGBA frames does not depend on the number of frames. Image
+    sequences are written one frame at a time, but the frames of an
+    animated GIF (quantized to one byte per pixel) are kept in memory until
+    the GIF is written, since PIL writes all the frames at once, so long
+    animations of large figures should be saved as image sequences.
+    '''
+
+    try:
+        from PIL import Image
+    except ImportError:
+        try:
+            import Image
+        except ImportError:
+            raise ImportError("The Python Imaging Library (PIL) is required to save animations")
+
+    if getattr(figure, '_slicer', None) is None:
+        raise Exception("Animations can only be saved for figures created from data with more than two dimensions")
+
+    if figure.image is None or figure._image_smooth is None:
+        raise Exception("show_colorscale should be called before saving an animation")
+
+    if limits not in LIMITS:
+        raise ValueError("limits should be one of %s" % ', '.join(LIMITS))
+
+    if slices is None:
+        subset = False
+        slices = _frame_slices(figure)
+    else:
+        subset = True
+        slices = [[s] if type(s) == int else list(s) for s in slices]
+
+    if len(slices) == 0:
+        raise ValueError("slices= should contain at least one slice")
+
+    for s in slices:
+        figure._slicer.check(s)
+
+    gif = '%' not in filename
+    if gif and os.path.splitext(filename)[1].lower() != '.gif':
+        raise ValueError("filename should either end in .gif, or be a pattern such as frame_%03i.png for an image sequence")
+
+    if threads is None:
+        threads = multiprocessing.cpu_count()
+
+    norm = figure.image.norm
+    original = (list(figure._slices), norm.vmin, norm.vmax)
+
+    # The limits are set from the percentiles in the same way as by
+    # show_colorscale, for the stretch of the image
+    stretch = getattr(norm, 'stretch', 'linear')
+
+    # The limits of the frames are taken from the statistics of the cube,
+    # unless a subset of the slices is shown with a global stretch
+    if limits == 'global':
+        if subset:
+            vmin_vmax = cube_limits(figure._slicer, slices, pmin, pmax)
+        else:
+            vmin_vmax = figure._cube_statistics().limits(pmin, pmax)
+        if vmin_vmax is not None:
+            norm.vmin, norm.vmax = image_util.auto_limits(vmin_vmax[0], vmin_vmax[1], stretch)
+            log.info("Setting the stretch of all frames to %10.3e - %10.3e" % (norm.vmin, norm.vmax))
+        if hasattr(figure, 'colorbar'):
+            figure.colorbar.update()
+
+    # Render with Agg, whichever backend the figure uses
+    mpl_figure = figure._figure
+    canvas = mpl_figure.canvas
+    if isinstance(canvas, FigureCanvasAgg):
+        agg = canvas
+    else:
+        agg = FigureCanvasAgg(mpl_figure)
+    if dpi is not None:
+        original_dpi = mpl_figure.get_dpi()
+        mpl_figure.set_dpi(dpi)
+
+    frames = [None] * len(slices)
+    buffers = Queue()
+    pending = []
+
+    def encode(index, buffer):
+        try:
+            if gif:
+                image = Image.fromarray(buffer[:, :, :3].copy(), 'RGB')
+                frames[index] = image.convert('P', palette=Image.ADAPTIVE)
+            else:
+                Image.fromarray(buffer, 'RGBA').save(filename % index)
+        finally:
+            buffers.put(buffer)
+
+    pool = ThreadPool(threads)
+
+    try:
+
+        for index, s in enumerate(slices):
+
+            figure.set_slice(s)
+
+            if limits == 'frame':
+                vmin, vmax = figure._cube_statistics().slice_limits(s, pmin, pmax)
+                norm.vmin, norm.vmax = image_util.auto_limits(vmin, vmax, stretch)
+                if hasattr(figure, 'colorbar'):
+                    figure.colorbar.update()
+
+            agg.draw()
+            rgba = np.asarray(agg.buffer_rgba())
+
+            # Allocate up to threads + 1 buffers, then wait for one to be
+            # released by the encoding threads
+            if index <= threads:
+                buffer = np.empty_like(rgba)
+            else:
+                buffer = buffers.get()
+
+            if buffer.shape != rgba.shape:
+                buffer = np.empty_like(rgba)
+            np.copyto(buffer, rgba)
+
+            pending.append(pool.apply_async(encode, (index, buffer)))
+
+            # Raise any error from the frames encoded so far, rather than
+            # after drawing all the frames
+            for result in [r for r in pending if r.ready()]:
+                result.get()
+                pending.remove(result)
+
+        for result in pending:
+            result.get()
+
+    finally:
+
+        pool.close()
+        pool.join()
+
+        if agg is not canvas:
+            mpl_figure.set_canvas(canvas)
+        if dpi is not None:
+            mpl_figure.set_dpi(original_dpi)
+
+        norm.vmin, norm.vmax = original[1:]
+        figure.set_slice(original[0])
+        if limits != 'current' and hasattr(figure, 'colorbar'):
+            figure.colorbar.update()
+
+    if gif:
+        frames[0].save(filename, save_all=True, append_images=frames[1:],
+                       duration=duration, loop=loop)
@@ -3,6 +3,7 @@ from __future__ import absolute_import, print_function, division
 from distutils import version
 import os
 import operator
+from collections import OrderedDict
 
 import matplotlib
 
@@ -54,7 +55,9 @@ WCS_TYPES = tuple(WCS_TYPES)
 import numpy as np
 
 from matplotlib.patches import Circle, Rectangle, Ellipse, Polygon, FancyArrow
-from matplotlib.collections import PatchCollection, LineCollection
+from matplotlib.collections import PatchCollection, LineCollection, \
+    EllipseCollection
+from matplotlib.colors import is_color_like
 
 from astropy import log
 import astropy.utils.exceptions as aue
@@ -64,11 +67,19 @@ from .decorators import auto_refresh, fixdocstring
 from .deprecated import Deprecated
 # from .overlays import Beam, Scalebar
 
+from . import catalog
+from . import contour_util
 from . import convolve_util
 from . import image_util
+from .lod import LevelOfDetail
 from . import header as header_util
 from . import wcs_util
 from . import slicer
+from . import reproject as reproject_util
+from . import mosaic
+from . import animation
+from . import cube_stats
+from . import collapse as collapse_util
 
 
 import matplotlib.pyplot as plt
@@ -81,7 +92,7 @@ from .colorbar import Colorbar
 from .overlays import Scalebar
 from .normalize import APLpyNormalize
 from .layers import Layers
-from .regions import Regions
+from .regions import Regions, TextCollection
 from .grid import Grid
 from .frame import Frame
 
@@ -103,7 +114,7 @@ class FITSFigure(Layers, Regions, Deprecated):
     def __init__(self, data, hdu=0, figure=None, subplot=(1, 1, 1),
                  downsample=False, north=False, convention=None,
                  dimensions=[0, 1], slices=[], auto_refresh=True,
-                 **kwargs):
+                 combine='mean', collapse=None, channels=None, **kwargs):
         '''
         Create a FITSFigure instance.
 
@@ -122,6 +133,12 @@ class FITSFigure(Layers, Regions, Deprecated):
                  astropy.wcs.WCS
                  np.ndarray
                  RGB image with AVM meta-data
+                 list of strings
+
+            If a list of FITS files is given, the images are reprojected
+            onto a common north-aligned grid and co-added into a mosaic,
+            and the number of images contributing to each pixel is stored
+            in the coverage attribute (which is None for other data).
 
         hdu : int, optional
             By default, the image in the primary HDU is read in. If a
@@ -149,8 +166,8 @@ class FITSFigure(Layers, Regions, Deprecated):
 
         north : str, optional
             Whether to rotate the image so that the North Celestial
-            Pole is up. Note that this option requires Montage to be
-            installed.
+            Pole is up. The image is reprojected with bilinear
+            interpolation, using several threads for large images.
 
         convention : str, optional
             This is used in cases where a FITS header can be interpreted
@@ -172,6 +189,21 @@ class FITSFigure(Layers, Regions, Deprecated):
             plotting method is called. This can also be set using the
             set_auto_refresh method.
 
+        combine : str, optional
+            If a list of FITS files is given, whether to combine overlapping
+            images with their 'mean' or 'median'.
+
+        collapse : str, optional
+            If a cube is given, collapse it along the only dimension not
+            shown with more than one pixel, and show the resulting image. This can be one of
+            'sum', 'mean', 'max', 'moment0', 'moment1' or 'moment2' (see
+            `~aplpy_wrapper.collapse.collapse`). The cube is read in chunks
+            of channels, so it is never loaded into memory at once.
+
+        channels : tuple, optional
+            If collapse is set, the range of channels (start, stop) to
+            collapse, as 0-based indices with stop excluded.
+
         kwargs
             Any additional arguments are passed on to matplotlib's Figure()
             class. For example, to set the figure size, use the
@@ -235,6 +267,19 @@ class FITSFigure(Layers, Regions, Deprecated):
             data.nx = nx
             data.ny = ny
 
+        self.coverage = None
+        if isinstance(data, (list, tuple)):
+            data, self.coverage = mosaic.mosaic(data, hdu=hdu, combine=combine)
+            hdu = 0
+
+        if collapse is not None:
+            data = collapse_util.collapse(data, collapse, hdu=hdu, channels=channels,
+                                          dimensions=dimensions, slices=slices,
+                                          convention=convention)
+            hdu = 0
+            dimensions, slices = [0, 1], []
+            self.grid_type = 'lines'
+
         if isinstance(data, WCS_TYPES):
             wcs = data
             if not hasattr(wcs, 'naxis1'):
@@ -251,7 +296,7 @@ class FITSFigure(Layers, Regions, Deprecated):
             ny = header['NAXIS%i' % (dimensions[1] + 1)]
             self._data = np.zeros((ny, nx), dtype=float)
             self._header = header
-            self._wcs = wcs_util.WCS(header, dimensions=dimensions, slices=slices, relax=True)
+            self._wcs = wcs_util.get_wcs(header, dimensions=dimensions, slices=slices)
             self._wcs.nx = nx
             self._wcs.ny = ny
             if downsample:
@@ -263,17 +308,14 @@ class FITSFigure(Layers, Regions, Deprecated):
         else:
             self._data, self._header, self._wcs, self._wcsaxes_slices = self._get_hdu(data, hdu, north, convention=convention,
                           dimensions=dimensions,
-                          slices=slices)
+                          slices=slices, keep_cube=True)
             self._wcs.nx = self._header['NAXIS%i' % (dimensions[0] + 1)]
             self._wcs.ny = self._header['NAXIS%i' % (dimensions[1] + 1)]
 
         # Downsample if requested
+        self._downsample = downsample
         if downsample:
-            nx_new = self._wcs.nx - np.mod(self._wcs.nx, downsample)
-            ny_new = self._wcs.ny - np.mod(self._wcs.ny, downsample)
-            self._data = self._data[0:ny_new, 0:nx_new]
-            self._data = image_util.resample(self._data, downsample)
-            self._wcs.nx, self._wcs.ny = nx_new, ny_new
+            self._downsample_data()
 
         # Open the figure
         if figure:
@@ -340,17 +382,124 @@ class FITSFigure(Layers, Regions, Deprecated):
         # Initialize layers list
         self._initialize_layers()
 
-        # Find generating function for vmin/vmax
-        self._auto_v = image_util.percentile_function(self._data)
+        # Contour geometries, which are re-used when the same data is
+        # contoured again with a different style, and images reprojected
+        # onto the pixel grid of this figure. The data version is
+        # incremented whenever the image data changes.
+        self._contour_cache = OrderedDict()
+        self._reproject_cache = OrderedDict()
+        self._data_version = 0
+
+        # The generating function for vmin/vmax is computed when first needed
+        self._auto_v_function = None
 
         # Set image holder to be empty
         self.image = None
+        self._image_smooth = None
 
         # Set default theme
         self.set_theme(theme='pretty')
 
+    def _downsample_data(self):
+        nx_new = self._wcs.nx - np.mod(self._wcs.nx, self._downsample)
+        ny_new = self._wcs.ny - np.mod(self._wcs.ny, self._downsample)
+        self._data = self._data[0:ny_new, 0:nx_new]
+        self._data = image_util.resample(self._data, self._downsample)
+        self._wcs = self._wcs.mutable_copy()
+        self._wcs.nx, self._wcs.ny = nx_new, ny_new
+
+    @property
+    def _auto_v(self):
+        # The generating function for vmin/vmax, for the current data
+        if self._auto_v_function is None:
+            self._auto_v_function = image_util.percentile_function(self._data)
+        return self._auto_v_function
+
+    def _cube_statistics(self):
+        '''
+        Return the percentiles of the whole cube and of each slice, computed
+        when first needed (or read from the statistics file saved next to
+        the FITS file).
+        '''
+        if self._cube_stats is None:
+            filename, hdu = self._cube_source or (None, 0)
+            self._cube_stats = cube_stats.cube_statistics(self._slicer, filename=filename,
+                                                          hdu=hdu, dimensions=self._dimensions)
+        return self._cube_stats
+
+    # @auto_refresh
+    def set_slice(self, slices):
+        '''
+        Show a different slice of the cube.
+
+        The new slice is extracted from the cube read in when the figure
+        was created (without reading the file again), and the image, the
+        pixel-to-world transformation of the slice, and contour layers from
+        other images are updated in place. The axes, ticks, labels, and
+        other layers are kept, as is the current stretch of the image.
+        Slices adjacent to the new one are loaded in a background thread,
+        so that stepping through the cube is fast. The thread exits when it
+        is idle, and close() releases the slices it has loaded.
+
+        If the world coordinates of the displayed axes depend on the
+        slice (for example for a position-velocity image sliced along
+        declination), the coordinates of the axes are rebuilt for the new
+        slice, and the theme and grid are applied again, but other
+        settings of the ticks and labels are reset.
+
+        Parameters
+        ----------
+
+        slices : int or tuple or list
+            The slices to extract, in the same form as the slices=
+            argument of FITSFigure.
+        '''
+
+        if getattr(self, '_slicer', None) is None:
+            raise Exception("set_slice can only be used for figures created from data with more than two dimensions")
+
+        if type(slices) == int:
+            slices = [slices]
+        slices = list(slices)
+
+        self._slicer.check(slices)
+
+        self._data = self._slicer.get(slices)
+        self._slices = slices
+        old_wcs = self._wcs
+        self._wcs = wcs_util.get_wcs(self._header, dimensions=self._dimensions,
+                                     slices=slices)
+        self._wcsaxes_slices = slicer.get_wcsaxes_slices(self._dimensions, slices)
+
+        # The axes only need to be updated if the world coordinates of the
+        # displayed axes change with the slice
+        xp, yp = np.meshgrid(np.linspace(0.5, old_wcs.nx + 0.5, 5),
+                             np.linspace(0.5, old_wcs.ny + 0.5, 5))
+        xp, yp = xp.ravel(), yp.ravel()
+        if not np.allclose(wcs_util._pix2world_nd(old_wcs, xp, yp),
+                           wcs_util._pix2world_nd(self._wcs, xp, yp), equal_nan=True):
+            self.ax.reset_wcs(self._wcs, slices=self._wcsaxes_slices)
+            self.set_theme(self._theme)
+            if hasattr(self, 'grid'):
+                self.grid.show()
+
+        if self._downsample:
+            self._downsample_data()
+
+        self._auto_v_function = None
+        self._data_version += 1
+
+        if self.image is not None and self._image_smooth is not None:
+            smooth, kernel = self._image_smooth
+            self.image.set_data(convolve_util.convolve(self._data, smooth=smooth,
+                                                       kernel=kernel))
+
+        self._update_contours()
+
     def _get_hdu(self, data, hdu, north, convention=None, dimensions=[0, 1],
-                 slices=[]):
+                 slices=[], keep_cube=False):
+
+        source = (data, hdu) if isinstance(data, basestring) else None
 
         if isinstance(data, basestring):
 
@@ -411,13 +560,7 @@ class FITSFigure(Layers, Regions, Deprecated):
 
         # Reproject to face north if requested
         if north:
-            try:
-                import montage_wrapper as montage
-            except ImportError:
-                raise Exception("Both the Montage command-line tools and the"
-                                " montage-wrapper Python module are required"
-                                " to use the north= argument")
-            hdu = montage.reproject_hdu(hdu, north_aligned=True)
+            hdu = reproject_util.reproject_north(hdu)
 
         # Now copy the data and header to new objects, since in PyFITS the two
         # attributes are linked, which can lead to confusing behavior. We just
@@ -437,6 +580,17 @@ class FITSFigure(Layers, Regions, Deprecated):
                 slices = [0 for i in range(1, len(shape) - 1)]
                 log.info("Setting slices=%s" % str(slices))
 
+        # Keep the cube for set_slice, which extracts other slices from it
+        if keep_cube:
+            if len(shape) > 2:
+                self._slicer = slicer.SlicePrefetcher(data, header, dimensions=dimensions)
+            else:
+                self._slicer = None
+            self._dimensions = list(dimensions)
+            self._slices = list(slices)
+            self._cube_source = source
+            self._cube_stats = None
+
         # Extract slices
         x, y, data, wcsaxes_slices = slicer.slice_hypercube(data, header, dimensions=dimensions, slices=slices)
 
@@ -447,7 +601,7 @@ class FITSFigure(Layers, Regions, Deprecated):
         header = header_util.check(header, convention=convention, dimensions=dimensions)
 
         # Parse WCS info
-        wcs = wcs_util.WCS(header, dimensions=dimensions, slices=slices, relax=True)
+        wcs = wcs_util.get_wcs(header, dimensions=dimensions, slices=slices)
 
         return data, header, wcs, wcsaxes_slices
 
@@ -549,7 +703,7 @@ class FITSFigure(Layers, Regions, Deprecated):
                        pmin=0.25, pmax=99.75,
                        stretch='linear', exponent=2, invert='default',
                        smooth=None, kernel='gauss', aspect='equal',
-                       interpolation='nearest'):
+                       interpolation='nearest', limits='slice'):
         '''
         Show a grayscale image of the FITS file.
 
@@ -613,6 +767,14 @@ class FITSFigure(Layers, Regions, Deprecated):
             will be output at native resolution irrespective of the dpi
             setting), 'bilinear', 'bicubic', and many more (see the
             matplotlib documentation for imshow).
+
+        limits : { 'slice', 'cube' }, optional
+            For figures showing a slice of a cube, whether pmin and pmax
+            are percentiles of the values in the current slice ('slice';
+            default), or of the whole cube ('cube'). The percentiles of the
+            cube are computed once, from a sample of each slice, and saved
+            next to the FITS file, so that the stretch does not change when
+            moving between slices with set_slice.
         '''
 
         if invert == 'default':
@@ -627,7 +789,7 @@ class FITSFigure(Layers, Regions, Deprecated):
                              pmin=pmin, pmax=pmax,
                              stretch=stretch, exponent=exponent, cmap=cmap,
                              smooth=smooth, kernel=kernel, aspect=aspect,
-                             interpolation=interpolation)
+                             interpolation=interpolation, limits=limits)
 
     # @auto_refresh
     def hide_grayscale(self, *args, **kwargs):
@@ -637,7 +799,7 @@ class FITSFigure(Layers, Regions, Deprecated):
     def show_colorscale(self, vmin=None, vmid=None, vmax=None,
                         pmin=0.25, pmax=99.75, stretch='linear', exponent=2,
                         cmap='default', smooth=None, kernel='gauss',
-                        aspect='equal', interpolation='nearest'):
+                        aspect='equal', interpolation='nearest', limits='slice'):
         '''
         Show a colorscale image of the FITS file.
 
@@ -699,8 +861,26 @@ class FITSFigure(Layers, Regions, Deprecated):
             will be output at native resolution irrespective of the dpi
             setting), 'bilinear', 'bicubic', and many more (see the
             matplotlib documentation for imshow).
+
+        limits : { 'slice', 'cube' }, optional
+            For figures showing a slice of a cube, whether pmin and pmax
+            are percentiles of the values in the current slice ('slice';
+            default), or of the whole cube ('cube'). The percentiles of the
+            cube are computed once, from a sample of each slice, and saved
+            next to the FITS file, so that the stretch does not change when
+            moving between slices with set_slice.
         '''
 
+        if limits not in ['slice', 'cube']:
+            raise ValueError("limits should be one of 'slice' or 'cube'")
+
+        if limits == 'cube':
+            if getattr(self, '_slicer', None) is None:
+                raise Exception("limits='cube' can only be used for figures created from data with more than two dimensions")
+            auto_v = self._cube_statistics().percentile_function()
+        else:
+            auto_v = self._auto_v
+
         if cmap == 'default':
             cmap = self._get_colormap_default()
 
@@ -711,30 +891,31 @@ class FITSFigure(Layers, Regions, Deprecated):
         cmap = mpl.cm.get_cmap(cmap)
 
         if min_auto:
-            vmin = self._auto_v(pmin)
+            vmin = auto_v(pmin)
 
         if max_auto:
-            vmax = self._auto_v(pmax)
+            vmax = auto_v(pmax)
 
         # Prepare normalizer object
         normalizer = APLpyNormalize(stretch=stretch, exponent=exponent,
                                     vmid=vmid, vmin=vmin, vmax=vmax)
 
         # Adjust vmin/vmax if auto
+        vmin, vmax = image_util.auto_limits(vmin, vmax, stretch,
+                                            min_auto=min_auto, max_auto=max_auto)
+
         if min_auto:
-            if stretch == 'linear':
-                vmin = -0.1 * (vmax - vmin) + vmin
             log.info("Auto-setting vmin to %10.3e" % vmin)
 
         if max_auto:
-            if stretch == 'linear':
-                vmax = 0.1 * (vmax - vmin) + vmax
             log.info("Auto-setting vmax to %10.3e" % vmax)
 
         # Update normalizer object
         normalizer.vmin = vmin
         normalizer.vmax = vmax
 
+        self._image_smooth = (smooth, kernel)
+
         if self.image:
             self.image.set_visible(True)
             self.image.set_norm(normalizer)
@@ -839,7 +1020,9 @@ class FITSFigure(Layers, Regions, Deprecated):
     def show_contour(self, data=None, hdu=0, layer=None, levels=5,
                      filled=False, cmap=None, colors=None, returnlevels=False,
                      convention=None, dimensions=[0, 1], slices=[],
-                     smooth=None, kernel='gauss', overlap=False, **kwargs):
+                     smooth=None, kernel='gauss', overlap=False, threads=None,
+                     simplify=None, resolution=None, refine=False,
+                     reproject=False, **kwargs):
         '''
         Overlay contours on the current plot.
 
@@ -919,6 +1102,44 @@ class FITSFigure(Layers, Regions, Deprecated):
             reduces file size when using a file for the contours covering
             a much larger area than the image.
 
+        threads : int, optional
+            The number of threads used to compute each contour level. By
+            default, all the available processors are used for large images
+            (and a single thread otherwise). This requires the contourpy
+            package.
+
+        simplify : float, optional
+            If specified, the contour paths are simplified with the
+            Douglas-Peucker algorithm, removing vertices which deviate from
+            the simplified paths by less than this many pixels (of the
+            contoured image). This greatly reduces the size of vector output
+            for contours of noisy data.
+
+        resolution : int or 'auto', optional
+            If specified, the contours are computed on a version of the
+            image reduced in resolution by averaging blocks of this many
+            pixels across. If set to 'auto', the reduction is chosen so
+            that the reduced image has about as many pixels as are used to
+            display it. This is much faster for large images.
+
+        refine : bool, optional
+            If resolution is specified, compute the contours at full
+            resolution instead, but only in the parts of the image which
+            contain contours. The image is divided into tiles whose size is
+            set by the reduction factor, and only the tiles whose range of
+            values (at full resolution) includes a contour level are
+            contoured.
+
+        reproject : bool or str, optional
+            If data is specified, reproject it onto the pixel grid of the
+            displayed image before computing the contours, rather than
+            transforming the contours from the pixel grid of the contoured
+            image. This can be 'nearest', 'bilinear' (the default if True
+            is given), or 'flux'. The reprojection is done in tiles, in
+            parallel for large images, and the result is re-used when the
+            same file is contoured again. The smoothing and resolution
+            options then apply to the reprojected image.
+
         kwargs
             Additional keyword arguments (such as alpha, linewidths, or
             linestyles) will be passed on directly to Matplotlib's
@@ -936,37 +1157,83 @@ class FITSFigure(Layers, Regions, Deprecated):
         elif not colors:
             cmap = mpl.cm.get_cmap('jet')
 
-        if data is not None:
-            data_contour, header_contour, wcs_contour, wcsaxes_slices = self._get_hdu(data,
-                hdu, False, convention=convention, dimensions=dimensions,
-                slices=slices)
-        else:
-            data_contour = self._data
-            header_contour = self._header
-            wcs_contour = self._wcs
+        if data is None or reproject is False:
+            reproject = None
+        elif reproject is True:
+            reproject = 'bilinear'
 
-        wcs_contour.nx = header_contour['NAXIS%i' % (dimensions[0] + 1)]
-        wcs_contour.ny = header_contour['NAXIS%i' % (dimensions[1] + 1)]
+        key = self._contour_key(data, hdu, convention, dimensions, slices,
+                                smooth, kernel, levels, filled, resolution,
+                                refine, reproject)
 
-        image_contour = convolve_util.convolve(data_contour, smooth=smooth, kernel=kernel)
-        extent_contour = (0.5, wcs_contour.nx + 0.5, 0.5, wcs_contour.ny + 0.5)
+        if key is not None and key in self._contour_cache:
+
+            # The geometry has already been computed for the same data,
+            # smoothing and levels, so only the style has changed
+            geometry = self._contour_cache.pop(key)
+            self._contour_cache[key] = geometry
 
-        if type(levels) == int:
-            auto_levels = image_util.percentile_function(image_contour)
-            vmin = auto_levels(0.25)
-            vmax = auto_levels(99.75)
-            levels = np.linspace(vmin, vmax, levels)
-
-        if filled:
-            c = self.ax.contourf(image_contour, levels,
-                                 transform=self.ax.get_transform(wcs_contour),
-                                 extent=extent_contour,
-                                 cmap=cmap, colors=colors, **kwargs)
         else:
-            c = self.ax.contour(image_contour, levels,
-                                transform=self.ax.get_transform(wcs_contour),
-                                extent=extent_contour,
-                                cmap=cmap, colors=colors, **kwargs)
+
+            if reproject is not None:
+                data_contour = self._reprojected(data, hdu, convention,
+                                                 dimensions, slices, reproject,
+                                                 threads)
+                wcs_contour = self._wcs
+            elif data is not None:
+                data_contour, header_contour, wcs_contour, wcsaxes_slices = self._get_hdu(data,
+                    hdu, False, convention=convention, dimensions=dimensions,
+                    slices=slices)
+                wcs_contour.nx = header_contour['NAXIS%i' % (dimensions[0] + 1)]
+                wcs_contour.ny = header_contour['NAXIS%i' % (dimensions[1] + 1)]
+            else:
+                data_contour = self._data
+                wcs_contour = self._wcs
+
+            image_contour = convolve_util.convolve(data_contour, smooth=smooth, kernel=kernel)
+
+            if type(levels) == int:
+                auto_levels = image_util.percentile_function(image_contour)
+                vmin = auto_levels(0.25)
+                vmax = auto_levels(99.75)
+                levels = np.linspace(vmin, vmax, levels)
+
+            # Compute the contours in the pixel frame of the contoured image.
+            # If this is a different image, the vertices are transformed to
+            # the pixel frame of the displayed image once, rather than on
+            # every draw.
+            if resolution == 'auto':
+                factor = contour_util.auto_factor(image_contour, self.ax)
+            else:
+                factor = resolution or 1
+
+            if factor > 1 and refine:
+                allsegs, allkinds = contour_util.contour_refined(image_contour, levels, factor,
+                                                                 filled=filled, ax=self.ax)
+            elif factor > 1:
+                allsegs, allkinds = contour_util.contour_reduced(image_contour, levels, factor,
+                                                                 filled=filled, ax=self.ax,
+                                                                 threads=threads)
+            else:
+                allsegs, allkinds = contour_util.contour_segments(image_contour, levels,
+                                                                  filled=filled, ax=self.ax,
+                                                                  threads=threads)
+            geometry = contour_util.ContourGeometry(levels, allsegs, allkinds,
+                                                    filled, wcs_contour)
+
+            if key is not None:
+                self._contour_cache[key] = geometry
+                while len(self._contour_cache) > contour_util.CACHE_SIZE:
+                    self._contour_cache.popitem(last=False)
+
+        geometry = geometry.simplified(simplify)
+
+        levels = geometry.levels
+
+        style = dict(cmap=cmap, colors=colors,
+                     extent=self._extent if overlap else None, **kwargs)
+        c = geometry.contour_set(self.ax, self._wcs, **style)
+
         # Need to add this otherwise figure's shape changes to fit in everything
         # of the contour
         self.ax.set_xlim(0, self._data.shape[self.x])
@@ -975,14 +1242,147 @@ class FITSFigure(Layers, Regions, Deprecated):
         if layer:
             contour_set_name = layer
         else:
-            self._contour_counter += 1
-            contour_set_name = 'contour_set_' + str(self._contour_counter)
+            contour_set_name = self._layers.next_name('contour_set')
 
-        self._layers[contour_set_name] = c
+        self._layers.add(contour_set_name, c, geometry=geometry, style=style)
 
         if returnlevels:
             return levels
 
+    def _data_key(self, data, hdu, convention, dimensions, slices):
+        '''
+        Return a key identifying contoured data, or None for data given as
+        arrays or HDU objects.
+        '''
+        if data is None:
+            return ('figure', self._data_version)
+        elif isinstance(data, basestring) and os.path.exists(data):
+            return (os.path.abspath(data), os.path.getmtime(data), hdu,
+                    convention, tuple(dimensions), tuple(slices))
+        else:
+            return None
+
+    def _contour_key(self, data, hdu, convention, dimensions, slices,
+                     smooth, kernel, levels, filled, resolution, refine,
+                     reproject):
+        '''
+        Return the key identifying the geometry of a contour layer in the
+        contour cache, or None if the geometry cannot be cached (for data
+        given as arrays or HDU objects, or for custom kernels).
+        '''
+
+        data_key = self._data_key(data, hdu, convention, dimensions, slices)
+        if data_key is None:
+            return None
+
+        # Reprojected data depend on the pixel grid of the displayed image
+        if reproject is not None:
+            data_key = (data_key, reproject, self._data_version)
+
+        if not isinstance(kernel, basestring):
+            return None
+
+        if type(levels) == int:
+            levels_key = levels
+        else:
+            levels_key = tuple(np.atleast_1d(levels).tolist())
+
+        return (data_key, smooth, kernel, levels_key, bool(filled),
+                resolution, bool(refine))
+
+    def _reprojected(self, data, hdu, convention, dimensions, slices, mode,
+                     threads):
+        '''
+        Return an image reprojected onto the pixel grid of the displayed
+        image, re-using a previous reprojection of the same file if possible.
+        '''
+
+        key = self._data_key(data, hdu, convention, dimensions, slices)
+        if key is not None:
+            key = (key, mode, self._data_version)
+            if key in self._reproject_cache:
+                image = self._reproject_cache.pop(key)
+                self._reproject_cache[key] = image
+                return image
+
+        data_contour, header_contour, wcs_contour, wcsaxes_slices = self._get_hdu(data,
+            hdu, False, convention=convention, dimensions=dimensions,
+            slices=slices)
+
+        image = reproject_util.reproject(data_contour, wcs_contour, self._wcs,
+                                         (self._wcs.ny, self._wcs.nx),
+                                         mode=mode, threads=threads)
+
+        if key is not None:
+            self._reproject_cache[key] = image
+            while len(self._reproject_cache) > reproject_util.CACHE_SIZE:
+                self._reproject_cache.popitem(last=False)
+
+        return image
+
+    def _update_contours(self):
+        '''
+        Re-transform the contour layers computed from other images, if the
+        WCS of the displayed image has changed since they were drawn.
+        '''
+        for record in self._layers.records():
+            if record.geometry is None or not record.geometry.needs_update(self._wcs):
+                continue
+            if record.style.get('extent') is not None:
+                record.style['extent'] = self._extent
+            self._restyle_contour(record, {})
+
+    def _restyle_contour(self, record, style):
+        visible = record.get_visible()
+        record.remove()
+        record.style.update(style)
+        record.set_artist(record.geometry.contour_set(self.ax, self._wcs,
+                                                      **record.style))
+        record.set_visible(visible)
+
+    # @auto_refresh
+    def set_contour_style(self, layer, cmap=None, colors=None, **kwargs):
+        '''
+        Change the colors or style of a contour layer in place.
+
+        The contours are not re-computed, and the layer keeps its name and
+        position in the list of layers.
+
+        Parameters
+        ----------
+
+        layer : str
+            The name of the contour layer
+
+        cmap : str, optional
+            The colormap to use for the contours
+
+        colors : str or tuple, optional
+            The color or colors of the contours. This overrides cmap.
+
+        kwargs
+            Additional keyword arguments (such as alpha, linewidths, or
+            linestyles) are passed on to the Matplotlib ContourSet.
+        '''
+
+        if layer not in self._layers:
+            raise Exception("Layer " + layer + " does not exist")
+
+        record = self._layers.record(layer)
+
+        if record.geometry is None:
+            raise Exception("Layer " + layer + " is not a contour layer")
+
+        style = dict(kwargs)
+        if cmap:
+            style['cmap'] = mpl.cm.get_cmap(cmap)
+            style['colors'] = None
+        if colors:
+            style['cmap'] = None
+            style['colors'] = colors
+
+        self._restyle_contour(record, style)
+
     # This method plots markers. The input should be an Nx2 array with WCS coordinates
     # in degree format.
 
@@ -1028,15 +1428,15 @@ class FITSFigure(Layers, Regions, Deprecated):
         if layer:
             marker_set_name = layer
         else:
-            self._scatter_counter += 1
-            marker_set_name = 'marker_set_' + str(self._scatter_counter)
+            marker_set_name = self._layers.next_name('marker_set')
 
         self._layers[marker_set_name] = s
 
     # Show circles. Different from markers as this method allows more definitions
     # for the circles.
     # @auto_refresh
-    def show_circles(self, xw, yw, radius, layer=False, zorder=None, **kwargs):
+    def show_circles(self, xw, yw, radius, layer=False, zorder=None,
+                     lod=None, lod_mode='points', **kwargs):
         '''
         Overlay circles on the current plot.
 
@@ -1057,6 +1457,16 @@ class FITSFigure(Layers, Regions, Deprecated):
             custom names to layers (instead of circle_set_n) and for
             replacing existing layers.
 
+        lod : float, optional
+            If specified, the circles are shown as a level-of-detail layer:
+            Circles that appear smaller than this number of screen pixels are
+            drawn as points (or as a density image), and only the circles
+            within the current view are drawn as true shapes. The
+            representation is updated whenever the view changes.
+
+        lod_mode : { 'points', 'density' }, optional
+            How to draw the circles that are smaller than lod pixels.
+
         kwargs
             Additional keyword arguments (such as facecolor, edgecolor, alpha,
             or linewidth) are passed to Matplotlib
@@ -1088,13 +1498,186 @@ class FITSFigure(Layers, Regions, Deprecated):
         xp, yp = wcs_util.world2pix(self._wcs, xw, yw)
         rp = 3600.0 * radius / wcs_util.arcperpix(self._wcs)
 
-        patches = []
-        for i in range(len(xp)):
-            patches.append(Circle((xp[i], yp[i]), radius=rp[i]))
+        if lod is not None:
+            c = LevelOfDetail(self.ax, 'ellipse', xp, yp, 2. * rp, 2. * rp,
+                              threshold=lod, mode=lod_mode, zorder=zorder,
+                              **kwargs)
+        else:
+            patches = []
+            for i in range(len(xp)):
+                patches.append(Circle((xp[i], yp[i]), radius=rp[i]))
 
-        # Due to bugs in matplotlib, we need to pass the patch properties
-        # directly to the PatchCollection rather than use match_original.
-        p = PatchCollection(patches, **kwargs)
+            # Due to bugs in matplotlib, we need to pass the patch properties
+            # directly to the PatchCollection rather than use match_original.
+            p = PatchCollection(patches, **kwargs)
+
+            if zorder is not None:
+                p.zorder = zorder
+            c = self.ax.add_collection(p)
+
+        if layer:
+            circle_set_name = layer
+        else:
+            circle_set_name = self._layers.next_name('circle_set')
+
+        self._layers[circle_set_name] = c
+
+    def _stream_table(self, table, columns, chunk_size, hdu, radius_column=None,
+                      margin=0.):
+        '''
+        Iterate over a catalog in chunks, yielding the pixel positions (and
+        any extra columns) of the rows that fall within the image footprint.
+
+        The first two columns are the world coordinates of the sources. The
+        footprint is padded by margin pixels, and if radius_column is given,
+        by the radius (in degrees) of each source, read from the column with
+        this index.
+        '''
+
+        for chunk in catalog.iter_table(table, columns, chunk_size=chunk_size, hdu=hdu):
+
+            xp, yp = wcs_util.world2pix(self._wcs, chunk[0], chunk[1])
+
+            pad = margin
+            if radius_column is not None:
+                pad = pad + 3600.0 * chunk[radius_column] / wcs_util.arcperpix(self._wcs)
+
+            keep = catalog.in_footprint(xp, yp, self._extent, margin=pad)
+
+            yield [xp[keep], yp[keep]] + [values[keep] for values in chunk[2:]]
+
+    # @auto_refresh
+    def show_table_markers(self, table, xcol, ycol, chunk_size=100000, hdu=1,
+                           layer=False, **kwargs):
+        '''
+        Overlay markers for the sources in a FITS or CSV table.
+
+        The table is read in chunks of rows, so that memory usage is bounded
+        by the chunk size rather than by the size of the table. Each chunk
+        is converted to pixel coordinates in a single call, and only the
+        sources falling within the image are kept.
+
+        Parameters
+        ----------
+
+        table : str
+            The path to a FITS binary table or a CSV file with a header line
+            containing the column names
+
+        xcol, ycol : str
+            The names of the columns containing the x and y positions of the
+            markers (in world coordinates)
+
+        chunk_size : int, optional
+            The number of rows to read at a time
+
+        hdu : int, optional
+            The HDU containing the table, for FITS files
+
+        layer : str, optional
+            The name of the scatter layer. This is useful for giving
+            custom names to layers (instead of marker_set_n) and for
+            replacing existing layers.
+
+        kwargs
+            Additional keyword arguments are passed on to
+            :meth:`~aplpy_wrapper.aplpy.FITSFigure.show_markers`
+        '''
+
+        xp, yp = [], []
+        for chunk_xp, chunk_yp in self._stream_table(table, [xcol, ycol],
+                                                     chunk_size, hdu):
+            xp.append(chunk_xp)
+            yp.append(chunk_yp)
+
+        if len(xp) > 0:
+            xp, yp = np.concatenate(xp), np.concatenate(yp)
+        else:
+            xp, yp = np.array([]), np.array([])
+
+        if 'c' not in kwargs:
+            kwargs.setdefault('edgecolor', 'red')
+            kwargs.setdefault('facecolor', 'none')
+
+        kwargs.setdefault('s', 30)
+
+        if layer:
+            self.remove_layer(layer, raise_exception=False)
+
+        s = self.ax.scatter(xp, yp, **kwargs)
+
+        if layer:
+            marker_set_name = layer
+        else:
+            marker_set_name = self._layers.next_name('marker_set')
+
+        self._layers[marker_set_name] = s
+
+    # @auto_refresh
+    def show_table_circles(self, table, xcol, ycol, rcol, chunk_size=100000,
+                           hdu=1, layer=False, zorder=None, **kwargs):
+        '''
+        Overlay circles for the sources in a FITS or CSV table.
+
+        The table is read in chunks of rows, and only the circles that
+        overlap with the image are kept. The circles are stored as arrays in
+        a single :class:`~matplotlib.collections.EllipseCollection` rather
+        than as individual patches.
+
+        Parameters
+        ----------
+
+        table : str
+            The path to a FITS binary table or a CSV file with a header line
+            containing the column names
+
+        xcol, ycol : str
+            The names of the columns containing the x and y positions of the
+            centers of the circles (in world coordinates)
+
+        rcol : str
+            The name of the column containing the radii of the circles (in
+            world coordinates)
+
+        chunk_size : int, optional
+            The number of rows to read at a time
+
+        hdu : int, optional
+            The HDU containing the table, for FITS files
+
+        layer : str, optional
+            The name of the circle layer. This is useful for giving
+            custom names to layers (instead of circle_set_n) and for
+            replacing existing layers.
+
+        kwargs
+            Additional keyword arguments (such as facecolor, edgecolor, alpha,
+            or linewidth) are passed to Matplotlib
+            :class:`~matplotlib.collections.EllipseCollection` class, and can
+            be used to control the appearance of the circles.
+        '''
+
+        xp, yp, rp = [], [], []
+        for chunk_xp, chunk_yp, chunk_rw in self._stream_table(table, [xcol, ycol, rcol],
+                                                               chunk_size, hdu, radius_column=2):
+            xp.append(chunk_xp)
+            yp.append(chunk_yp)
+            rp.append(3600.0 * chunk_rw / wcs_util.arcperpix(self._wcs))
+
+        if len(xp) > 0:
+            xp, yp, rp = np.concatenate(xp), np.concatenate(yp), np.concatenate(rp)
+        else:
+            xp, yp, rp = np.array([]), np.array([]), np.array([])
+
+        if 'facecolor' not in kwargs:
+            kwargs.setdefault('facecolor', 'none')
+
+        if layer:
+            self.remove_layer(layer, raise_exception=False)
+
+        p = EllipseCollection(2. * rp, 2. * rp, np.zeros(len(rp)), units='xy',
+                              offsets=np.column_stack((xp, yp)),
+                              transOffset=self.ax.transData, **kwargs)
 
         if zorder is not None:
             p.zorder = zorder
@@ -1103,14 +1686,13 @@ class FITSFigure(Layers, Regions, Deprecated):
         if layer:
             circle_set_name = layer
         else:
-            self._circle_counter += 1
-            circle_set_name = 'circle_set_' + str(self._circle_counter)
+            circle_set_name = self._layers.next_name('circle_set')
 
         self._layers[circle_set_name] = c
 
     # @auto_refresh
     def show_ellipses(self, xw, yw, width, height, angle=0, layer=False,
-                      zorder=None, **kwargs):
+                      zorder=None, lod=None, lod_mode='points', **kwargs):
         '''
         Overlay ellipses on the current plot.
 
@@ -1138,6 +1720,16 @@ class FITSFigure(Layers, Regions, Deprecated):
             custom names to layers (instead of ellipse_set_n) and for
             replacing existing layers.
 
+        lod : float, optional
+            If specified, the ellipses are shown as a level-of-detail layer:
+            Ellipses that appear smaller than this number of screen pixels are
+            drawn as points (or as a density image), and only the ellipses
+            within the current view are drawn as true shapes. The
+            representation is updated whenever the view changes.
+
+        lod_mode : { 'points', 'density' }, optional
+            How to draw the ellipses that are smaller than lod pixels.
+
         kwargs
             Additional keyword arguments (such as facecolor, edgecolor, alpha,
             or linewidth) are passed to Matplotlib
@@ -1181,29 +1773,33 @@ class FITSFigure(Layers, Regions, Deprecated):
         hp = 3600.0 * height / wcs_util.arcperpix(self._wcs)
         ap = angle
 
-        patches = []
-        for i in range(len(xp)):
-            patches.append(Ellipse((xp[i], yp[i]), width=wp[i], height=hp[i], angle=ap[i]))
+        if lod is not None:
+            c = LevelOfDetail(self.ax, 'ellipse', xp, yp, wp, hp, angle=ap,
+                              threshold=lod, mode=lod_mode, zorder=zorder,
+                              **kwargs)
+        else:
+            patches = []
+            for i in range(len(xp)):
+                patches.append(Ellipse((xp[i], yp[i]), width=wp[i], height=hp[i], angle=ap[i]))
 
-        # Due to bugs in matplotlib, we need to pass the patch properties
-        # directly to the PatchCollection rather than use match_original.
-        p = PatchCollection(patches, **kwargs)
+            # Due to bugs in matplotlib, we need to pass the patch properties
+            # directly to the PatchCollection rather than use match_original.
+            p = PatchCollection(patches, **kwargs)
 
-        if zorder is not None:
-            p.zorder = zorder
-        c = self.ax.add_collection(p)
+            if zorder is not None:
+                p.zorder = zorder
+            c = self.ax.add_collection(p)
 
         if layer:
             ellipse_set_name = layer
         else:
-            self._ellipse_counter += 1
-            ellipse_set_name = 'ellipse_set_' + str(self._ellipse_counter)
+            ellipse_set_name = self._layers.next_name('ellipse_set')
 
         self._layers[ellipse_set_name] = c
 
     # @auto_refresh
     def show_rectangles(self, xw, yw, width, height, layer=False, zorder=None,
-                        **kwargs):
+                        lod=None, lod_mode='points', **kwargs):
         '''
         Overlay rectangles on the current plot.
 
@@ -1227,6 +1823,16 @@ class FITSFigure(Layers, Regions, Deprecated):
             custom names to layers (instead of rectangle_set_n) and for
             replacing existing layers.
 
+        lod : float, optional
+            If specified, the rectangles are shown as a level-of-detail layer:
+            Rectangles that appear smaller than this number of screen pixels are
+            drawn as points (or as a density image), and only the rectangles
+            within the current view are drawn as true shapes. The
+            representation is updated whenever the view changes.
+
+        lod_mode : { 'points', 'density' }, optional
+            How to draw the rectangles that are smaller than lod pixels.
+
         kwargs
             Additional keyword arguments (such as facecolor, edgecolor, alpha,
             or linewidth) are passed to Matplotlib
@@ -1264,25 +1870,29 @@ class FITSFigure(Layers, Regions, Deprecated):
         wp = 3600.0 * width / wcs_util.arcperpix(self._wcs)
         hp = 3600.0 * height / wcs_util.arcperpix(self._wcs)
 
-        patches = []
-        xp = xp - wp / 2.
-        yp = yp - hp / 2.
-        for i in range(len(xp)):
-            patches.append(Rectangle((xp[i], yp[i]), width=wp[i], height=hp[i]))
+        if lod is not None:
+            c = LevelOfDetail(self.ax, 'rectangle', xp, yp, wp, hp,
+                              threshold=lod, mode=lod_mode, zorder=zorder,
+                              **kwargs)
+        else:
+            patches = []
+            xp = xp - wp / 2.
+            yp = yp - hp / 2.
+            for i in range(len(xp)):
+                patches.append(Rectangle((xp[i], yp[i]), width=wp[i], height=hp[i]))
 
-        # Due to bugs in matplotlib, we need to pass the patch properties
-        # directly to the PatchCollection rather than use match_original.
-        p = PatchCollection(patches, **kwargs)
+            # Due to bugs in matplotlib, we need to pass the patch properties
+            # directly to the PatchCollection rather than use match_original.
+            p = PatchCollection(patches, **kwargs)
 
-        if zorder is not None:
-            p.zorder = zorder
-        c = self.ax.add_collection(p)
+            if zorder is not None:
+                p.zorder = zorder
+            c = self.ax.add_collection(p)
 
         if layer:
             rectangle_set_name = layer
         else:
-            self._rectangle_counter += 1
-            rectangle_set_name = 'rectangle_set_' + str(self._rectangle_counter)
+            rectangle_set_name = self._layers.next_name('rectangle_set')
 
         self._layers[rectangle_set_name] = c
 
@@ -1330,8 +1940,7 @@ class FITSFigure(Layers, Regions, Deprecated):
         if layer:
             line_set_name = layer
         else:
-            self._linelist_counter += 1
-            line_set_name = 'line_set_' + str(self._linelist_counter)
+            line_set_name = self._layers.next_name('line_set')
 
         self._layers[line_set_name] = c
 
@@ -1416,8 +2025,7 @@ class FITSFigure(Layers, Regions, Deprecated):
         if layer:
             line_set_name = layer
         else:
-            self._linelist_counter += 1
-            line_set_name = 'arrow_set_' + str(self._linelist_counter)
+            line_set_name = self._layers.next_name('arrow_set')
 
         self._layers[line_set_name] = c
 
@@ -1488,8 +2096,7 @@ class FITSFigure(Layers, Regions, Deprecated):
         if layer:
             poly_set_name = layer
         else:
-            self._poly_counter += 1
-            poly_set_name = 'poly_set_' + str(self._poly_counter)
+            poly_set_name = self._layers.next_name('poly_set')
 
         self._layers[poly_set_name] = c
 
@@ -1556,8 +2163,100 @@ class FITSFigure(Layers, Regions, Deprecated):
         if layer:
             label_name = layer
         else:
-            self._label_counter += 1
-            label_name = 'label_' + str(self._label_counter)
+            label_name = self._layers.next_name('label')
+
+        self._layers[label_name] = l
+
+    # @auto_refresh
+    @fixdocstring
+    def add_labels(self, x, y, text, relative=False, color='black',
+                   family=None, style=None, variant=None, stretch=None,
+                   weight=None, size=None, fontproperties=None,
+                   horizontalalignment='center', verticalalignment='center',
+                   cull=False, layer=None, **kwargs):
+        '''
+        Add many text labels as a single layer.
+
+        The positions are converted to pixel coordinates in a single call,
+        and all the labels are drawn by a single artist. This is much faster
+        than calling add_label for each label when labeling large catalogs.
+
+        Parameters
+        ----------
+
+        x, y : list or `~numpy.ndarray`
+            Coordinates of the text labels
+
+        text : list or `~numpy.ndarray`
+            The labels
+
+        relative : str, optional
+            Whether the coordinates are to be interpreted as world
+            coordinates (e.g. RA/Dec or longitude/latitude), or
+            coordinates relative to the axes (where 0.0 is left or bottom
+            and 1.0 is right or top).
+
+        color : str or list, optional
+            The color of the labels, or a list of colors (one per label)
+
+        common: family, style, variant, stretch, weight, size,
+                fontproperties, horizontalalignment, verticalalignment
+
+        cull : bool, optional
+            Whether to skip labels that would overlap with other labels
+            at the current zoom level. Labels earlier in the list take
+            priority.
+
+        layer : str, optional
+            The name of the label layer. This is useful for giving
+            custom names to layers (instead of label_n) and for
+            replacing existing layers.
+        '''
+
+        if layer:
+            self.remove_layer(layer, raise_exception=False)
+
+        # Can't pass fontproperties=None to text. Only pass it if it is not None.
+        if fontproperties:
+            kwargs['fontproperties'] = fontproperties
+
+        x = np.atleast_1d(np.asarray(x, dtype=float))
+        y = np.atleast_1d(np.asarray(y, dtype=float))
+
+        if np.isscalar(text):
+            text = np.repeat(text, len(x))
+        else:
+            text = np.asarray(text, dtype=object)
+
+        if len(x) != len(y) or len(x) != len(text):
+            raise Exception("x, y, and text should have the same length")
+
+        # RGB(A) tuples are single colors rather than lists of colors
+        if is_color_like(color):
+            colors = None
+        else:
+            colors, color = color, None
+
+        if relative:
+            xp, yp = x, y
+        else:
+            xp, yp = wcs_util.world2pix(self._wcs, x, y)
+
+        l = TextCollection(xp, yp, text, colors=colors, cull=cull,
+                           color=color, family=family, style=style,
+                           variant=variant, stretch=stretch, weight=weight,
+                           size=size, horizontalalignment=horizontalalignment,
+                           verticalalignment=verticalalignment, **kwargs)
+
+        if relative:
+            l.set_transform(self.ax.transAxes)
+
+        self.ax.add_artist(l)
+
+        if layer:
+            label_name = layer
+        else:
+            label_name = self._layers.next_name('label')
 
         self._layers[label_name] = l
 
@@ -1673,6 +2372,55 @@ class FITSFigure(Layers, Regions, Deprecated):
     def _get_colormap_default(self):
         return self._figure.apl_colorscale_cmap_default
 
+    def save_animation(self, filename, slices=None, limits='global',
+                       pmin=0.25, pmax=99.75, duration=100, loop=0, dpi=None,
+                       threads=None):
+        '''
+        Save an animation stepping through the slices of a cube.
+
+        The frames are drawn by this figure, with the current colorscale,
+        overlays, and layers, after which the figure is returned to the
+        current slice. show_colorscale should be called first. The frames
+        of an animated GIF are kept in memory until it is written, so long
+        animations are best saved as image sequences.
+
+        Parameters
+        ----------
+
+        filename : str
+            The name of the animated GIF file to write, or a pattern such
+            as 'frame_%03i.png' to write one image per frame
+
+        slices : list, optional
+            The slices to show in each frame, in the same form as the
+            slices= argument of FITSFigure. By default, all the slices
+            along the first sliced dimension are shown.
+
+        limits : { 'global', 'frame', 'current' }, optional
+            Whether to use a stretch computed from the pmin and pmax
+            percentiles of all the frames ('global'), of each frame
+            ('frame'), or the current stretch of the image ('current').
+
+        pmin, pmax : float, optional
+            The percentiles used for the limits of the stretch
+
+        duration : float, optional
+            The duration of each frame of an animated GIF, in milliseconds
+
+        loop : int, optional
+            The number of times an animated GIF should loop (0 for ever)
+
+        dpi : float, optional
+            The output resolution, in dots per inch
+
+        threads : int, optional
+            The number of threads used to convert and write the frames. By
+            default, one thread per CPU is used.
+        '''
+        animation.save_animation(self, filename, slices=slices, limits=limits,
+                                 pmin=pmin, pmax=pmax, duration=duration,
+                                 loop=loop, dpi=dpi, threads=threads)
+
     # @auto_refresh
     def set_theme(self, theme):
         '''
@@ -1687,6 +2435,8 @@ class FITSFigure(Layers, Regions, Deprecated):
             and grid black, and displays the image in inverted grayscale)
        '''
 
+        self._theme = theme
+
         if theme == 'pretty':
             self.frame.set_color('black')
             self.frame.set_linewidth(1.0)
@@ -1918,4 +2668,6 @@ class FITSFigure(Layers, Regions, Deprecated):
         '''
         Close the figure and free up the memory.
         '''
+        if getattr(self, '_slicer', None) is not None:
+            self._slicer.stop()
         mpl.close(self._figure)
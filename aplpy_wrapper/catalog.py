@@ -0,0 +1,131 @@
+from __future__ import absolute_import, print_function, division
+
+import os
+import itertools
+
+import numpy as np
+from astropy.io import fits
+
+FITS_EXTENSIONS = ['.fits', '.fit', '.fts', '.fits.gz', '.fit.gz', '.fts.gz']
+
+
+def is_fits_table(filename):
+    '''
+    Guess from the file extension whether a catalog is a FITS table.
+    '''
+    filename = filename.lower()
+    for extension in FITS_EXTENSIONS:
+        if filename.endswith(extension):
+            return True
+    return False
+
+
+def iter_fits_table(filename, columns, chunk_size=100000, hdu=1):
+    '''
+    Iterate over columns of a FITS binary table in chunks of rows.
+
+    The file is memory-mapped and each chunk is sliced from the table before
+    the columns are extracted, so only the rows in the current chunk are read
+    from disk.
+
+    Parameters
+    ----------
+
+    filename : str
+        The FITS file containing the table
+
+    columns : list
+        The names (or indices) of the columns to read
+
+    chunk_size : int, optional
+        The number of rows to read at a time
+
+    hdu : int, optional
+        The HDU containing the table
+    '''
+
+    hdulist = fits.open(filename, memmap=True)
+
+    try:
+        table = hdulist[hdu].data
+        if table is None:
+            raise Exception("HDU %i of %s does not contain a table" % (hdu, filename))
+        n_rows = len(table)
+        for start in range(0, n_rows, chunk_size):
+            rows = table[start:start + chunk_size]
+            yield [np.asarray(rows.field(column), dtype=float)
+                   for column in columns]
+    finally:
+        hdulist.close()
+
+
+def iter_csv_table(filename, columns, chunk_size=100000, delimiter=','):
+    '''
+    Iterate over columns of a delimited text table in chunks of rows.
+
+    The first line of the file should contain the column names. Only
+    chunk_size lines are held in memory at any one time.
+
+    Parameters
+    ----------
+
+    filename : str
+        The CSV file containing the table
+
+    columns : list
+        The names (or indices) of the columns to read
+
+    chunk_size : int, optional
+        The number of rows to read at a time
+
+    delimiter : str, optional
+        The column delimiter
+    '''
+
+    with open(filename, 'r') as f:
+
+        names = [name.strip().strip('"\'')
+                 for name in f.readline().split(delimiter)]
+
+        usecols = []
+        for column in columns:
+            if column in names:
+                usecols.append(names.index(column))
+            elif isinstance(column, int):
+                usecols.append(column)
+            else:
+                raise Exception("Column %s not found in %s" % (column, filename))
+
+        while True:
+            lines = list(itertools.islice(f, chunk_size))
+            if len(lines) == 0:
+                break
+            chunk = np.loadtxt(lines, delimiter=delimiter, usecols=usecols,
+                               ndmin=2, dtype=float)
+            yield [chunk[:, i] for i in range(len(usecols))]
+
+
+def iter_table(filename, columns, chunk_size=100000, hdu=1, delimiter=','):
+    '''
+    Iterate over columns of a FITS or CSV table in chunks of rows.
+
+    The format is determined from the file extension.
+    '''
+
+    if not os.path.exists(filename):
+        raise IOError("File not found: " + filename)
+
+    if is_fits_table(filename):
+        return iter_fits_table(filename, columns, chunk_size=chunk_size, hdu=hdu)
+    else:
+        return iter_csv_table(filename, columns, chunk_size=chunk_size,
+                              delimiter=delimiter)
+
+
+def in_footprint(xp, yp, extent, margin=0.):
+    '''
+    Return a boolean mask of the pixel positions falling within the image
+    extent (xmin, xmax, ymin, ymax), optionally padded by margin pixels.
+    '''
+    return (xp >= extent[0] - margin) & (xp <= extent[1] + margin) & \
+           (yp >= extent[2] - margin) & (yp <= extent[3] + margin)
@@ -0,0 +1,428 @@
+from __future__ import absolute_import, print_function, division
+
+import os
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+from astropy import log
+from astropy.io import fits
+
+import matplotlib.pyplot as mpl
+from wcsaxes import WCSAxes
+
+from . import animation
+from . import convolve_util
+from . import cube_stats
+from . import header as header_util
+from . import image_util
+from . import slicer
+from . import wcs_util
+from .ticks import Ticks
+from .ticklabels import TickLabels
+from .axis_labels import AxisLabels
+from .colorbar import Colorbar
+from .normalize import APLpyNormalize
+from .frame import Frame
+from .aplpy import Parameters
+
+
+class _Panel(object):
+    '''
+    One panel of a channel map, with the attributes used by the axes
+    helpers (ticks, labels, frame, colorbar).
+    '''
+
+    def __init__(self, figure, ax, x, y, parameters):
+        self._figure = figure
+        self._parameters = parameters
+        self.ax = ax
+        self.x = x
+        self.y = y
+        self.image = None
+        self.ticks = Ticks(ax, x, y)
+        self.tick_labels = TickLabels(ax, x, y)
+        self.axis_labels = AxisLabels(ax, x, y)
+        self.frame = Frame(self)
+
+
+class _Broadcast(object):
+    '''
+    Apply the methods called on this object to the same helper (e.g. the
+    ticks) of every panel, so that all panels share one configuration.
+    '''
+
+    def __init__(self, targets):
+        self._targets = targets
+
+    def __getattr__(self, name):
+        methods = [getattr(target, name) for target in self._targets]
+
+        def apply(*args, **kwargs):
+            for method in methods:
+                method(*args, **kwargs)
+
+        apply.__doc__ = methods[0].__doc__
+        return apply
+
+
+class ChannelMaps(object):
+
+    def __init__(self, data, channels=None, hdu=0, nrows=None, ncols=None,
+                 dimensions=[0, 1], slices=[], convention=None, figure=None,
+                 channel_labels=True, threads=None, **kwargs):
+        '''
+        Create a grid of panels showing consecutive slices of a cube.
+
+        Parameters
+        ----------
+
+        data : str or HDU
+            The FITS file or HDU containing the cube. Files are memory
+            mapped, and kept open until close() is called.
+
+        channels : list, optional
+            The slices to show along the first sliced dimension. By
+            default, all the slices are shown.
+
+        hdu : int, optional
+            The HDU to read if data is a filename
+
+        nrows, ncols : int, optional
+            The number of rows and columns of panels. By default, the
+            panels are arranged in a grid which is roughly square.
+
+        dimensions : tuple or list, optional
+            The index of the axes shown in each panel
+
+        slices : tuple or list, optional
+            For cubes with more than three dimensions, the slices to
+            extract along the other sliced dimensions. The first value is
+            replaced by each of the channels.
+
+        convention : str, optional
+            This is used in cases where a FITS header can be interpreted
+            in multiple ways (see `~aplpy_wrapper.FITSFigure`).
+
+        figure : ~matplotlib.figure.Figure, optional
+            If specified, the panels are added to this figure rather than
+            to a new one.
+
+        channel_labels : bool, optional
+            Whether to label each panel with the world coordinate of its
+            slice.
+
+        threads : int, optional
+            The number of threads used to read and smooth the data of the
+            panels. By default, one thread per CPU is used.
+
+        kwargs
+            Any additional arguments are passed on to matplotlib's Figure()
+            class.
+
+        All the panels share the same WCS, and the ticks, tick labels, axis
+        labels and frame are configured once for all the panels through the
+        ticks, tick_labels, axis_labels and frame attributes, which accept
+        the same methods as those of FITSFigure. Only the panel in the
+        bottom left corner shows tick labels and axis labels.
+        '''
+
+        # The file is kept open (memory mapped) until close() is called, so
+        # that the statistics of the cube can be computed when needed
+        if isinstance(data, basestring):
+            if not os.path.exists(data):
+                raise IOError("File not found: " + data)
+            self._cube_source = (data, hdu)
+            self._hdulist = fits.open(data, memmap=True)
+            data = self._hdulist[hdu]
+        else:
+            self._cube_source = None
+            self._hdulist = None
+
+        header = header_util.check(data.header.copy(), convention=convention,
+                                   dimensions=dimensions)
+        cube = data.data
+
+        if cube.ndim < 3:
+            raise Exception("Channel maps can only be created from data with more than two dimensions")
+
+        self._slicer = slicer.SlicePrefetcher(cube, header, dimensions=dimensions, depth=0)
+        sizes = self._slicer.sizes
+
+        if channels is None:
+            channels = range(sizes[0])
+        channels = list(channels)
+        if len(channels) == 0:
+            raise ValueError("channels= should contain at least one slice")
+
+        slices = list(slices) if len(slices) > 0 else [0] * len(sizes)
+        self._slices = []
+        for channel in channels:
+            s = list(slices)
+            s[0] = channel
+            self._slicer.check(s)
+            self._slices.append(s)
+
+        n = len(channels)
+        if ncols is None:
+            ncols = int(np.ceil(np.sqrt(n))) if nrows is None else int(np.ceil(n / nrows))
+        if nrows is None:
+            nrows = int(np.ceil(n / ncols))
+        if nrows * ncols < n:
+            raise ValueError("nrows x ncols is smaller than the number of channels")
+
+        self._header = header
+        self._dimensions = list(dimensions)
+        self._cube_stats = None
+        self._threads = threads or multiprocessing.cpu_count()
+
+        # Read the slices shown in parallel
+        log.info("Reading %i slices" % n)
+        pool = ThreadPool(min(self._threads, n))
+        try:
+            self._data = pool.map(lambda s: np.array(self._slicer.view(s)), self._slices)
+        finally:
+            pool.close()
+            pool.join()
+
+        # The panels fill a box leaving space for the colorbar, without gaps
+        # between panels
+        self._box = [0.1, 0.1, 0.75, 0.85]
+        width = self._box[2] / ncols
+        height = self._box[3] / nrows
+
+        nx = header['NAXIS%i' % (dimensions[0] + 1)]
+        ny = header['NAXIS%i' % (dimensions[1] + 1)]
+        self._extent = (0.5, nx + 0.5, 0.5, ny + 0.5)
+
+        # By default, the panels are 2.5 inches wide, with the aspect ratio
+        # of the images
+        if 'figsize' not in kwargs:
+            kwargs['figsize'] = (2.5 * ncols / self._box[2],
+                                 2.5 * ny / nx * nrows / self._box[3])
+
+        if figure:
+            self._figure = figure
+        else:
+            self._figure = mpl.figure(**kwargs)
+
+        self._parameters = Parameters()
+        self._parameters.auto_refresh = False
+
+        # All the panels share the WCS of the first slice
+        wcs = wcs_util.get_wcs(header, dimensions=dimensions, slices=self._slices[0])
+        wcsaxes_slices = slicer.get_wcsaxes_slices(dimensions, self._slices[0])
+        x, y = dimensions
+
+        # The first panel of the last row shows the tick and axis labels
+        labelled = ((n - 1) // ncols) * ncols
+
+        self.panels = []
+        for index in range(n):
+            row, col = divmod(index, ncols)
+            position = [self._box[0] + col * width,
+                        self._box[1] + (nrows - 1 - row) * height,
+                        width, height]
+            ax = WCSAxes(self._figure, position, wcs=wcs, slices=wcsaxes_slices)
+            self._figure.add_axes(ax)
+            ax.set_xlim(*self._extent[:2])
+            ax.set_ylim(*self._extent[2:])
+            panel = _Panel(self._figure, ax, x, y, self._parameters)
+            if index != labelled:
+                panel.tick_labels.hide()
+                panel.axis_labels.hide()
+            self.panels.append(panel)
+
+        self.ticks = _Broadcast([panel.ticks for panel in self.panels])
+        self.tick_labels = _Broadcast([panel.tick_labels for panel in self.panels])
+        self.axis_labels = _Broadcast([panel.axis_labels for panel in self.panels])
+        self.frame = _Broadcast([panel.frame for panel in self.panels])
+
+        if channel_labels:
+            axis = [dim for dim in range(cube.ndim) if dim not in dimensions][0]
+            values, unit = wcs_util.axis_world(wcs, axis, sizes[0])
+            unit = unit.to_string()
+            for panel, channel in zip(self.panels, channels):
+                panel.ax.text(0.05, 0.95, ("%g %s" % (values[channel], unit)).strip(),
+                              transform=panel.ax.transAxes, ha='left', va='top',
+                              color='white', size='small')
+
+        self.image = None
+        self.set_theme(theme='pretty')
+
+    def _cube_statistics(self):
+        # The percentiles of the whole cube, computed when first needed (or
+        # read from the statistics file saved next to the FITS file)
+        if self._cube_stats is None:
+            filename, hdu = self._cube_source or (None, 0)
+            self._cube_stats = cube_stats.cube_statistics(self._slicer, filename=filename,
+                                                          hdu=hdu, dimensions=self._dimensions)
+        return self._cube_stats
+
+    @property
+    def ax(self):
+        # The axes of the first panel, used by the colorbar to find the
+        # figure layout
+        return self.panels[0].ax
+
+    def show_colorscale(self, vmin=None, vmid=None, vmax=None,
+                        pmin=0.25, pmax=99.75, stretch='linear', exponent=2,
+                        cmap='default', smooth=None, kernel='gauss',
+                        interpolation='nearest', limits='cube'):
+        '''
+        Show a colorscale image of the slices in all the panels, with the
+        same stretch.
+
+        The arguments are the same as for
+        `~aplpy_wrapper.FITSFigure.show_colorscale`, except for limits. If
+        vmin or vmax are not given, they are computed from the pmin and pmax
+        percentiles of the whole cube ('cube'; default), as for
+        FITSFigure.show_colorscale(limits='cube'), or of the slices shown
+        ('channels'), so that the colors of all the panels can be compared.
+        The slices are smoothed in parallel.
+        '''
+
+        if limits not in ['cube', 'channels']:
+            raise ValueError("limits should be one of 'cube' or 'channels'")
+
+        if cmap == 'default':
+            cmap = self._figure.apl_colorscale_cmap_default
+        cmap = mpl.cm.get_cmap(cmap)
+
+        min_auto = np.equal(vmin, None)
+        max_auto = np.equal(vmax, None)
+
+        if min_auto or max_auto:
+            if limits == 'cube':
+                auto_vmin, auto_vmax = self._cube_statistics().limits(pmin, pmax)
+            else:
+                auto_v = animation.cube_limits(self._slicer, self._slices, pmin, pmax)
+                if auto_v is None:
+                    log.warning("Slices contain only NaN or Inf values")
+                    auto_v = (0., 0.)
+                auto_vmin, auto_vmax = auto_v
+            if min_auto:
+                vmin = auto_vmin
+            if max_auto:
+                vmax = auto_vmax
+
+        normalizer = APLpyNormalize(stretch=stretch, exponent=exponent,
+                                    vmid=vmid, vmin=vmin, vmax=vmax)
+
+        vmin, vmax = image_util.auto_limits(vmin, vmax, stretch,
+                                            min_auto=min_auto, max_auto=max_auto)
+
+        if min_auto:
+            log.info("Auto-setting vmin to %10.3e" % vmin)
+
+        if max_auto:
+            log.info("Auto-setting vmax to %10.3e" % vmax)
+
+        normalizer.vmin = vmin
+        normalizer.vmax = vmax
+
+        pool = ThreadPool(min(self._threads, len(self._data)))
+        try:
+            images = pool.map(lambda plane: convolve_util.convolve(plane, smooth=smooth,
+                                                                   kernel=kernel),
+                              self._data)
+        finally:
+            pool.close()
+            pool.join()
+
+        for panel, image in zip(self.panels, images):
+            if panel.image:
+                panel.image.set_visible(True)
+                panel.image.set_norm(normalizer)
+                panel.image.set_cmap(cmap=cmap)
+                panel.image.set_interpolation(interpolation)
+                panel.image.set_data(image)
+            else:
+                panel.image = panel.ax.imshow(image, cmap=cmap,
+                                              interpolation=interpolation,
+                                              origin='lower', extent=self._extent,
+                                              norm=normalizer, aspect='equal')
+
+        # The colorbar follows the image of the first panel, which shares
+        # its stretch with the other panels
+        self.image = self.panels[0].image
+
+        if hasattr(self, 'colorbar'):
+            self.colorbar.update()
+
+    def add_colorbar(self, **kwargs):
+        '''
+        Add a colorbar shared by all the panels.
+
+        The colorbar is placed on the right of the grid of panels, unless
+        box is given. The arguments are the same as for
+        `~aplpy_wrapper.colorbar.Colorbar.show`, and the colorbar
+        attribute can be used to control its aspect.
+        '''
+        if hasattr(self, 'colorbar'):
+            raise Exception("Colorbar already exists")
+        if self.image is None:
+            raise Exception("No image is shown, so a colorbar cannot be displayed")
+        if kwargs.get('box') is None:
+            kwargs['box'] = [self._box[0] + self._box[2] + 0.02, self._box[1],
+                             0.025, self._box[3]]
+        try:
+            self.colorbar = Colorbar(self)
+            self.colorbar.show(**kwargs)
+        except:
+            del self.colorbar
+            raise
+
+    def remove_colorbar(self):
+        '''
+        Removes the colorbar from the figure.
+        '''
+        self.colorbar._remove()
+        del self.colorbar
+
+    def set_theme(self, theme):
+        '''
+        Set the axes, ticks, and image colors of all the panels to a certain
+        style (see `~aplpy_wrapper.FITSFigure.set_theme`).
+        '''
+        if theme == 'pretty':
+            self.frame.set_color('black')
+            self.frame.set_linewidth(1.0)
+            self.ticks.set_color('white')
+            self.ticks.set_length(7)
+            self._figure.apl_grayscale_invert_default = False
+            self._figure.apl_colorscale_cmap_default = 'jet'
+            cmap = 'jet'
+        elif theme == 'publication':
+            self.frame.set_color('black')
+            self.frame.set_linewidth(1.0)
+            self.ticks.set_color('black')
+            self.ticks.set_length(7)
+            self._figure.apl_grayscale_invert_default = True
+            self._figure.apl_colorscale_cmap_default = 'gist_heat'
+            cmap = 'gist_yarg'
+        else:
+            raise ValueError("theme should be one of 'pretty' or 'publication'")
+        for panel in self.panels:
+            if panel.image:
+                panel.image.set_cmap(cmap=mpl.cm.get_cmap(cmap))
+
+    def save(self, filename, dpi=None, transparent=False, format=None):
+        '''
+        Save the channel maps to a file.
+
+        The arguments are the same as for `~aplpy_wrapper.FITSFigure.save`.
+        '''
+        if isinstance(filename, basestring) and format is None:
+            format = os.path.splitext(filename)[1].lower()[1:]
+        self._figure.savefig(filename, dpi=dpi, transparent=transparent,
+                             format=format)
+
+    def close(self):
+        '''
+        Close the figure and free up the memory.
+        '''
+        mpl.close(self._figure)
+        if self._hdulist is not None:
+            self._hdulist.close()
+            self._hdulist = None
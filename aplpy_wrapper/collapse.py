@@ -0,0 +1,250 @@
+from __future__ import absolute_import, print_function, division
+
+import numpy as np
+from astropy import log
+from astropy import units as u
+from astropy.io import fits
+from astropy.wcs import WCS as AstropyWCS
+
+from . import header as header_util
+from . import wcs_util
+
+OPERATIONS = ['sum', 'mean', 'max', 'moment0', 'moment1', 'moment2']
+
+# The maximum size (in bytes) of the chunks of channels read at a time
+CHUNK_BYTES = 64 * 1024 * 1024
+
+
+def collapse_axis(shape, dimensions, axis=None):
+    '''
+    Return the dimension along which a cube with the given shape (in FITS
+    order) is collapsed. By default, this is the only dimension not shown
+    with more than one pixel.
+    '''
+    sliced = [dim for dim in range(len(shape)) if dim not in dimensions]
+    if axis is not None:
+        if axis not in sliced:
+            raise ValueError("axis= should be one of the dimensions not shown (%s)" % ', '.join(map(str, sliced)))
+        return axis
+    candidates = [dim for dim in sliced if shape[dim] > 1]
+    if len(candidates) > 1:
+        raise ValueError("The cube has several dimensions with more than one pixel - use axis= to select the dimension to collapse")
+    return candidates[0] if candidates else sliced[0]
+
+
+def header_2d(header, wcs, dimensions):
+    '''
+    Return the header of an image with the given two axes of a cube, from
+    the checked header and WCS of the cube.
+    '''
+    wcs_2d = AstropyWCS(naxis=2)
+    wcs_2d.wcs = wcs.wcs.sub([dimensions[0] + 1, dimensions[1] + 1])
+    new = wcs_2d.to_header()
+    new['NAXIS'] = 2
+    new['NAXIS1'] = header['NAXIS%i' % (dimensions[0] + 1)]
+    new['NAXIS2'] = header['NAXIS%i' % (dimensions[1] + 1)]
+    for keyword in ['OBJECT', 'TELESCOP', 'INSTRUME', 'DATE-OBS', 'BMAJ', 'BMIN', 'BPA']:
+        if keyword in header:
+            new[keyword] = header[keyword]
+    return new
+
+
+def _unit(unit, operation, spectral_unit):
+    # The unit of the collapsed image, as a FITS unit string
+    unit = u.Unit(unit, parse_strict='silent')
+    if operation in ['sum', 'mean', 'max']:
+        pass
+    elif operation == 'moment0':
+        unit = unit * spectral_unit
+    elif operation == 'moment1':
+        unit = spectral_unit
+    else:
+        unit = spectral_unit ** 2
+    if isinstance(unit, u.UnrecognizedUnit):
+        return unit.to_string()
+    return unit.to_string(format='fits')
+
+
+def collapse(data, operation='moment0', hdu=0, channels=None,
+             dimensions=[0, 1], slices=[], axis=None, convention=None,
+             chunk_bytes=CHUNK_BYTES):
+    '''
+    Collapse a cube along one of its dimensions.
+
+    Parameters
+    ----------
+
+    data : str or HDU
+        The FITS file or HDU containing the cube
+
+    operation : str, optional
+        One of 'sum', 'mean', or 'max' (of the values in each spectrum),
+        'moment0' (the integrated intensity), 'moment1' (the intensity
+        weighted mean of the spectral coordinate) or 'moment2' (the
+        intensity weighted variance of the spectral coordinate)
+
+    hdu : int, optional
+        The HDU to read if data is a filename
+
+    channels : tuple, optional
+        The range of channels (start, stop) to collapse, as 0-based indices
+        with stop excluded. By default, all the channels are used.
+
+    dimensions : tuple or list, optional
+        The two axes of the image
+
+    slices : tuple or list, optional
+        For cubes with more than three dimensions, the slices to extract
+        along the dimensions which are neither shown nor collapsed, in the
+        same form as the slices= argument of FITSFigure (the value for the
+        collapsed dimension is ignored). By default, the first slice is
+        used.
+
+    axis : int, optional
+        The dimension to collapse. By default, this is the only dimension
+        not shown with more than one pixel (so that for example cubes with
+        a Stokes axis of size one can be collapsed). Celestial dimensions
+        cannot be collapsed.
+
+    convention : str, optional
+        This is used in cases where a FITS header can be interpreted in
+        multiple ways (see `~aplpy_wrapper.FITSFigure`).
+
+    chunk_bytes : int, optional
+        The maximum size of the chunks of channels read at a time
+
+    The cube is read in chunks of channels, and only a few 2-d images are
+    accumulated, so the memory used does not depend on the number of
+    channels. Files are memory mapped, and closed once the image has been
+    computed. Blank (NaN) values are ignored, and pixels without any valid
+    values are set to NaN. Returns an HDU with the collapsed image and a
+    2-d header.
+    '''
+
+    if operation not in OPERATIONS:
+        raise ValueError("operation should be one of %s" % ', '.join(OPERATIONS))
+
+    if isinstance(data, basestring):
+        with fits.open(data, memmap=True) as hdulist:
+            return collapse(hdulist[hdu], operation=operation, channels=channels,
+                            dimensions=dimensions, slices=slices, axis=axis,
+                            convention=convention, chunk_bytes=chunk_bytes)
+
+    cube = data.data
+    if cube.ndim < 3:
+        raise Exception("Only data with more than two dimensions can be collapsed")
+
+    header = header_util.check(data.header.copy(), convention=convention,
+                               dimensions=dimensions)
+
+    shape = cube.shape[::-1]
+    axis = collapse_axis(shape, dimensions, axis=axis)
+
+    # The slices of the other dimensions, in the form used by wcs_util
+    sliced = [dim for dim in range(cube.ndim) if dim not in dimensions]
+    if len(slices) == 0:
+        slices = [0] * len(sliced)
+    slices = list(slices)
+    if len(slices) != len(sliced):
+        raise ValueError("slices= should have %i values" % len(sliced))
+    slices[sliced.index(axis)] = 0
+
+    wcs = wcs_util.get_wcs(header, dimensions=dimensions, slices=slices)
+
+    if axis in [wcs.wcs.lng, wcs.wcs.lat]:
+        raise ValueError("Cannot collapse along celestial axis %i (%s)" % (axis, header['CTYPE%i' % (axis + 1)]))
+
+    n_channels = shape[axis]
+
+    if channels is None:
+        start, stop = 0, n_channels
+    else:
+        start, stop = max(0, channels[0]), min(n_channels, channels[1])
+    if stop <= start:
+        raise ValueError("channels= should contain at least one channel")
+
+    values, spectral_unit = wcs_util.axis_world(wcs, axis, n_channels)
+    widths = np.abs(np.gradient(values)) if n_channels > 1 else np.ones(1)
+
+    # Spectral coordinates are taken relative to the middle of the range,
+    # to reduce rounding errors in the second moment
+    reference = values[(start + stop) // 2]
+    values = values - reference
+
+    # The Numpy index of each chunk, and the order of the axes of the
+    # chunk which gives (channel, y, x)
+    index = [None] * cube.ndim
+    for dim, value in zip(sliced, slices):
+        index[cube.ndim - 1 - dim] = value
+    for dim in dimensions:
+        index[cube.ndim - 1 - dim] = slice(None)
+    remaining = sorted([axis] + list(dimensions), reverse=True)
+    order = [remaining.index(axis), remaining.index(dimensions[1]),
+             remaining.index(dimensions[0])]
+
+    plane_shape = (shape[dimensions[1]], shape[dimensions[0]])
+    plane_bytes = 8 * plane_shape[0] * plane_shape[1]
+    chunk = max(1, int(chunk_bytes // plane_bytes))
+
+    log.info("Computing %s of channels %i to %i" % (operation, start, stop - 1))
+
+    count = np.zeros(plane_shape)
+    if operation == 'max':
+        total = np.empty(plane_shape)
+        total.fill(np.nan)
+    else:
+        total = np.zeros(plane_shape)
+    if operation in ['moment1', 'moment2']:
+        first = np.zeros(plane_shape)
+    if operation == 'moment2':
+        second = np.zeros(plane_shape)
+
+    for c0 in range(start, stop, chunk):
+
+        c1 = min(c0 + chunk, stop)
+
+        index[cube.ndim - 1 - axis] = slice(c0, c1)
+        block = np.asarray(cube[tuple(index)], dtype=float).transpose(order)
+
+        finite = np.isfinite(block)
+        count += finite.sum(axis=0)
+
+        if operation == 'max':
+            total = np.fmax(total, np.where(finite, block, -np.inf).max(axis=0))
+            continue
+
+        block = np.where(finite, block, 0.)
+
+        if operation == 'moment0':
+            weights = widths[c0:c1, np.newaxis, np.newaxis]
+            total += (block * weights).sum(axis=0)
+        else:
+            total += block.sum(axis=0)
+
+        if operation in ['moment1', 'moment2']:
+            v = values[c0:c1, np.newaxis, np.newaxis]
+            first += (block * v).sum(axis=0)
+            if operation == 'moment2':
+                second += (block * v ** 2).sum(axis=0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if operation in ['sum', 'moment0', 'max']:
+            image = total
+        elif operation == 'mean':
+            image = total / count
+        elif operation == 'moment1':
+            image = first / total + reference
+        else:
+            mean = first / total
+            image = second / total - mean ** 2
+
+    image[count == 0] = np.nan
+    if operation == 'max':
+        image[np.isinf(image)] = np.nan
+
+    new = header_2d(header, wcs, dimensions)
+    unit = _unit(header.get('BUNIT', ''), operation, spectral_unit)
+    if unit:
+        new['BUNIT'] = unit
+
+    return fits.PrimaryHDU(image, new)
@@ -0,0 +1,472 @@
+from __future__ import absolute_import, print_function, division
+
+import warnings
+import multiprocessing
+
+import numpy as np
+from astropy import log
+
+from matplotlib.contour import ContourSet, QuadContourSet
+from matplotlib.path import Path
+
+try:
+    import contourpy
+except ImportError:
+    contourpy = None
+
+from . import wcs_util
+
+# The number of contour geometries kept by each figure for re-use
+CACHE_SIZE = 8
+
+# Images with at least this many pixels are contoured with several threads
+# by default
+PARALLEL_SIZE = 4000000
+
+# The size of the tiles used when refining contours computed on a reduced
+# image, in blocks of the reduced image
+REFINE_BLOCKS = 16
+
+
+def _pixel_grid(image):
+    # Contours are computed in FITS pixel coordinates, so that they line up
+    # with images shown with an extent of (0.5, nx + 0.5, 0.5, ny + 0.5)
+    ny, nx = image.shape
+    return np.arange(nx) + 1., np.arange(ny) + 1.
+
+
+def _n_threads(image, threads):
+    if threads is None:
+        if image.size >= PARALLEL_SIZE:
+            return multiprocessing.cpu_count()
+        else:
+            return 1
+    return max(1, int(threads))
+
+
+def _generator(x, y, image, threads):
+    '''
+    Create a contourpy generator. With several threads, the image is split
+    into chunks which are contoured concurrently (with the GIL released) for
+    each level, and the results are assembled by contourpy.
+    '''
+    kwargs = dict(line_type=contourpy.LineType.SeparateCode,
+                  fill_type=contourpy.FillType.OuterCode)
+    if threads > 1:
+        kwargs.update(name='threaded', thread_count=threads,
+                      chunk_count=min(threads, max(image.shape) // 64 + 1))
+    return contourpy.contour_generator(x, y, image, **kwargs)
+
+
+def contour_segments(image, levels, filled=False, ax=None, threads=None):
+    '''
+    Compute the contour lines (or filled contour polygons) of an image.
+
+    Returns the vertices and path codes for each level, in the format of
+    the allsegs and allkinds attributes of a Matplotlib ContourSet, with
+    vertices in FITS pixel coordinates. If contourpy is not installed, the
+    contours are computed by Matplotlib, in which case ax should be given.
+
+    If threads is greater than one, each level is computed by that many
+    threads in parallel. By default, several threads are used for images
+    with more than PARALLEL_SIZE pixels. With several threads, contours
+    are split where they cross the edges of the chunks of the image given
+    to each thread, which does not change their appearance.
+    '''
+
+    x, y = _pixel_grid(image)
+    image = np.ma.masked_invalid(image)
+
+    if contourpy is not None:
+
+        generator = _generator(x, y, image, _n_threads(image, threads))
+        allsegs, allkinds = [], []
+        if filled:
+            for lower, upper in zip(levels[:-1], levels[1:]):
+                segs, kinds = generator.filled(lower, upper)
+                allsegs.append(list(segs))
+                allkinds.append(list(kinds))
+        else:
+            for level in levels:
+                segs, kinds = generator.lines(level)
+                allsegs.append(list(segs))
+                allkinds.append(list(kinds))
+
+    else:
+
+        c = QuadContourSet(ax, x, y, image, levels, filled=filled)
+        allsegs, allkinds = c.allsegs, c.allkinds
+        for contour in c.collections:
+            contour.remove()
+
+    return allsegs, allkinds
+
+
+def block_reduce(image, factor):
+    '''
+    Reduce the resolution of an image by averaging blocks of factor x factor
+    pixels, ignoring NaN values. The image is padded with NaN values if its
+    dimensions are not multiples of factor.
+    '''
+
+    ny, nx = image.shape
+    pad_y, pad_x = (-ny) % factor, (-nx) % factor
+
+    image = np.asarray(image, dtype=float)
+    if pad_y > 0 or pad_x > 0:
+        image = np.pad(image, ((0, pad_y), (0, pad_x)), mode='constant',
+                       constant_values=np.nan)
+
+    blocks = image.reshape(image.shape[0] // factor, factor,
+                           image.shape[1] // factor, factor)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanmean(np.nanmean(blocks, axis=3), axis=1)
+
+
+def _offset_segments(allsegs, dx, dy, scale=1.):
+    return [[seg * scale + np.array([dx, dy]) for seg in segs] for segs in allsegs]
+
+
+def contour_reduced(image, levels, factor, filled=False, ax=None, threads=None):
+    '''
+    Compute contours on a block-reduced version of the image, returning
+    vertices in the pixel coordinates of the full-resolution image.
+    '''
+
+    allsegs, allkinds = contour_segments(block_reduce(image, factor), levels,
+                                         filled=filled, ax=ax, threads=threads)
+
+    # Pixel i of the reduced image is centered on pixel (i - 0.5) * factor
+    # + 0.5 of the original image
+    offset = 0.5 - 0.5 * factor
+    return _offset_segments(allsegs, offset, offset, scale=factor), allkinds
+
+
+def _line_codes(seg):
+    codes = np.empty(len(seg), dtype=Path.code_type)
+    codes.fill(Path.LINETO)
+    codes[0] = Path.MOVETO
+    return codes
+
+
+def _tile_rectangle(x0, x1, y0, y1):
+    vertices = np.array([[x0, y0], [x1, y0], [x1, y1], [x0, y1], [x0, y0]])
+    codes = np.array([Path.MOVETO, Path.LINETO, Path.LINETO, Path.LINETO,
+                      Path.CLOSEPOLY], dtype=Path.code_type)
+    return vertices, codes
+
+
+def contour_refined(image, levels, factor, filled=False, ax=None):
+    '''
+    Compute full-resolution contours, only in the parts of the image which
+    contain contours.
+
+    The image is divided into tiles of REFINE_BLOCKS x REFINE_BLOCKS blocks
+    of the reduced image. The range of values in each tile is used to find
+    the tiles which are crossed by a contour, and only those tiles are
+    contoured at full resolution. For filled contours, tiles which are not
+    crossed by a contour are filled with a single rectangle. Contours are
+    split at the edges of the tiles, which does not change their appearance.
+    '''
+
+    levels = np.asarray(levels)
+    n_out = len(levels) - 1 if filled else len(levels)
+    allsegs = [[] for i in range(n_out)]
+    allkinds = [[] for i in range(n_out)]
+
+    ny, nx = image.shape
+    tile = factor * REFINE_BLOCKS
+
+    # Neighboring tiles share a row and column of pixels, so that contours
+    # join up across the edges of the tiles
+    for j0 in range(0, max(ny - 1, 1), tile):
+        for i0 in range(0, max(nx - 1, 1), tile):
+
+            sub = image[j0:j0 + tile + 1, i0:i0 + tile + 1]
+            finite = np.isfinite(sub)
+            if not np.any(finite):
+                continue
+
+            vmin, vmax = sub[finite].min(), sub[finite].max()
+            crossed = np.any((levels >= vmin) & (levels <= vmax))
+
+            if not crossed and (not filled or np.all(finite)):
+                if filled and vmin > levels[0] and vmax <= levels[-1]:
+                    band = np.searchsorted(levels, vmin) - 1
+                    vertices, codes = _tile_rectangle(i0 + 1, i0 + sub.shape[1],
+                                                      j0 + 1, j0 + sub.shape[0])
+                    allsegs[band].append(vertices)
+                    allkinds[band].append(codes)
+                continue
+
+            segs, kinds = contour_segments(sub, levels, filled=filled, ax=ax,
+                                           threads=1)
+            segs = _offset_segments(segs, i0, j0)
+            for level in range(n_out):
+                allsegs[level].extend(segs[level])
+                if kinds is not None and kinds[level] is not None:
+                    allkinds[level].extend(kinds[level])
+                else:
+                    allkinds[level].extend([_line_codes(seg) for seg in segs[level]])
+
+    return allsegs, allkinds
+
+
+def auto_factor(image, ax):
+    '''
+    Find the block-reduction factor for which the reduced image has about
+    as many pixels as are used to display it in the axes.
+    '''
+    bbox = ax.get_window_extent()
+    ny, nx = image.shape
+    return max(1, int(min(nx / bbox.width, ny / bbox.height)))
+
+
+def transform_segments(allsegs, wcs_in, wcs_out):
+    '''
+    Transform contour vertices from the pixel frame of one image to the pixel
+    frame of another.
+
+    The vertices of all the levels are concatenated and transformed with a
+    single vectorized call, then split back into the original segments.
+    '''
+
+    lengths = [len(seg) for segs in allsegs for seg in segs]
+
+    if sum(lengths) == 0:
+        return [list(segs) for segs in allsegs]
+
+    vertices = np.vstack([seg for segs in allsegs for seg in segs])
+    xp, yp = wcs_util.pix2pix(wcs_in, wcs_out, vertices[:, 0], vertices[:, 1])
+    vertices = np.split(np.column_stack((xp, yp)), np.cumsum(lengths)[:-1])
+
+    result = []
+    i = 0
+    for segs in allsegs:
+        result.append(vertices[i:i + len(segs)])
+        i += len(segs)
+    return result
+
+
+def overlapping(allsegs, allkinds, extent):
+    '''
+    Remove segments which lie entirely outside the extent (xmin, xmax, ymin,
+    ymax) of an image.
+    '''
+
+    new_segs, new_kinds = [], []
+
+    for level, segs in enumerate(allsegs):
+        keep_segs, keep_kinds = [], []
+        for i, seg in enumerate(segs):
+            if len(seg) == 0:
+                continue
+            with np.errstate(invalid='ignore'):
+                inside = (seg[:, 0] >= extent[0]) & (seg[:, 0] <= extent[1]) & \
+                         (seg[:, 1] >= extent[2]) & (seg[:, 1] <= extent[3])
+            if np.any(inside) or (np.nanmin(seg[:, 0]) <= extent[0] and
+                                  np.nanmax(seg[:, 0]) >= extent[1] and
+                                  np.nanmin(seg[:, 1]) <= extent[2] and
+                                  np.nanmax(seg[:, 1]) >= extent[3]):
+                keep_segs.append(seg)
+                if allkinds is not None and allkinds[level] is not None:
+                    keep_kinds.append(allkinds[level][i])
+        new_segs.append(keep_segs)
+        new_kinds.append(keep_kinds if allkinds is not None and allkinds[level] is not None else None)
+
+    return new_segs, new_kinds
+
+
+def _douglas_peucker(points, first, last, tolerance):
+    '''
+    Return a boolean mask of the points to keep when simplifying the lines
+    points[first[i]:last[i] + 1] with the Douglas-Peucker algorithm. The
+    end points of each line are always kept.
+
+    Rather than recursing into each line separately, all the intervals which
+    still need to be split are processed at once with vectorized operations,
+    so that the number of Python iterations is the depth of the recursion
+    rather than the number of intervals.
+    '''
+
+    keep = np.zeros(len(points), dtype=bool)
+    keep[first] = True
+    keep[last] = True
+
+    active = last - first >= 2
+    first, last = first[active], last[active]
+
+    while len(first) > 0:
+
+        # Indices of the inner points of each interval, and the interval
+        # each one belongs to
+        counts = last - first - 1
+        offsets = np.cumsum(counts) - counts
+        owner = np.repeat(np.arange(len(first)), counts)
+        inner = np.arange(counts.sum()) - offsets[owner] + first[owner] + 1
+
+        start, end = points[first[owner]], points[last[owner]]
+        dx, dy = (end - start).T
+        length = np.hypot(dx, dy)
+        px, py = (points[inner] - start).T
+
+        # For closed rings, the distance is measured to the start point
+        with np.errstate(invalid='ignore', divide='ignore'):
+            distance = np.where(length > 0.,
+                                np.abs(dx * py - dy * px) / length,
+                                np.hypot(px, py))
+
+        # Find the farthest point in each interval
+        dmax = np.maximum.reduceat(distance, offsets)
+        candidates = np.nonzero(distance == dmax[owner])[0]
+        owners, index = np.unique(owner[candidates], return_index=True)
+        split = inner[candidates[index]]
+
+        # Split the intervals whose farthest point is beyond the tolerance
+        far = dmax > tolerance
+        split, first, last = split[far], first[far], last[far]
+        keep[split] = True
+
+        first, last = np.hstack([first, split]), np.hstack([split, last])
+        active = last - first >= 2
+        first, last = first[active], last[active]
+
+    return keep
+
+
+def simplify_segments(allsegs, allkinds, tolerance, levels=None):
+    '''
+    Simplify the contour paths of each level with the Douglas-Peucker
+    algorithm, with a tolerance in pixels, and report the number of vertices
+    before and after simplification for each level.
+
+    Each ring of a compound path (such as a filled contour with holes) is
+    simplified separately. Closed rings which collapse to fewer than three
+    distinct vertices are removed, and if the first (outer) ring of a path
+    is removed, the whole path is removed.
+    '''
+
+    new_segs, new_kinds = [], []
+
+    for level, segs in enumerate(allsegs):
+
+        kinds = allkinds[level] if allkinds is not None else None
+
+        segs = [seg for seg in segs if len(seg) > 0]
+        if kinds is not None:
+            kinds = [codes for codes in kinds if len(codes) > 0]
+
+        before = sum(len(seg) for seg in segs)
+
+        if before == 0:
+            new_segs.append([])
+            new_kinds.append([])
+            continue
+
+        # Concatenate all the paths for this level, and find the rings
+        lengths = np.array([len(seg) for seg in segs])
+        seg_start = np.cumsum(lengths) - lengths
+        points = np.vstack(segs)
+        if kinds is None:
+            codes = np.empty(len(points), dtype=Path.code_type)
+            codes.fill(Path.LINETO)
+        else:
+            codes = np.hstack(kinds).astype(Path.code_type)
+        codes[seg_start] = Path.MOVETO
+
+        ring_start = np.nonzero(codes == Path.MOVETO)[0]
+        ring_end = np.hstack([ring_start[1:], len(points)]) - 1
+        closed = codes[ring_end] == Path.CLOSEPOLY
+
+        keep = _douglas_peucker(points, ring_start, ring_end, tolerance)
+
+        # Remove closed rings which have collapsed, and paths whose outer
+        # ring has collapsed
+        n_kept = np.add.reduceat(keep, ring_start)
+        collapsed = closed & (n_kept < 4)
+        ring_seg = np.searchsorted(seg_start, ring_start, side='right') - 1
+        removed_seg = np.zeros(len(segs), dtype=bool)
+        outer = np.zeros(len(points), dtype=bool)
+        outer[seg_start] = True
+        removed_seg[ring_seg[collapsed & outer[ring_start]]] = True
+        drop = collapsed | removed_seg[ring_seg]
+        keep &= ~np.repeat(drop, ring_end - ring_start + 1)
+
+        points = points[keep]
+        codes = codes[keep]
+        counts = np.add.reduceat(keep, seg_start)
+
+        level_segs = np.split(points, np.cumsum(counts)[:-1])
+        level_kinds = np.split(codes, np.cumsum(counts)[:-1])
+        new_segs.append([seg for seg in level_segs if len(seg) > 0])
+        new_kinds.append([kind for kind in level_kinds if len(kind) > 0])
+
+        name = "%g" % levels[level] if levels is not None else str(level)
+        log.info("Simplified contour level %s from %i to %i vertices" % (name, before, len(points)))
+
+    return new_segs, new_kinds
+
+
+class ContourGeometry(object):
+    '''
+    The levels and vertices of a contour layer.
+
+    The vertices are kept in the native pixel frame of the contoured image.
+    If this differs from the displayed image, they are transformed once to
+    the pixel frame of the displayed image. The transformed vertices are
+    cached, and are only re-computed if the WCS of the displayed image
+    changes.
+    '''
+
+    def __init__(self, levels, allsegs, allkinds, filled, wcs):
+        self.levels = levels
+        self.allsegs = allsegs
+        self.allkinds = allkinds
+        self.filled = filled
+        self.wcs = wcs
+        self._host_wcs = None
+        self._pixel_segs = None
+        self._simplified = {}
+
+    def simplified(self, tolerance):
+        '''
+        Return the geometry simplified with a given tolerance (in pixels of
+        the contoured image). Simplified geometries are kept, so that they
+        are cached along with the original geometry.
+        '''
+        if not tolerance:
+            return self
+        if tolerance not in self._simplified:
+            allsegs, allkinds = simplify_segments(self.allsegs, self.allkinds,
+                                                  tolerance, levels=self.levels)
+            self._simplified[tolerance] = ContourGeometry(self.levels, allsegs, allkinds,
+                                                          self.filled, self.wcs)
+        return self._simplified[tolerance]
+
+    def pixel_segments(self, host_wcs):
+        '''
+        Return the vertices in the pixel frame of host_wcs.
+        '''
+        if host_wcs is self.wcs:
+            return self.allsegs
+        if host_wcs is not self._host_wcs:
+            self._pixel_segs = transform_segments(self.allsegs, self.wcs, host_wcs)
+            self._host_wcs = host_wcs
+        return self._pixel_segs
+
+    def needs_update(self, host_wcs):
+        return host_wcs is not self.wcs and host_wcs is not self._host_wcs
+
+    def contour_set(self, ax, host_wcs, extent=None, **kwargs):
+        '''
+        Create a ContourSet in the pixel frame of host_wcs. If extent is
+        given, only segments overlapping it are kept.
+        '''
+        allsegs = self.pixel_segments(host_wcs)
+        allkinds = self.allkinds
+        if extent is not None:
+            allsegs, allkinds = overlapping(allsegs, allkinds, extent)
+        return ContourSet(ax, self.levels, allsegs, allkinds,
+                          filled=self.filled, **kwargs)
@@ -0,0 +1,189 @@
+from __future__ import absolute_import, print_function, division
+
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from astropy import log
+
+# The percentiles at which the statistics are stored. Other percentiles
+# are interpolated. The percentiles of each slice are stored at fewer
+# points (more closely spaced near the extremes, where the limits of the
+# stretch are usually set) and in single precision, since there is one set
+# for each slice.
+PERCENTILES = np.linspace(0., 100., 1001)
+SLICE_PERCENTILES = np.unique(np.hstack([np.linspace(0., 2., 41),
+                                         np.linspace(2., 98., 97),
+                                         np.linspace(98., 100., 41)]))
+
+# The maximum number of values sampled from each slice, and from the whole
+# cube for the global percentiles
+SLICE_SAMPLES = 100000
+CUBE_SAMPLES = 2000000
+
+# Statistics for files are saved next to the files, with this suffix
+SUFFIX = '.stats.npz'
+
+# The version of the statistics files, which should be incremented if the
+# way the statistics are computed changes
+VERSION = 2
+
+# The number of sets of statistics kept in memory
+CACHE_SIZE = 8
+
+_memory_cache = OrderedDict()
+_memory_cache_lock = threading.Lock()
+
+
+def sample(plane, n_samples):
+    '''
+    Return a regular sample of at most n_samples finite values of an array.
+    '''
+    values = np.asarray(plane).ravel()
+    step = max(1, int(np.ceil(len(values) / n_samples)))
+    values = values[::step]
+    return values[np.isfinite(values)]
+
+
+def _percentiles(values, percentiles=PERCENTILES):
+    if len(values) == 0:
+        return np.repeat(np.nan, len(percentiles))
+    return np.percentile(values, percentiles)
+
+
+class CubeStatistics(object):
+    '''
+    Approximate percentiles of the values of a cube, both over the whole
+    cube and for each slice.
+    '''
+
+    def __init__(self, sizes, global_percentiles, slice_percentiles):
+        self.sizes = list(sizes)
+        self.global_percentiles = global_percentiles
+        self.slice_percentiles = slice_percentiles
+
+    @classmethod
+    def compute(cls, slicer):
+        '''
+        Compute the statistics in a single pass over the slices of a cube.
+
+        Each slice is read once, and a bounded sample of its values is used
+        for its percentiles. A smaller sample of each is kept for the global
+        percentiles, of at most CUBE_SAMPLES values in total (or 1000 values
+        per slice for cubes with more slices). The memory used does not
+        depend on the size of the slices, and the percentiles of each slice
+        take less than 1 kB.
+        '''
+
+        sizes = slicer.sizes
+        n_slices = int(np.prod(sizes))
+        n_global = max(1000, CUBE_SAMPLES // n_slices)
+
+        slice_percentiles = np.zeros((n_slices, len(SLICE_PERCENTILES)), dtype=np.float32)
+        pool = []
+        for index in range(n_slices):
+            values = sample(slicer.view(np.unravel_index(index, sizes)), SLICE_SAMPLES)
+            slice_percentiles[index] = _percentiles(values, SLICE_PERCENTILES)
+            pool.append(sample(values, n_global))
+
+        return cls(sizes, _percentiles(np.hstack(pool)), slice_percentiles)
+
+    def _limits(self, values, pmin, pmax, name, percentiles=PERCENTILES):
+        if np.all(np.isnan(values)):
+            log.warning("%s contains only NaN or Inf values" % name)
+            return 0., 0.
+        return (float(np.interp(pmin, percentiles, values)),
+                float(np.interp(pmax, percentiles, values)))
+
+    def percentile_function(self):
+        '''
+        Return a function giving the value at a percentile of the whole cube,
+        in the form returned by image_util.percentile_function.
+        '''
+        return lambda p: np.interp(p, PERCENTILES, self.global_percentiles)
+
+    def limits(self, pmin, pmax):
+        '''
+        Return the values at two percentiles of the whole cube.
+        '''
+        return self._limits(self.global_percentiles, pmin, pmax, 'Cube')
+
+    def slice_limits(self, slices, pmin, pmax):
+        '''
+        Return the values at two percentiles of one slice.
+        '''
+        index = np.ravel_multi_index(tuple(slices), self.sizes)
+        return self._limits(self.slice_percentiles[index], pmin, pmax, 'Slice',
+                            percentiles=SLICE_PERCENTILES)
+
+    def save(self, filename, key):
+        # Write to a temporary file first, so that the statistics file is
+        # never partially written
+        temporary = filename + '.tmp%i' % os.getpid()
+        with open(temporary, 'wb') as f:
+            np.savez(f, key=np.array(key), sizes=np.array(self.sizes),
+                     global_percentiles=self.global_percentiles,
+                     slice_percentiles=self.slice_percentiles)
+        getattr(os, 'replace', os.rename)(temporary, filename)
+
+    @classmethod
+    def load(cls, filename, key):
+        # Return the statistics saved in a file, or None if the file does
+        # not exist or is for a different version of the data
+        if not os.path.exists(filename):
+            return None
+        try:
+            with np.load(filename) as saved:
+                if str(saved['key']) != key:
+                    return None
+                return cls(saved['sizes'].tolist(), saved['global_percentiles'],
+                           saved['slice_percentiles'])
+        except Exception:
+            return None
+
+
+def _key(filename, hdu, dimensions, sizes):
+    return repr((VERSION, os.path.getmtime(filename), os.path.getsize(filename),
+                 hdu, tuple(dimensions), tuple(sizes), SLICE_SAMPLES, CUBE_SAMPLES))
+
+
+def cube_statistics(slicer, filename=None, hdu=0, dimensions=[0, 1]):
+    '''
+    Return the statistics of a cube, computing them if necessary.
+
+    If the cube was read from a file, the statistics are kept in memory and
+    saved next to the file (with the suffix SUFFIX), so that they are only
+    computed once for each version of the file. If the statistics cannot be
+    written next to the file, they are only kept in memory.
+    '''
+
+    if filename is None:
+        return CubeStatistics.compute(slicer)
+
+    filename = os.path.abspath(filename)
+    key = _key(filename, hdu, dimensions, slicer.sizes)
+    stats_file = filename + SUFFIX
+
+    with _memory_cache_lock:
+        if (stats_file, key) in _memory_cache:
+            stats = _memory_cache.pop((stats_file, key))
+            _memory_cache[stats_file, key] = stats
+            return stats
+
+    stats = CubeStatistics.load(stats_file, key)
+
+    if stats is None:
+        log.info("Computing statistics for %s" % filename)
+        stats = CubeStatistics.compute(slicer)
+        try:
+            stats.save(stats_file, key)
+        except (IOError, OSError):
+            log.info("Could not save statistics to %s" % stats_file)
+
+    with _memory_cache_lock:
+        _memory_cache[stats_file, key] = stats
+        while len(_memory_cache) > CACHE_SIZE:
+            _memory_cache.popitem(last=False)
+
+    return stats
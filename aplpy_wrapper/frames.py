@@ -0,0 +1,179 @@
+from __future__ import absolute_import, print_function, division
+
+import numpy as np
+
+# Celestial frame conversions. Each frame is related to FK5 (J2000) by a
+# rotation matrix, and the matrices for every pair of frames are computed
+# once when the module is imported. A conversion is then a single (N, 3) x
+# (3, 3) matrix multiplication of unit vectors, and no state is shared
+# between calls, so conversions can safely run in several threads.
+
+FRAMES = ['fk5', 'fk4', 'galactic', 'ecliptic']
+
+# Galactic conversion constants (position of the north galactic pole, and
+# galactic longitude of the north celestial pole)
+RA_NGP = np.radians(192.859508333333)
+DEC_NGP = np.radians(27.1283361111111)
+L_CP = np.radians(122.932)
+
+# Mean obliquity of the ecliptic at J2000
+OBLIQUITY = np.radians(23.4392911)
+
+
+def precession_matrix(equinox1, equinox2, fk4=False):
+    "Adapted from the IDL astronomy library"
+
+    deg_to_rad = np.pi / 180.
+    sec_to_rad = deg_to_rad / 3600.
+
+    t = 0.001 * (equinox2 - equinox1)
+
+    if not fk4:
+
+        st = 0.001 * (equinox1 - 2000.)
+
+        # Compute 3 rotation angles
+        a = sec_to_rad * t * (23062.181 + st * (139.656 + 0.0139 * st) + t * (30.188 - 0.344 * st + 17.998 * t))
+        b = sec_to_rad * t * t * (79.280 + 0.410 * st + 0.205 * t) + a
+        c = sec_to_rad * t * (20043.109 - st * (85.33 + 0.217 * st) + t * (- 42.665 - 0.217 * st - 41.833 * t))
+
+    else:
+
+        st = 0.001 * (equinox1 - 1900.)
+
+        # Compute 3 rotation angles
+        a = sec_to_rad * t * (23042.53 + st * (139.75 + 0.06 * st) + t * (30.23 - 0.27 * st + 18.0 * t))
+        b = sec_to_rad * t * t * (79.27 + 0.66 * st + 0.32 * t) + a
+        c = sec_to_rad * t * (20046.85 - st * (85.33 + 0.37 * st) + t * (- 42.67 - 0.37 * st - 41.8 * t))
+
+    sina = np.sin(a)
+    sinb = np.sin(b)
+    sinc = np.sin(c)
+    cosa = np.cos(a)
+    cosb = np.cos(b)
+    cosc = np.cos(c)
+
+    r = np.array([[cosa * cosb * cosc - sina * sinb, sina * cosb + cosa * sinb * cosc,  cosa * sinc],
+                  [- cosa * sinb - sina * cosb * cosc, cosa * cosb - sina * sinb * cosc, - sina * sinc],
+                  [- cosb * sinc, - sinb * sinc, cosc]])
+
+    return r
+
+
+def _unit_vector(lon, lat):
+    return np.array([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+def _galactic_matrix():
+    # The rows are the galactic x (towards the galactic center), y, and z
+    # (towards the north galactic pole) axes in FK5 coordinates.
+    z = _unit_vector(RA_NGP, DEC_NGP)
+    # The north celestial pole is at galactic longitude L_CP, so the
+    # galactic center is at position angle L_CP - 90 degrees from the
+    # celestial pole, as seen from the galactic pole.
+    pole = np.array([0., 0., 1.])
+    y_pole = pole - np.dot(pole, z) * z
+    y_pole /= np.linalg.norm(y_pole)
+    x_pole = np.cross(y_pole, z)
+    x = np.cos(L_CP) * y_pole + np.sin(L_CP) * x_pole
+    y = np.cross(z, x)
+    return np.vstack([x, y, z])
+
+
+def _ecliptic_matrix():
+    c, s = np.cos(OBLIQUITY), np.sin(OBLIQUITY)
+    return np.array([[1., 0., 0.], [0., c, s], [0., -s, c]])
+
+
+# Matrices converting unit vectors from each frame to FK5, and from FK5 to
+# each frame. For FK4, the two directions use separately computed
+# precession matrices, as in the original b1950toj2000/j2000tob1950.
+_TO_FK5 = {'fk5': np.identity(3),
+           'fk4': precession_matrix(1950., 2000.).transpose(),
+           'galactic': _galactic_matrix().transpose(),
+           'ecliptic': _ecliptic_matrix().transpose()}
+
+_FROM_FK5 = {'fk5': np.identity(3),
+             'fk4': precession_matrix(2000., 1950.).transpose(),
+             'galactic': _galactic_matrix(),
+             'ecliptic': _ecliptic_matrix()}
+
+MATRICES = {}
+for frame_in in FRAMES:
+    for frame_out in FRAMES:
+        matrix = np.dot(_FROM_FK5[frame_out], _TO_FK5[frame_in])
+        matrix.flags.writeable = False
+        MATRICES[frame_in, frame_out] = matrix
+
+
+def rotation_matrix(frame_in, frame_out):
+    '''
+    Return the matrix which converts unit vectors from one frame to another.
+    '''
+    try:
+        return MATRICES[frame_in, frame_out]
+    except KeyError:
+        raise ValueError("Cannot convert from %s to %s - frames should be one of %s" % (frame_in, frame_out, ', '.join(FRAMES)))
+
+
+def convert(lon, lat, frame_in, frame_out, out=None):
+    '''
+    Convert longitudes and latitudes (in degrees) from one frame to another.
+
+    Parameters
+    ----------
+
+    lon, lat : float or `~numpy.ndarray`
+        The coordinates to convert
+
+    frame_in, frame_out : str
+        The frames to convert from and to (one of fk5, fk4, galactic,
+        ecliptic)
+
+    out : tuple of two `~numpy.ndarray`, optional
+        Arrays in which to place the converted longitudes and latitudes.
+        These can be the input arrays, for an in-place conversion.
+
+    Returns the converted longitudes (between 0 and 360) and latitudes.
+    Single precision input is converted in single precision.
+    '''
+
+    matrix = rotation_matrix(frame_in, frame_out)
+
+    lon = np.asarray(lon)
+    lat = np.asarray(lat)
+    shape = np.broadcast(lon, lat).shape
+    dtype = np.result_type(lon, lat, np.float32)
+
+    lon_rad = np.radians(lon, dtype=dtype).reshape(-1)
+    lat_rad = np.radians(lat, dtype=dtype).reshape(-1)
+
+    cos_lat = np.cos(lat_rad)
+    vectors = np.empty((len(lon_rad), 3), dtype=dtype)
+    np.multiply(cos_lat, np.cos(lon_rad), out=vectors[:, 0])
+    np.multiply(cos_lat, np.sin(lon_rad), out=vectors[:, 1])
+    np.sin(lat_rad, out=vectors[:, 2])
+
+    vectors = np.dot(vectors, matrix.transpose().astype(dtype))
+
+    np.arctan2(vectors[:, 1], vectors[:, 0], out=vectors[:, 0])
+    np.degrees(vectors[:, 0], out=vectors[:, 0])
+    np.mod(vectors[:, 0], 360., out=vectors[:, 0])
+
+    np.clip(vectors[:, 2], -1., 1., out=vectors[:, 2])
+    np.arcsin(vectors[:, 2], out=vectors[:, 2])
+    np.degrees(vectors[:, 2], out=vectors[:, 2])
+
+    if out is None:
+        lon_out = np.empty(shape, dtype=dtype)
+        lat_out = np.empty(shape, dtype=dtype)
+    else:
+        lon_out, lat_out = out
+
+    lon_out[...] = vectors[:, 0].reshape(shape)
+    lat_out[...] = vectors[:, 2].reshape(shape)
+
+    if shape == ():
+        return lon_out[()], lat_out[()]
+    else:
+        return lon_out, lat_out
@@ -31,8 +31,8 @@ class Grid(object):
         self._figure = parent._figure
         self.x = x
         self.y = y
-        self.x_unit = self._wcs.wcs.cunit[self.x]
-        self.y_unit = self._wcs.wcs.cunit[self.y]
+        self.x_unit = self._wcs.geometry.cunits[self.x]
+        self.y_unit = self._wcs.geometry.cunits[self.y]
         self.grid_type = parent.grid_type
 
         # Save plotting parameters (required for @auto_refresh)
@@ -77,6 +77,22 @@ def percentile_function(array):
     return spl
 
 
+def auto_limits(vmin, vmax, stretch, min_auto=True, max_auto=True):
+    '''
+    Return the limits of a stretch from the values at the pmin and pmax
+    percentiles. For linear stretches, the limits which are set
+    automatically are moved out by 10% of the range.
+    '''
+
+    if min_auto and stretch == 'linear':
+        vmin = -0.1 * (vmax - vmin) + vmin
+
+    if max_auto and stretch == 'linear':
+        vmax = 0.1 * (vmax - vmin) + vmax
+
+    return vmin, vmax
+
+
 def stretch(array, function, exponent=2, midpoint=None):
 
     if function == 'linear':
@@ -1,12 +1,273 @@
 from __future__ import absolute_import, print_function, division
 
+import fnmatch
+from collections import OrderedDict
+
+import numpy as np
+
 from matplotlib.contour import ContourSet
-from matplotlib.collections import RegularPolyCollection, \
-    PatchCollection, CircleCollection, LineCollection
+from matplotlib.collections import Collection
 
 from .regions import ArtistCollection
 from .decorators import auto_refresh
 
+# The layer types, in the order in which they are checked when a layer is
+# added. Any other object with remove, get_visible, and set_visible methods
+# is treated as a collection.
+LAYER_TYPES = [(ContourSet, 'contour'),
+               (Collection, 'collection'),
+               (ArtistCollection, 'collection')]
+
+
+def _layer_type(artist):
+    for cls, layer_type in LAYER_TYPES:
+        if isinstance(artist, cls):
+            return layer_type
+    if hasattr(artist, 'remove') and hasattr(artist, 'get_visible') and hasattr(artist, 'set_visible'):
+        return 'collection'
+    raise Exception("Unknown layer type: " + str(type(artist)))
+
+
+def _collection_stats(collection):
+    '''
+    Return the number of items, the memory used by the vertices and offsets,
+    and the bounding box (xmin, xmax, ymin, ymax) of a collection.
+    '''
+
+    paths = collection.get_paths()
+    offsets = np.asarray(collection.get_offsets())
+
+    n_items = max(len(paths), len(offsets))
+    nbytes = offsets.nbytes + sum(path.vertices.nbytes for path in paths)
+
+    if collection.axes is None:
+        return n_items, nbytes, None
+
+    limits = collection.get_datalim(collection.axes.transData)
+    if np.all(np.isfinite(limits.bounds)):
+        return n_items, nbytes, (limits.x0, limits.x1, limits.y0, limits.y1)
+    else:
+        return n_items, nbytes, None
+
+
+def layer_stats(artist):
+    '''
+    Return the number of items, memory footprint in bytes, and bounding box
+    in pixel coordinates of a layer artist.
+
+    Artists can provide their own statistics through a _layer_stats method.
+    '''
+
+    if hasattr(artist, '_layer_stats'):
+        return artist._layer_stats()
+
+    if isinstance(artist, ContourSet):
+        children = artist.collections
+    elif isinstance(artist, Collection):
+        children = [artist]
+    else:
+        return 1, 0, None
+
+    return _combine([_collection_stats(child) for child in children])
+
+
+def _combine(stats):
+    n_items, nbytes, bbox = 0, 0, None
+    for n, b, box in stats:
+        n_items += n
+        nbytes += b
+        if box is not None:
+            if bbox is None:
+                bbox = box
+            else:
+                bbox = (min(bbox[0], box[0]), max(bbox[1], box[1]),
+                        min(bbox[2], box[2]), max(bbox[3], box[3]))
+    return n_items, nbytes, bbox
+
+
+def union_stats(artists):
+    '''
+    Combine the statistics of several artists.
+    '''
+    return _combine([layer_stats(artist) for artist in artists])
+
+
+class LayerRecord(object):
+    '''
+    A layer artist, with the metadata recorded when it was added.
+    '''
+
+    def __init__(self, name, artist, tags=(), parent=None, geometry=None,
+                 style=None):
+        self.name = name
+        self.tags = set(tags)
+        self.parent = parent
+        self.companions = []
+        self.geometry = geometry
+        self.style = style or {}
+        self.set_artist(artist)
+
+    def set_artist(self, artist):
+        '''
+        Replace the artist of the layer, keeping its name, tags and position
+        in the registry.
+        '''
+        self.artist = artist
+        self.type = _layer_type(artist)
+        if self.type == 'contour':
+            self.zorder = artist.collections[0].get_zorder() if len(artist.collections) > 0 else None
+        else:
+            self.zorder = artist.get_zorder() if hasattr(artist, 'get_zorder') else None
+        self.n_items, self.nbytes, self.bbox = layer_stats(artist)
+
+    def get_visible(self):
+        if self.type == 'contour':
+            return len(self.artist.collections) > 0 and self.artist.collections[0].get_visible()
+        else:
+            return self.artist.get_visible()
+
+    def set_visible(self, visible):
+        if self.type == 'contour':
+            for contour in self.artist.collections:
+                contour.set_visible(visible)
+        else:
+            self.artist.set_visible(visible)
+
+    def remove(self):
+        if self.type == 'contour':
+            for contour in self.artist.collections:
+                contour.remove()
+        else:
+            self.artist.remove()
+
+    def to_dict(self):
+        '''
+        Return the layer metadata as a dictionary (without the artist).
+        '''
+        return {'name': self.name, 'type': self.type,
+                'visible': self.get_visible(), 'zorder': self.zorder,
+                'bbox': self.bbox, 'n_items': self.n_items,
+                'nbytes': self.nbytes, 'tags': sorted(self.tags),
+                'parent': self.parent}
+
+
+class LayerRegistry(object):
+    '''
+    An ordered registry of layers.
+
+    This behaves like a dictionary mapping layer names to artists, but also
+    records the type, z-order, bounding box, number of items, memory
+    footprint, and tags of each layer when it is added, and keeps track of
+    companion layers (such as the text of region layers) which are removed
+    along with their parent.
+    '''
+
+    def __init__(self):
+        self._records = OrderedDict()
+        self._counters = {}
+
+    def next_name(self, prefix):
+        '''
+        Return the next automatic name for a layer of the given kind (e.g.
+        contour_set_1, contour_set_2, ...).
+        '''
+        self._counters[prefix] = self._counters.get(prefix, 0) + 1
+        return prefix + '_' + str(self._counters[prefix])
+
+    def add(self, name, artist, tags=(), parent=None, geometry=None,
+            style=None):
+        # Replacing a layer also drops the companions of the old layer from
+        # the registry, since they belong to the old artist
+        if name in self._records:
+            old = self._records[name]
+            self.pop(name)
+            for companion in old.companions:
+                if companion in self._records:
+                    self.pop(companion)
+        record = LayerRecord(name, artist, tags=tags, parent=parent,
+                             geometry=geometry, style=style)
+        self._records[name] = record
+        if parent is not None and parent in self._records:
+            self._records[parent].companions.append(name)
+        return record
+
+    def record(self, name):
+        return self._records[name]
+
+    def records(self):
+        return list(self._records.values())
+
+    def select(self, pattern='*', tag=None):
+        '''
+        Return the names of the layers matching a glob pattern and/or tag.
+        '''
+        return [name for name, record in self._records.items()
+                if fnmatch.fnmatchcase(name, pattern) and
+                (tag is None or tag in record.tags)]
+
+    def in_view(self, xmin, xmax, ymin, ymax):
+        '''
+        Return the names of the layers whose bounding box overlaps the given
+        range of pixel coordinates (layers with an unknown extent are always
+        included).
+        '''
+        names = []
+        for name, record in self._records.items():
+            if record.bbox is None or (record.bbox[0] <= xmax and record.bbox[1] >= xmin and
+                                       record.bbox[2] <= ymax and record.bbox[3] >= ymin):
+                names.append(name)
+        return names
+
+    def rename(self, name, new_name):
+        '''
+        Rename a layer, keeping its position in the registry.
+        '''
+        if new_name in self._records:
+            raise Exception("Layer " + new_name + " already exists")
+        records = OrderedDict()
+        for key, record in self._records.items():
+            if key == name:
+                record.name = new_name
+                key = new_name
+            if record.parent == name:
+                record.parent = new_name
+            record.companions = [new_name if companion == name else companion
+                                 for companion in record.companions]
+            records[key] = record
+        self._records = records
+
+    def pop(self, name):
+        record = self._records.pop(name)
+        if record.parent is not None and record.parent in self._records:
+            companions = self._records[record.parent].companions
+            if name in companions:
+                companions.remove(name)
+        return record.artist
+
+    def __setitem__(self, name, artist):
+        self.add(name, artist)
+
+    def __getitem__(self, name):
+        return self._records[name].artist
+
+    def __contains__(self, name):
+        return name in self._records
+
+    def __iter__(self):
+        return iter(list(self._records))
+
+    def __len__(self):
+        return len(self._records)
+
+    def keys(self):
+        return list(self._records)
+
+    def values(self):
+        return [record.artist for record in self._records.values()]
+
+    def items(self):
+        return [(name, record.artist) for name, record in self._records.items()]
+
 
 class Layers(object):
 
@@ -14,54 +275,19 @@ class Layers(object):
         pass
 
     def _layer_type(self, layer):
-        if isinstance(self._layers[layer], ContourSet):
-            return 'contour'
-        elif isinstance(self._layers[layer], RegularPolyCollection):
-            return 'collection'
-        elif isinstance(self._layers[layer], PatchCollection):
-            return 'collection'
-        elif isinstance(self._layers[layer], CircleCollection):
-            return 'collection'
-        elif isinstance(self._layers[layer], LineCollection):
-            return 'collection'
-        elif isinstance(self._layers[layer], ArtistCollection):
-            return 'collection'
-        elif hasattr(self._layers[layer], 'remove') and hasattr(self._layers[layer], 'get_visible') and hasattr(self._layers[layer], 'set_visible'):
-            return 'collection'
-        else:
-            raise Exception("Unknown layer type: " + \
-                str(type(self._layers[layer])))
+        return self._layers.record(layer).type
 
     def _initialize_layers(self):
 
-        self._layers = {}
-        self._contour_counter = 0
-        self._scatter_counter = 0
-        self._circle_counter = 0
-        self._ellipse_counter = 0
-        self._rectangle_counter = 0
-        self._linelist_counter = 0
-        self._region_counter = 0
-        self._label_counter = 0
-        self._poly_counter = 0
+        self._layers = LayerRegistry()
 
     def list_layers(self):
         '''
         Print a list of layers to standard output.
         '''
 
-        layers_list = []
-
-        for layer in self._layers:
-
-            layer_type = self._layer_type(layer)
-
-            if layer_type == 'contour':
-                visible = self._layers[layer].collections[0].get_visible()
-            elif layer_type == 'collection':
-                visible = self._layers[layer].get_visible()
-
-            layers_list.append({'name': layer, 'visible': visible})
+        layers_list = [{'name': record.name, 'visible': record.get_visible()}
+                       for record in self._layers.records()]
 
         n_layers = len(layers_list)
         if n_layers == 0:
@@ -78,6 +304,47 @@ class Layers(object):
                 else:
                     print("   -> " + layer['name'] + " (hidden)")
 
+    def layer_stats(self):
+        '''
+        Return a list of dictionaries describing each layer.
+
+        The dictionaries contain the name, type, visibility, z-order,
+        bounding box (in pixel coordinates), number of items, memory
+        footprint (in bytes) and tags of each layer.
+        '''
+        return [record.to_dict() for record in self._layers.records()]
+
+    def tag_layer(self, layer, *tags):
+        '''
+        Add tags to a layer, which can then be used to hide, show, or remove
+        several layers at once.
+
+        Parameters
+        ----------
+        layer : str
+            The name of the layer to tag
+
+        tags : str
+            One or more tags
+        '''
+        self._layers.record(layer).tags.update(tags)
+
+    def rename_layer(self, layer, new_name):
+        '''
+        Rename a layer.
+
+        Parameters
+        ----------
+        layer : str
+            The name of the layer to rename
+
+        new_name : str
+            The new name of the layer
+        '''
+        if layer not in self._layers:
+            raise Exception("Layer " + layer + " does not exist")
+        self._layers.rename(layer, new_name)
+
     # @auto_refresh
     def remove_layer(self, layer, raise_exception=True):
         '''
@@ -91,18 +358,12 @@ class Layers(object):
 
         if layer in self._layers:
 
-            layer_type = self._layer_type(layer)
-
-            if layer_type == 'contour':
-                for contour in self._layers[layer].collections:
-                    contour.remove()
-                self._layers.pop(layer)
-            elif layer_type == 'collection':
-                self._layers[layer].remove()
-                self._layers.pop(layer)
-                if (layer + '_txt') in self._layers:
-                    self._layers[layer + '_txt'].remove()
-                    self._layers.pop(layer + '_txt')
+            record = self._layers.record(layer)
+            record.remove()
+            self._layers.pop(layer)
+            for companion in list(record.companions):
+                self._layers.record(companion).remove()
+                self._layers.pop(companion)
 
         else:
 
@@ -124,13 +385,7 @@ class Layers(object):
         '''
         if layer in self._layers:
 
-            layer_type = self._layer_type(layer)
-
-            if layer_type == 'contour':
-                for contour in self._layers[layer].collections:
-                    contour.set_visible(False)
-            elif layer_type == 'collection':
-                self._layers[layer].set_visible(False)
+            self._layers.record(layer).set_visible(False)
 
         else:
 
@@ -151,18 +406,60 @@ class Layers(object):
         '''
         if layer in self._layers:
 
-            layer_type = self._layer_type(layer)
-
-            if layer_type == 'contour':
-                for contour in self._layers[layer].collections:
-                    contour.set_visible(True)
-            elif layer_type == 'collection':
-                self._layers[layer].set_visible(True)
+            self._layers.record(layer).set_visible(True)
 
         else:
             if raise_exception:
                 raise Exception("Layer " + layer + " does not exist")
 
+    # @auto_refresh
+    def remove_layers(self, pattern='*', tag=None):
+        '''
+        Remove all the layers matching a pattern and/or tag.
+
+        Parameters
+        ----------
+        pattern : str, optional
+            A glob pattern for the layer names, e.g. 'contour_set_*'
+
+        tag : str, optional
+            If specified, only layers with this tag are removed
+        '''
+        for layer in self._layers.select(pattern, tag):
+            self.remove_layer(layer, raise_exception=False)
+
+    # @auto_refresh
+    def hide_layers(self, pattern='*', tag=None):
+        '''
+        Hide all the layers matching a pattern and/or tag.
+
+        Parameters
+        ----------
+        pattern : str, optional
+            A glob pattern for the layer names, e.g. 'contour_set_*'
+
+        tag : str, optional
+            If specified, only layers with this tag are hidden
+        '''
+        for layer in self._layers.select(pattern, tag):
+            self._layers.record(layer).set_visible(False)
+
+    # @auto_refresh
+    def show_layers(self, pattern='*', tag=None):
+        '''
+        Show all the layers matching a pattern and/or tag.
+
+        Parameters
+        ----------
+        pattern : str, optional
+            A glob pattern for the layer names, e.g. 'contour_set_*'
+
+        tag : str, optional
+            If specified, only layers with this tag are shown
+        '''
+        for layer in self._layers.select(pattern, tag):
+            self._layers.record(layer).set_visible(True)
+
     def get_layer(self, layer, raise_exception=True):
         '''
         Return a layer object.
@@ -0,0 +1,196 @@
+from __future__ import absolute_import, print_function, division
+
+import numpy as np
+
+from matplotlib.artist import Artist, allow_rasterization
+from matplotlib.lines import Line2D
+from matplotlib.image import AxesImage
+from matplotlib.collections import EllipseCollection, PolyCollection
+
+
+def rectangle_vertices(xp, yp, wp, hp, angle=None):
+    '''
+    Return an (N, 4, 2) array with the corners of N rectangles centered on
+    (xp, yp), with widths wp and heights hp, rotated anti-clockwise by angle
+    (in degrees).
+    '''
+
+    dx = np.array([-0.5, 0.5, 0.5, -0.5])[np.newaxis, :] * wp[:, np.newaxis]
+    dy = np.array([-0.5, -0.5, 0.5, 0.5])[np.newaxis, :] * hp[:, np.newaxis]
+
+    if angle is not None:
+        theta = np.radians(angle)[:, np.newaxis]
+        dx, dy = dx * np.cos(theta) - dy * np.sin(theta), \
+                 dx * np.sin(theta) + dy * np.cos(theta)
+
+    return np.dstack((xp[:, np.newaxis] + dx, yp[:, np.newaxis] + dy))
+
+
+class _LevelOfDetailArtist(Artist):
+    '''
+    The artist added to the axes for a LevelOfDetail layer, which updates
+    the layer each time it is drawn, and then draws its points and shapes.
+    '''
+
+    def __init__(self, layer):
+        Artist.__init__(self)
+        self._layer = layer
+
+    @allow_rasterization
+    def draw(self, renderer):
+        if not self.get_visible():
+            return
+        self._layer._update()
+        self._layer._points.draw(renderer)
+        if self._layer._shapes is not None:
+            self._layer._shapes.draw(renderer)
+
+
+class LevelOfDetail(object):
+    '''
+    A layer of shapes whose representation depends on the zoom level.
+
+    Shapes that would appear smaller than threshold screen pixels are drawn as
+    points (mode='points') or as a density image (mode='density'), and the
+    remaining shapes are drawn as true shapes, but only if they fall within the
+    current view. The rules are re-evaluated each time the layer is drawn, so
+    that they follow the view limits, the size of the figure, and its
+    resolution (for example when saving with a different dpi).
+    '''
+
+    def __init__(self, ax, shape, xp, yp, wp, hp, angle=None, threshold=2.,
+                 mode='points', zorder=None, density_bin=4, **kwargs):
+
+        if mode not in ['points', 'density']:
+            raise ValueError("mode should be one of 'points' or 'density'")
+
+        self._ax = ax
+        self._shape = shape
+        self._xp = np.asarray(xp, dtype=float)
+        self._yp = np.asarray(yp, dtype=float)
+        self._wp = np.asarray(wp, dtype=float)
+        self._hp = np.asarray(hp, dtype=float)
+        if angle is None:
+            self._angle = np.zeros(len(self._xp))
+        else:
+            self._angle = np.asarray(angle, dtype=float)
+        self._size = np.maximum(self._wp, self._hp)
+        self._threshold = threshold
+        self._mode = mode
+        self._density_bin = density_bin
+        self._kwargs = kwargs
+        self._visible = True
+        self._zorder = zorder
+        self._state = None
+
+        self._shapes = None
+
+        color = kwargs.get('edgecolor', kwargs.get('color', 'black'))
+
+        if mode == 'points':
+            self._points = Line2D([], [], linestyle='none', marker='.',
+                                  markersize=1, color=color)
+        else:
+            self._points = AxesImage(self._ax, cmap='gray_r', origin='lower',
+                                     interpolation='nearest', alpha=0.7)
+        self._attach(self._points)
+
+        # The points and shapes are drawn by a single artist added to the
+        # axes, rather than being added to the axes themselves
+        self._artist = _LevelOfDetailArtist(self)
+        self._ax.add_artist(self._artist)
+        self._artist.set_transform(ax.transData)
+
+        if zorder is not None:
+            self._artist.set_zorder(zorder)
+
+    def _attach(self, artist):
+        # Set up an artist drawn by this layer as if it was added to the axes
+        artist.set_figure(self._ax.figure)
+        artist.axes = self._ax
+        if not artist.is_transform_set():
+            artist.set_transform(self._ax.transData)
+        artist.set_clip_path(self._ax.patch)
+
+    def _pixel_scale(self):
+        '''
+        Return the number of screen pixels per image pixel.
+        '''
+        p = self._ax.transData.transform([[0., 0.], [1., 0.], [0., 1.]])
+        return min(np.hypot(*(p[1] - p[0])), np.hypot(*(p[2] - p[0])))
+
+    def _make_shapes(self, keep):
+
+        kwargs = self._kwargs.copy()
+        kwargs.setdefault('facecolor', 'none')
+
+        if self._shape == 'ellipse':
+            return EllipseCollection(self._wp[keep], self._hp[keep],
+                                     self._angle[keep], units='xy',
+                                     offsets=np.column_stack((self._xp[keep], self._yp[keep])),
+                                     transOffset=self._ax.transData, **kwargs)
+        elif self._shape == 'rectangle':
+            return PolyCollection(rectangle_vertices(self._xp[keep], self._yp[keep],
+                                                     self._wp[keep], self._hp[keep],
+                                                     self._angle[keep]), **kwargs)
+        else:
+            raise ValueError("Unknown shape: %s" % self._shape)
+
+    def _update(self):
+
+        xmin, xmax = sorted(self._ax.get_xlim())
+        ymin, ymax = sorted(self._ax.get_ylim())
+        scale = self._pixel_scale()
+
+        # Only do the work if the view has changed since the last evaluation
+        state = (xmin, xmax, ymin, ymax, scale)
+        if state == self._state:
+            return
+        self._state = state
+
+        half = 0.5 * self._size
+        visible = (self._xp + half >= xmin) & (self._xp - half <= xmax) & \
+                  (self._yp + half >= ymin) & (self._yp - half <= ymax)
+
+        large = visible & (self._size * scale >= self._threshold)
+        small = visible & ~large
+
+        if self._mode == 'points':
+            self._points.set_data(self._xp[small], self._yp[small])
+        else:
+            nx = max(1, int((xmax - xmin) * scale / self._density_bin))
+            ny = max(1, int((ymax - ymin) * scale / self._density_bin))
+            density, _, _ = np.histogram2d(self._xp[small], self._yp[small],
+                                           bins=(nx, ny),
+                                           range=((xmin, xmax), (ymin, ymax)))
+            self._points.set_data(np.ma.masked_equal(density.transpose(), 0.))
+            self._points.set_extent((xmin, xmax, ymin, ymax))
+
+        self._shapes = None
+        if np.any(large):
+            self._shapes = self._make_shapes(large)
+            self._attach(self._shapes)
+
+    def _layer_stats(self):
+        nbytes = sum(array.nbytes for array in [self._xp, self._yp, self._wp,
+                                                self._hp, self._angle, self._size])
+        if len(self._xp) == 0:
+            return 0, nbytes, None
+        half = 0.5 * self._size
+        return len(self._xp), nbytes, ((self._xp - half).min(), (self._xp + half).max(),
+                                       (self._yp - half).min(), (self._yp + half).max())
+
+    def remove(self):
+        self._artist.remove()
+        self._shapes = None
+
+    def get_visible(self):
+        return self._visible
+
+    def set_visible(self, visible=True):
+        self._visible = visible
+        self._artist.set_visible(visible)
+
+    def set_zorder(self, zorder):
+        self._zorder = zorder
+        self._artist.set_zorder(zorder)
@@ -0,0 +1,174 @@
+from __future__ import absolute_import, print_function, division
+
+import numpy as np
+from astropy import log
+from astropy.io import fits
+
+from . import wcs_util
+from . import reproject as reproject_util
+
+COMBINE = ['mean', 'median']
+
+
+def mosaic_header(headers, wcs_list):
+    '''
+    Return the header of a north-aligned mosaic covering all the images.
+
+    The mosaic uses the projection and celestial system of the first image,
+    and the smallest pixel scale of all the images.
+    '''
+
+    system, equinox, units = wcs_util.system(wcs_list[0])
+    if system['name'] == 'unknown':
+        raise Exception("Cannot build a mosaic from images without celestial coordinates")
+
+    # The positions along the edges of all the images, in the (non-inverted)
+    # system of the first image
+    output = (dict(system, inverted=False), equinox)
+    lon, lat = [], []
+    for header, wcs in zip(headers, wcs_list):
+        xp, yp = reproject_util.edge_positions(header['NAXIS1'], header['NAXIS2'])
+        xw, yw = wcs.wcs_pix2world(xp, yp, 1)
+        system_in, equinox_in, units_in = wcs_util.system(wcs)
+        xw, yw = wcs_util.convert_coords(xw, yw, (system_in, equinox_in), output)
+        lon.append(xw)
+        lat.append(yw)
+    lon, lat = np.hstack(lon), np.hstack(lat)
+
+    # Center the mosaic on the mean direction of the edges
+    lon_rad, lat_rad = np.radians(lon), np.radians(lat)
+    x = np.nanmean(np.cos(lat_rad) * np.cos(lon_rad))
+    y = np.nanmean(np.cos(lat_rad) * np.sin(lon_rad))
+    z = np.nanmean(np.sin(lat_rad))
+    center = (np.degrees(np.arctan2(y, x)) % 360., np.degrees(np.arctan2(z, np.hypot(x, y))))
+
+    scale = min(reproject_util.pixel_scale(wcs) for wcs in wcs_list)
+
+    return reproject_util.aligned_header(headers[0], system, lon, lat,
+                                         center, scale)
+
+
+def _median(stack, count):
+    # The median of the finite values along the first axis. NaN values are
+    # sorted to the end, so the median of the count finite values is
+    # found directly, without the warnings emitted by nanmedian for pixels
+    # with no data.
+    stack = np.sort(stack, axis=0)
+    low = np.maximum(count - 1, 0) // 2
+    high = np.maximum(count, 1) // 2
+    result = 0.5 * (np.take_along_axis(stack, low[np.newaxis], axis=0)[0] +
+                    np.take_along_axis(stack, high[np.newaxis], axis=0)[0])
+    result[count == 0] = np.nan
+    return result
+
+
+def mosaic(filenames, hdu=0, combine='mean', mode='bilinear', threads=None,
+           tile_size=reproject_util.TILE_SIZE):
+    '''
+    Reproject and co-add several overlapping 2-d images into a mosaic.
+
+    Parameters
+    ----------
+
+    filenames : list
+        The FITS files to combine
+
+    hdu : int, optional
+        The HDU to read from each file
+
+    combine : str, optional
+        Whether to combine overlapping images with their 'mean' or 'median'
+
+    mode : str, optional
+        The reprojection mode (see `~aplpy_wrapper.reproject.reproject`)
+
+    threads : int, optional
+        The number of threads used to compute the tiles of the mosaic. By
+        default, one thread per CPU is used for large mosaics.
+
+    tile_size : int, optional
+        The size of the square tiles in which the mosaic is computed
+
+    The mosaic is computed one tile at a time, and each tile only
+    reprojects the images which overlap it. The input files are memory
+    mapped and closed once the mosaic has been computed, and large mosaics
+    are written to a temporary memory-mapped file. Returns an HDU
+    containing the mosaic, and an array with the number of images
+    contributing to each pixel.
+    '''
+
+    if combine not in COMBINE:
+        raise ValueError("combine should be one of %s" % ', '.join(COMBINE))
+
+    if len(filenames) == 0:
+        raise ValueError("At least one file is required to build a mosaic")
+
+    hdulists = []
+    try:
+        for filename in filenames:
+            hdulists.append(fits.open(filename, memmap=True))
+        return _mosaic([reproject_util.image_2d(hdulist[hdu]) for hdulist in hdulists],
+                       combine, mode, threads, tile_size)
+    finally:
+        # The mosaic is written to a separate array, so the input files
+        # can be closed once it has been computed
+        for hdulist in hdulists:
+            hdulist.close()
+
+
+def _mosaic(images, combine, mode, threads, tile_size):
+    # Build the mosaic from a list of (data, header) pairs
+    wcs_list = [wcs_util.get_wcs(header) for data, header in images]
+
+    header = mosaic_header([header for data, header in images], wcs_list)
+    wcs_out = wcs_util.get_wcs(header)
+    shape = (header['NAXIS2'], header['NAXIS1'])
+
+    log.info("Building %i x %i mosaic from %i images" % (shape[1], shape[0], len(images)))
+
+    # The range of pixels of the mosaic covered by each image
+    boxes = []
+    for (data, image_header), wcs in zip(images, wcs_list):
+        xp, yp = reproject_util.edge_positions(image_header['NAXIS1'], image_header['NAXIS2'])
+        xo, yo = wcs_util.pix2pix(wcs, wcs_out, xp, yp)
+        boxes.append((np.nanmin(xo), np.nanmax(xo), np.nanmin(yo), np.nanmax(yo)))
+
+    oversample = [reproject_util.oversample_factor(wcs, wcs_out) if mode == 'flux' else None
+                  for wcs in wcs_list]
+
+    dtype = np.result_type(np.float32, *[data.dtype for data, image_header in images])
+    output = reproject_util.output_array(shape, dtype)
+    coverage = reproject_util.output_array(shape, np.int16)
+
+    def work(tile):
+
+        y0, y1, x0, x1 = tile
+
+        blocks = []
+        for i, (data, image_header) in enumerate(images):
+            xmin, xmax, ymin, ymax = boxes[i]
+            if xmax < x0 + 0.5 or xmin > x1 + 0.5 or ymax < y0 + 0.5 or ymin > y1 + 0.5:
+                continue
+            blocks.append(reproject_util.reproject_block(data, wcs_list[i], wcs_out,
+                                                         tile, mode, oversample[i]))
+
+        if len(blocks) == 0:
+            output[y0:y1, x0:x1] = np.nan
+            coverage[y0:y1, x0:x1] = 0
+            return
+
+        stack = np.array(blocks)
+        count = np.isfinite(stack).sum(axis=0)
+
+        if combine == 'mean':
+            with np.errstate(invalid='ignore', divide='ignore'):
+                output[y0:y1, x0:x1] = np.where(count > 0, np.nansum(stack, axis=0) / count, np.nan)
+        else:
+            output[y0:y1, x0:x1] = _median(stack, count)
+
+        coverage[y0:y1, x0:x1] = count
+
+    reproject_util.map_tiles(work, reproject_util.tiles(shape, tile_size),
+                             reproject_util.default_threads(shape, threads))
+
+    return fits.PrimaryHDU(output, header), coverage
@@ -80,7 +80,7 @@ class Scalebar(object):
         self._base_settings['borderpad'] = borderpad
         self._base_settings['pad'] = pad
 
-        degrees_per_pixel = wcs_util.degperpix(self._wcs)
+        degrees_per_pixel = self._wcs.geometry.degperpix
 
         length = length / degrees_per_pixel
 
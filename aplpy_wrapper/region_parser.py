@@ -0,0 +1,404 @@
+from __future__ import absolute_import, print_function, division
+
+import re
+
+import numpy as np
+from astropy import log
+
+from . import wcs_util
+
+# Coordinate systems recognized in region files, and the corresponding
+# (system, equinox) pairs used by wcs_util.convert_coords
+FRAMES = {'fk5': 'fk5', 'j2000': 'fk5', 'icrs': 'fk5',
+          'fk4': 'fk4', 'b1950': 'fk4',
+          'galactic': 'galactic', 'ecliptic': 'ecliptic',
+          'image': 'image', 'physical': 'image'}
+
+SYSTEMS = {'fk5': ({'name': 'equatorial', 'inverted': False}, 'j2000'),
+           'fk4': ({'name': 'equatorial', 'inverted': False}, 'b1950'),
+           'galactic': ({'name': 'galactic', 'inverted': False}, 'none'),
+           'ecliptic': ({'name': 'ecliptic', 'inverted': False}, 'none')}
+
+# Matplotlib markers for the ds9 point types
+POINT_MARKERS = {'circle': 'o', 'box': 's', 'diamond': 'D', 'cross': '+',
+                 'x': 'x', 'arrow': '^', 'boxcircle': 'o'}
+
+SHAPES = ['circle', 'ellipse', 'box', 'polygon', 'point', 'line', 'text']
+
+_shape_re = re.compile(r'^[+-]?\s*(?:(\w+)\s+)?(\w+)\s*\(')
+_attr_re = re.compile(r'(\w+)\s*=\s*(\{[^}]*\}|"[^"]*"|\'[^\']*\'|[^\s#]+(?:\s+\d+(?=\s|$))?)')
+
+
+def _opens_quote(text, i):
+    '''
+    Return whether the character at index i of text opens a quoted string.
+    Quotes directly after a number are units of arcseconds or arcminutes.
+    '''
+    return text[i] in '"\'' and (i == 0 or not (text[i - 1].isdigit() or text[i - 1] == '.'))
+
+
+def _split_statements(line):
+    '''
+    Split a line on semicolons, ignoring those inside braces or quotes.
+    '''
+    statements = []
+    depth = 0
+    quote = None
+    start = 0
+    for i, char in enumerate(line):
+        if quote:
+            if char == quote:
+                quote = None
+        elif _opens_quote(line, i):
+            quote = char
+        elif char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+        elif char == ';' and depth == 0:
+            statements.append(line[start:i])
+            start = i + 1
+    statements.append(line[start:])
+    return [s.strip() for s in statements if s.strip()]
+
+
+def _match_shape(statement):
+    '''
+    Split a shape statement into the point type (if any), the shape name,
+    the text of the arguments, and the remaining text. The arguments end at
+    the parenthesis closing the opening one, ignoring parentheses inside
+    braces or quotes (e.g. in text strings). Returns None if the statement
+    is not a shape.
+    '''
+    match = _shape_re.match(statement)
+    if match is None:
+        return None
+    depth = 1
+    quote = None
+    for i in range(match.end(), len(statement)):
+        char = statement[i]
+        if quote:
+            if char == quote:
+                quote = None
+        elif char == '{':
+            quote = '}'
+        elif _opens_quote(statement, i):
+            quote = char
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+            if depth == 0:
+                return (match.group(1), match.group(2),
+                        statement[match.end():i], statement[i + 1:].strip())
+    return None
+
+
+def _parse_attributes(text):
+    attributes = {}
+    for key, value in _attr_re.findall(text):
+        if value[0] in '{"\'':
+            value = value[1:-1]
+        attributes[key.lower()] = value
+    return attributes
+
+
+def _split_arguments(text):
+    '''
+    Split the arguments of a shape on commas (or whitespace), keeping text
+    in braces or quotes together.
+    '''
+    arguments = []
+    for item in re.findall(r'\{[^}]*\}|"[^"]*"|\'[^\']*\'|[^,\s]+', text):
+        arguments.append(item)
+    return arguments
+
+
+def parse_position(value, frame, hours=False):
+    '''
+    Convert a position value to degrees (or to pixels for the image frame).
+
+    Sexagesimal values can be given either as colon-separated values or with
+    h/d/m/s separators. If hours is True, sexagesimal values are interpreted
+    as hours (e.g. for right ascension).
+    '''
+
+    if frame == 'image':
+        return float(value)
+
+    if ':' in value or re.search('[hms]', value):
+        sign = -1. if value.startswith('-') else 1.
+        parts = [float(p) for p in re.split('[:hdms]', value.lstrip('+-')) if p]
+        parts += [0.] * (3 - len(parts))
+        result = sign * (parts[0] + parts[1] / 60. + parts[2] / 3600.)
+        if hours:
+            result *= 15.
+        return result
+    elif value.endswith('d'):
+        return float(value[:-1])
+    else:
+        return float(value)
+
+
+def parse_size(value, frame):
+    '''
+    Convert a size value to degrees, or to pixels for sizes in pixel units or
+    in the image frame. Returns the size and whether it is in pixels.
+    '''
+
+    unit = value[-1]
+
+    if unit == '"':
+        return float(value[:-1]) / 3600., False
+    elif unit == "'":
+        return float(value[:-1]) / 60., False
+    elif unit == 'd':
+        return float(value[:-1]), False
+    elif unit == 'r':
+        return np.degrees(float(value[:-1])), False
+    elif unit in 'pi':
+        return float(value[:-1]), True
+    else:
+        return float(value), frame == 'image'
+
+
+class _Columns(object):
+    '''
+    Accumulate the values of each shape type in lists, and convert them to
+    arrays once the whole file has been read.
+    '''
+
+    def __init__(self):
+        self.columns = {}
+
+    def append(self, name, **values):
+        group = self.columns.setdefault(name, {})
+        for key in values:
+            group.setdefault(key, []).append(values[key])
+
+    def arrays(self):
+        for name in self.columns:
+            for key in self.columns[name]:
+                if key != 'vertices':
+                    self.columns[name][key] = np.array(self.columns[name][key])
+        return self.columns
+
+
+def _parse_shape(columns, frame, marker, name, arguments, attributes):
+
+    style = dict(frame=frame, color=attributes.get('color', 'green'),
+                 linewidth=float(attributes.get('width', 1)),
+                 linestyle='dashed' if attributes.get('dash', '0') == '1' else 'solid')
+
+    hours = frame in ['fk5', 'fk4']
+
+    x = parse_position(arguments[0], frame, hours=hours)
+    y = parse_position(arguments[1], frame)
+
+    if name == 'circle':
+        r, pixel_size = parse_size(arguments[2], frame)
+        columns.append('ellipse', x=x, y=y, width=2. * r, height=2. * r,
+                       angle=0., width_pixels=pixel_size,
+                       height_pixels=pixel_size, **style)
+    elif name in ['ellipse', 'box']:
+        w, width_pixels = parse_size(arguments[2], frame)
+        h, height_pixels = parse_size(arguments[3], frame)
+        angle = float(arguments[-1]) if len(arguments) > 4 else 0.
+        if name == 'ellipse':
+            w, h = 2. * w, 2. * h
+        columns.append(name, x=x, y=y, width=w, height=h, angle=angle,
+                       width_pixels=width_pixels, height_pixels=height_pixels,
+                       **style)
+    elif name == 'polygon':
+        vertices = [(parse_position(arguments[i], frame, hours=hours),
+                     parse_position(arguments[i + 1], frame))
+                    for i in range(0, len(arguments) - 1, 2)]
+        columns.append('polygon', vertices=np.array(vertices), **style)
+    elif name == 'line':
+        columns.append('line', x1=x, y1=y,
+                       x2=parse_position(arguments[2], frame, hours=hours),
+                       y2=parse_position(arguments[3], frame), **style)
+    elif name == 'point':
+        marker = marker or attributes.get('point', 'boxcircle').split()[0]
+        columns.append('point', x=x, y=y, marker=POINT_MARKERS.get(marker, 'o'),
+                       **style)
+    elif name == 'text':
+        if len(arguments) > 2:
+            text = arguments[2].strip('{}"\'')
+        else:
+            text = attributes.get('text', '')
+        columns.append('text', x=x, y=y, text=text, color=style['color'],
+                       frame=frame, offset=0.)
+        return
+
+    if attributes.get('text', ''):
+        columns.append('text', x=x, y=y, text=attributes['text'],
+                       color=style['color'], frame=frame, offset=1.)
+
+
+def parse(lines):
+    '''
+    Parse the lines of a ds9 region file.
+
+    The common shapes (circle, ellipse, box, polygon, point, line, and text)
+    are supported, with positions in sexagesimal or decimal degrees in the
+    fk5, fk4, icrs, galactic, and ecliptic frames, or in image pixels. The
+    lines are processed one at a time, and the values for each shape type
+    are returned as a dictionary of columnar Numpy arrays, with positions in
+    degrees (or pixels for the image frame). Circles are returned as
+    ellipses with equal width and height.
+    '''
+
+    columns = _Columns()
+    frame = 'fk5'
+    defaults = {}
+    skipped = set()
+
+    for line in lines:
+
+        line = line.strip()
+
+        if line.startswith('# text('):
+            line = line[2:]
+        elif not line or line.startswith('#'):
+            continue
+
+        for statement in _split_statements(line):
+
+            keyword = statement.split('(')[0].strip().lower()
+
+            if keyword in FRAMES:
+                frame = FRAMES[keyword]
+                continue
+
+            if keyword.startswith('global'):
+                defaults = _parse_attributes(statement[6:])
+                continue
+
+            match = _match_shape(statement)
+            if match is None:
+                continue
+
+            marker, name, arguments, rest = match
+            name = name.lower()
+
+            if name not in SHAPES:
+                skipped.add(name)
+                continue
+
+            if marker is not None and name != 'point':
+                continue
+
+            attributes = defaults.copy()
+            attributes.update(_parse_attributes(rest))
+
+            _parse_shape(columns, frame, marker, name,
+                         _split_arguments(arguments), attributes)
+
+    for name in sorted(skipped):
+        log.warning("Region type '{0}' is not supported by the native parser - skipping".format(name))
+
+    return columns.arrays()
+
+
+def parse_file(filename):
+    '''
+    Parse a ds9 region file, reading it one line at a time.
+    '''
+    with open(filename, 'r') as f:
+        return parse(f)
+
+
+def _world2pix(wcs, x, y, frame, image_system):
+    '''
+    Convert positions in a region frame to pixel coordinates, in a single
+    call for all the positions.
+    '''
+
+    if frame == 'image':
+        return x, y
+
+    if image_system[0]['name'] == 'unknown':
+        raise Exception("Cannot show regions in the %s frame on an image without celestial coordinates" % frame)
+
+    x, y = wcs_util.convert_coords(x, y, SYSTEMS[frame], image_system)
+
+    return wcs_util.world2pix(wcs, x, y)
+
+
+def to_image(columns, wcs, text_offset=5.0):
+    '''
+    Convert parsed regions to pixel coordinates.
+
+    The positions in each frame are converted with a single vectorized call,
+    and angles are corrected for the orientation of north in the image.
+    Returns a new dictionary of columns in the format expected by
+    regions.shape_artists.
+    '''
+
+    system, equinox, units = wcs_util.system(wcs)
+    image_system = (system, equinox)
+    scale = wcs_util.degperpix(wcs)
+
+    result = {}
+
+    def convert(x, y, frame):
+        xp = np.zeros(len(x))
+        yp = np.zeros(len(x))
+        for f in np.unique(frame):
+            keep = frame == f
+            xp[keep], yp[keep] = _world2pix(wcs, x[keep], y[keep], f, image_system)
+        return xp, yp
+
+    for name in ['ellipse', 'box']:
+
+        if name not in columns:
+            continue
+
+        g = columns[name]
+        xp, yp = convert(g['x'], g['y'], g['frame'])
+
+        # Find the direction of north at each position
+        xn, yn = convert(g['x'], g['y'] + 1. / 3600., g['frame'])
+        north = np.where(g['frame'] == 'image', 0.,
+                         np.degrees(np.arctan2(-(xn - xp), yn - yp)))
+
+        # Sizes in pixels are kept separately for each axis, since the
+        # width and height can be given in different units
+        result[name] = dict(x=xp, y=yp,
+                            width=g['width'] * np.where(g['width_pixels'], 1., 1. / scale),
+                            height=g['height'] * np.where(g['height_pixels'], 1., 1. / scale),
+                            angle=g['angle'] + north, color=g['color'],
+                            linewidth=g['linewidth'], linestyle=g['linestyle'])
+
+    if 'polygon' in columns:
+        g = columns['polygon']
+        n = [len(v) for v in g['vertices']]
+        vertices = np.vstack(g['vertices'])
+        xp, yp = convert(vertices[:, 0], vertices[:, 1], np.repeat(g['frame'], n))
+        vertices = np.split(np.column_stack((xp, yp)), np.cumsum(n)[:-1])
+        result['polygon'] = dict(vertices=vertices, color=g['color'],
+                                 linewidth=g['linewidth'], linestyle=g['linestyle'])
+
+    if 'line' in columns:
+        g = columns['line']
+        xp, yp = convert(np.hstack([g['x1'], g['x2']]), np.hstack([g['y1'], g['y2']]),
+                         np.hstack([g['frame'], g['frame']]))
+        n = len(g['x1'])
+        result['line'] = dict(x1=xp[:n], y1=yp[:n], x2=xp[n:], y2=yp[n:],
+                              color=g['color'], linewidth=g['linewidth'],
+                              linestyle=g['linestyle'])
+
+    if 'point' in columns:
+        g = columns['point']
+        xp, yp = convert(g['x'], g['y'], g['frame'])
+        result['point'] = dict(x=xp, y=yp, marker=g['marker'], color=g['color'],
+                               linewidth=g['linewidth'], linestyle=g['linestyle'])
+
+    if 'text' in columns:
+        g = columns['text']
+        xp, yp = convert(g['x'], g['y'], g['frame'])
+        result['text'] = dict(x=xp, y=yp + g['offset'] * text_offset,
+                              text=g['text'], color=g['color'])
+
+    return result
@@ -1,8 +1,23 @@
 from __future__ import absolute_import, print_function, division
 
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from matplotlib.artist import Artist, allow_rasterization
+from matplotlib.text import Text
+from matplotlib.markers import MarkerStyle
+from matplotlib.transforms import IdentityTransform
+from matplotlib.collections import EllipseCollection, PolyCollection, \
+    LineCollection, PathCollection
+
 from astropy import log
 
 from .decorators import auto_refresh
+from .lod import rectangle_vertices
+from . import region_parser
+from . import wcs_util
 
 
 class Regions:
@@ -41,7 +56,7 @@ class Regions:
     """
 
     # @auto_refresh
-    def show_regions(self, region_file, layer=False, **kwargs):
+    def show_regions(self, region_file, layer=False, parser='native', **kwargs):
         """
         Overplot regions as specified in the region file.
 
@@ -55,35 +70,249 @@ class Regions:
         layer: str, optional
             The name of the layer
 
+        parser: { 'native', 'pyregion' }, optional
+            Whether to read region files with the built-in parser, which
+            supports the common shapes and does not require pyregion, or
+            with pyregion.
+
         kwargs
             Additional keyword arguments, e.g. zorder, will be passed to the
             ds9 call and onto the patchcollections.
         """
 
-        PC, TC = ds9(region_file, self._header, **kwargs)
+        PC, TC = ds9(region_file, self._header, ax=self.ax, wcs=self._wcs,
+                     parser=parser, **kwargs)
 
-        #ffpc = self._ax1.add_collection(PC)
-        PC.add_to_axes(self._ax1)
-        TC.add_to_axes(self._ax1)
+        PC.add_to_axes(self.ax)
+        TC.add_to_axes(self.ax)
 
         if layer:
             region_set_name = layer
+            self.remove_layer(region_set_name, raise_exception=False)
         else:
-            self._region_counter += 1
-            region_set_name = 'region_set_' + str(self._region_counter)
+            region_set_name = self._layers.next_name('region_set')
 
         self._layers[region_set_name] = PC
-        self._layers[region_set_name + "_txt"] = TC
+        self._layers.add(region_set_name + "_txt", TC, parent=region_set_name)
+
+
+# Parsed region files, keyed by (absolute path, modification time, parser)
+_region_cache = OrderedDict()
+_region_cache_size = 16
+
+POINT_MARKERS = region_parser.POINT_MARKERS
+
+
+def read_region_file(region_file, parser='pyregion'):
+    """
+    Read a ds9 region file, caching the result by path and modification time
+    so that a file is only parsed again if it has changed on disk.
+
+    With parser='pyregion' a pyregion ShapeList is returned, and with
+    parser='native' a dictionary of columnar arrays from the built-in parser.
+    """
+
+    filename = os.path.abspath(region_file)
+    key = (filename, os.path.getmtime(filename), parser)
+
+    if key in _region_cache:
+        _region_cache[key] = _region_cache.pop(key)
+        return _region_cache[key]
+
+    for old_key in list(_region_cache):
+        if old_key[0] == filename and old_key[2] == parser:
+            _region_cache.pop(old_key)
+
+    if parser == 'native':
+        rr = region_parser.parse_file(filename)
+    elif parser == 'pyregion':
+        import pyregion
+        rr = pyregion.open(filename)
+    else:
+        raise ValueError("parser should be one of 'native' or 'pyregion'")
+
+    _region_cache[key] = rr
+    while len(_region_cache) > _region_cache_size:
+        _region_cache.popitem(last=False)
+
+    return rr
+
+
+def group_shapes(shape_list, text_offset=5.0):
+    """
+    Group the shapes of a pyregion ShapeList in image coordinates by type,
+    returning a dictionary of columnar arrays for each type, as well as a
+    ShapeList of the shapes that cannot be grouped.
+
+    pyregion and aplpy both correct for the FITS standard origin=1,1 so the
+    pixel coordinates are shifted by one here to avoid double-correcting.
+    """
+
+    columns = {}
+    other = []
+
+    def append(name, **values):
+        group = columns.setdefault(name, {})
+        for key in values:
+            group.setdefault(key, []).append(values[key])
+
+    for r in shape_list:
+
+        c = r.coord_list
+        attr = r.attr[1]
+        style = dict(color=attr.get('color', 'green'),
+                     linewidth=float(attr.get('width', 1)),
+                     linestyle='dashed' if attr.get('dash', '0') == '1' else 'solid')
+
+        if r.name == 'circle':
+            append('ellipse', x=c[0] + 1, y=c[1] + 1, width=2. * c[2],
+                   height=2. * c[2], angle=0., **style)
+        elif r.name == 'ellipse':
+            append('ellipse', x=c[0] + 1, y=c[1] + 1, width=2. * c[2],
+                   height=2. * c[3], angle=c[-1] if len(c) > 4 else 0.,
+                   **style)
+        elif r.name in ['box', 'rotbox']:
+            append('box', x=c[0] + 1, y=c[1] + 1, width=c[2], height=c[3],
+                   angle=c[-1] if len(c) > 4 else 0., **style)
+        elif r.name == 'polygon':
+            append('polygon', vertices=np.array(c).reshape(-1, 2) + 1, **style)
+        elif r.name == 'line':
+            append('line', x1=c[0] + 1, y1=c[1] + 1, x2=c[2] + 1, y2=c[3] + 1,
+                   **style)
+        elif r.name == 'point':
+            append('point', x=c[0] + 1, y=c[1] + 1,
+                   marker=POINT_MARKERS.get(attr.get('point', 'boxcircle').split()[0], 'o'),
+                   **style)
+        elif r.name == 'text':
+            append('text', x=c[0] + 1, y=c[1] + 1, text=attr.get('text', ''),
+                   color=style['color'])
+            continue
+        else:
+            other.append(r)
+            continue
+
+        if attr.get('text', ''):
+            append('text', x=c[0] + 1, y=c[1] + 1 + text_offset,
+                   text=attr['text'], color=style['color'])
+
+    for name in columns:
+        for key in columns[name]:
+            if key != 'vertices':
+                columns[name][key] = np.array(columns[name][key])
+
+    return columns, other
+
+
+def shape_artists(columns, ax=None, **kwargs):
+    """
+    Make one array-backed collection per shape type (and one per point
+    marker), and a single TextCollection for all the labels, from a
+    dictionary of columnar region arrays in pixel coordinates.
+    """
+
+    if ax is None:
+        offset_transform = None
+    else:
+        offset_transform = ax.transData
+
+    artists = []
+
+    def style(group):
+        properties = dict(edgecolors=group['color'],
+                          linewidths=group['linewidth'],
+                          linestyles=list(group['linestyle']))
+        properties.update(kwargs)
+        return properties
+
+    if 'ellipse' in columns:
+        g = columns['ellipse']
+        artists.append(EllipseCollection(g['width'], g['height'], g['angle'],
+                                         units='xy',
+                                         offsets=np.column_stack((g['x'], g['y'])),
+                                         transOffset=offset_transform,
+                                         transform=IdentityTransform(),
+                                         facecolors='none', **style(g)))
+
+    if 'box' in columns:
+        g = columns['box']
+        artists.append(PolyCollection(rectangle_vertices(g['x'], g['y'],
+                                                         g['width'], g['height'],
+                                                         g['angle']),
+                                      facecolors='none', **style(g)))
+
+    if 'polygon' in columns:
+        g = columns['polygon']
+        artists.append(PolyCollection(g['vertices'], facecolors='none', **style(g)))
+
+    if 'line' in columns:
+        g = columns['line']
+        segments = np.dstack((np.column_stack((g['x1'], g['x2'])),
+                              np.column_stack((g['y1'], g['y2']))))
+        properties = style(g)
+        properties['colors'] = properties.pop('edgecolors')
+        artists.append(LineCollection(segments, **properties))
+
+    if 'point' in columns:
+        g = columns['point']
+        for marker in np.unique(g['marker']):
+            keep = g['marker'] == marker
+            marker = MarkerStyle(marker)
+            path = marker.get_path().transformed(marker.get_transform())
+            subset = dict((key, g[key][keep]) for key in g)
+            artists.append(PathCollection([path], sizes=[121.],
+                                          offsets=np.column_stack((subset['x'], subset['y'])),
+                                          transOffset=offset_transform,
+                                          transform=IdentityTransform(),
+                                          facecolors='none', **style(subset)))
+
+    if 'text' in columns:
+        g = columns['text']
+        texts = TextCollection(g['x'], g['y'], g['text'], colors=g['color'])
+    else:
+        texts = TextCollection([], [], [])
 
+    return artists, texts
 
-def ds9(region_file, header, zorder=3, **kwargs):
+
+def ds9(region_file, header, zorder=3, ax=None, wcs=None, parser='native',
+        **kwargs):
     """
     Wrapper to return a PatchCollection given a ds9 region file
     and a fits header.
 
+    Shapes are grouped by type into a small number of array-backed
+    collections, and all the text labels are drawn by a single artist.
+    Region files are read with the built-in parser by default, and with
+    pyregion if parser='pyregion' or if a pyregion.ShapeList is given. In
+    the latter case, shapes that cannot be grouped (e.g. annuli and pandas)
+    are drawn with the patches returned by pyregion.
+
     zorder - defaults to 3 so that regions are on top of contours
     """
 
+    if 'text_offset' in kwargs:
+        text_offset = kwargs['text_offset']
+        del kwargs['text_offset']
+    else:
+        text_offset = 5.0
+
+    if isinstance(region_file, basestring) and parser == 'native':
+
+        if wcs is None:
+            wcs = wcs_util.get_wcs(header)
+
+        columns = region_parser.to_image(read_region_file(region_file, parser='native'),
+                                         wcs, text_offset=text_offset)
+
+        artists, texts = shape_artists(columns, ax=ax, **kwargs)
+
+        PC = ArtistCollection(artists)
+        TC = ArtistCollection([texts])
+        PC.set_zorder(zorder)
+        TC.set_zorder(zorder)
+
+        return PC, TC
+
     try:
         import pyregion
     except:
@@ -91,7 +320,7 @@ def ds9(region_file, header, zorder=3, **kwargs):
 
     # read region file
     if isinstance(region_file, basestring):
-        rr = pyregion.open(region_file)
+        rr = read_region_file(region_file, parser='pyregion')
     elif isinstance(region_file, pyregion.ShapeList):
         rr = region_file
     else:
@@ -100,45 +329,39 @@ def ds9(region_file, header, zorder=3, **kwargs):
     # convert coordinates to image coordinates
     rrim = rr.as_imagecoord(header)
 
-    # pyregion and aplpy both correct for the FITS standard origin=1,1
-    # need to avoid double-correcting. Also, only some items in `coord_list`
-    # are pixel coordinates, so which ones should be corrected depends on the
-    # shape.
-    for r in rrim:
-        if r.name == 'polygon':
-            correct = range(len(r.coord_list))
-        elif r.name == 'line':
-            correct = range(4)
-        elif r.name in ['rotbox', 'box', 'ellipse', 'annulus', 'circle', 'panda', 'pie', 'epanda', 'text', 'point', 'vector']:
-            correct = range(2)
-        else:
-            log.warning("Unknown region type '{0}' - please report to the developers")
-            correct = range(2)
-        for i in correct:
-            r.coord_list[i] += 1
+    columns, other = group_shapes(rrim, text_offset=text_offset)
 
-    if 'text_offset' in kwargs:
-        text_offset = kwargs['text_offset']
-        del kwargs['text_offset']
-    else:
-        text_offset = 5.0
+    artists, texts = shape_artists(columns, ax=ax, **kwargs)
+
+    if len(other) > 0:
+
+        for r in other:
+            if r.name not in ['annulus', 'panda', 'pie', 'epanda', 'vector']:
+                log.warning("Unknown region type '{0}' - please report to the developers".format(r.name))
+            for i in range(2):
+                r.coord_list[i] += 1
 
-    # grab the shapes to overplot
-    pp, aa = rrim.get_mpl_patches_texts(text_offset=text_offset)
+        pp, aa = pyregion.ShapeList(other).get_mpl_patches_texts(text_offset=text_offset)
+        artists.extend(pp)
+        artists.extend(aa)
 
-    PC = ArtistCollection(pp, **kwargs)  # preserves line style (dashed)
-    TC = ArtistCollection(aa, **kwargs)
+    PC = ArtistCollection(artists)
+    TC = ArtistCollection([texts])
     PC.set_zorder(zorder)
     TC.set_zorder(zorder)
 
     return PC, TC
 
 
-class ArtistCollection():
+class ArtistCollection(Artist):
     """
     Matplotlib collections can't handle Text.
-    This is a barebones collection for text objects
-    that supports removing and making (in)visible
+    This is a barebones container for collections, patches and text
+    objects that supports removing and making (in)visible.
+
+    Only the container is added to the axes, and it draws its artists
+    itself, so that showing, hiding, reordering, or removing the whole
+    collection does not depend on the number of artists it contains.
     """
 
     def __init__(self, artistlist):
@@ -146,27 +369,194 @@ class ArtistCollection():
         Pass in a list of matplotlib.text.Text objects
         (or possibly any matplotlib Artist will work)
         """
+        Artist.__init__(self)
         self.artistlist = artistlist
 
-    def remove(self):
-        for T in self.artistlist:
-            T.remove()
+    def __len__(self):
+        return len(self.artistlist)
 
     def add_to_axes(self, ax):
         for T in self.artistlist:
-            ax.add_artist(T)
-
-    def get_visible(self):
-        visible = True
+            T.axes = ax
+            T.set_figure(ax.figure)
+            if not T.is_transform_set():
+                T.set_transform(ax.transData)
+            T.set_clip_path(ax.patch)
+        ax.add_artist(self)
+
+    @allow_rasterization
+    def draw(self, renderer):
+        if not self.get_visible():
+            return
         for T in self.artistlist:
-            if not T.get_visible():
-                visible = False
-        return visible
+            T.draw(renderer)
 
-    def set_visible(self, visible=True):
-        for T in self.artistlist:
-            T.set_visible(visible)
+    def _layer_stats(self):
+        from .layers import union_stats
+        return union_stats(self.artistlist)
 
-    def set_zorder(self, zorder):
-        for T in self.artistlist:
-            T.set_zorder(zorder)
+
+class TextCollection(Artist):
+    """
+    A single artist that draws many text labels.
+
+    Rather than creating one Text instance per label, the positions, strings
+    and colors are stored as arrays and a single Text instance is reused to
+    draw each label that falls within the axes.
+
+    If cull is True, labels that would overlap with labels drawn before
+    them (in the order given) are skipped. This is evaluated at draw time,
+    so the labels that are shown depend on the zoom level. Overlaps are
+    found using a grid index in screen space, so that each label is only
+    compared to the labels already drawn in neighboring grid cells.
+    """
+
+    def __init__(self, x, y, text, colors=None, cull=False, cull_pad=2.,
+                 **kwargs):
+        Artist.__init__(self)
+        self._x = np.asarray(x, dtype=float)
+        self._y = np.asarray(y, dtype=float)
+        self._text = np.asarray(text, dtype=object)
+        if colors is None:
+            self._colors = None
+        else:
+            self._colors = np.asarray(colors, dtype=object)
+        self._cull = cull
+        self._cull_pad = cull_pad
+        kwargs.setdefault('horizontalalignment', 'center')
+        kwargs.setdefault('verticalalignment', 'center')
+        self._label = Text(0., 0., '', **kwargs)
+
+    def __len__(self):
+        return len(self._text)
+
+    def _layer_stats(self):
+        nbytes = self._x.nbytes + self._y.nbytes + self._text.nbytes
+        if len(self._text) == 0 or (self.axes is not None and
+                                    self.get_transform() is not self.axes.transData):
+            return len(self._text), nbytes, None
+        return len(self._text), nbytes, (self._x.min(), self._x.max(),
+                                         self._y.min(), self._y.max())
+
+    def set_cull(self, cull):
+        """
+        Set whether to skip labels that overlap with other labels.
+        """
+        self._cull = cull
+
+    def _visible_indices(self):
+        """
+        Return the indices and display coordinates of the labels that fall
+        within the axes.
+        """
+
+        if len(self._text) == 0:
+            return np.array([], dtype=int), np.zeros((0, 2))
+
+        xy = self.get_transform().transform(np.column_stack((self._x, self._y)))
+
+        if self.axes is None:
+            return np.arange(len(self._text)), xy
+
+        bbox = self.axes.bbox
+        keep = np.nonzero((xy[:, 0] >= bbox.x0) & (xy[:, 0] <= bbox.x1) &
+                          (xy[:, 1] >= bbox.y0) & (xy[:, 1] <= bbox.y1))[0]
+
+        return keep, xy[keep]
+
+    def _extent(self, renderer, metrics, text, x, y):
+        """
+        Return the display-space bounding box of an unrotated label.
+
+        Measuring every label with the renderer is much slower than drawing
+        the labels that are kept, so the width is estimated as the sum of
+        the widths of the characters (ignoring kerning), which are only
+        measured once per draw and cached in metrics.
+        """
+
+        label = self._label
+
+        if 'height' not in metrics:
+            _, metrics['height'], metrics['descent'] = \
+                renderer.get_text_width_height_descent(
+                    'lp', label.get_fontproperties(), ismath=False)
+
+        width = 0.
+        for char in text:
+            if char not in metrics:
+                metrics[char] = renderer.get_text_width_height_descent(
+                    char, label.get_fontproperties(), ismath=False)[0]
+            width += metrics[char]
+
+        height, descent = metrics['height'], metrics['descent']
+
+        halign = label.get_horizontalalignment()
+        if halign == 'center':
+            x0 = x - 0.5 * width
+        elif halign == 'right':
+            x0 = x - width
+        else:
+            x0 = x
+
+        valign = label.get_verticalalignment()
+        if valign == 'center':
+            y0 = y - 0.5 * height
+        elif valign == 'top':
+            y0 = y - height
+        elif valign == 'baseline':
+            y0 = y - descent
+        else:
+            y0 = y
+
+        return x0, y0, x0 + width, y0 + height
+
+    def _overlaps(self, grid, cell, x0, y0, x1, y1):
+
+        i0, i1 = int(x0 // cell), int(x1 // cell)
+        j0, j1 = int(y0 // cell), int(y1 // cell)
+
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                for (u0, v0, u1, v1) in grid.get((i, j), ()):
+                    if x0 < u1 and u0 < x1 and y0 < v1 and v0 < y1:
+                        return True
+
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                grid.setdefault((i, j), []).append((x0, y0, x1, y1))
+
+        return False
+
+    @allow_rasterization
+    def draw(self, renderer):
+
+        if not self.get_visible():
+            return
+
+        label = self._label
+        label.set_figure(self.figure)
+        label.set_transform(self.get_transform())
+        label.set_zorder(self.get_zorder())
+
+        grid = {}
+        metrics = {}
+        cell = None
+        pad = self._cull_pad
+
+        indices, xy = self._visible_indices()
+
+        for i, (x, y) in zip(indices, xy):
+
+            if self._cull:
+                x0, y0, x1, y1 = self._extent(renderer, metrics, self._text[i], x, y)
+                if cell is None:
+                    cell = max(x1 - x0, y1 - y0, 1.) + 2. * pad
+                if self._overlaps(grid, cell, x0 - pad, y0 - pad,
+                                  x1 + pad, y1 + pad):
+                    continue
+
+            label.set_position((self._x[i], self._y[i]))
+            label.set_text(self._text[i])
+            if self._colors is not None:
+                label.set_color(self._colors[i])
+            label.draw(renderer)
@@ -0,0 +1,390 @@
+from __future__ import absolute_import, print_function, division
+
+import re
+import tempfile
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+from astropy import log
+from astropy.io import fits
+
+from . import wcs_util
+
+MODES = ['nearest', 'bilinear', 'flux']
+
+# The number of reprojected images kept by each figure for re-use
+CACHE_SIZE = 4
+
+# The size (in pixels) of the square tiles in which the output image is
+# computed, and the number of output pixels above which several threads
+# are used by default
+TILE_SIZE = 512
+PARALLEL_SIZE = 4000000
+
+# Output images with at least this many pixels are written to a temporary
+# memory-mapped file rather than held in memory
+MEMMAP_SIZE = 50000000
+
+# The number of positions sampled along each edge of the input image to
+# determine the extent of the north-aligned image
+EDGE_SAMPLES = 100
+
+# The maximum number of sub-pixels along each axis used to average the
+# input over the area of each output pixel in flux-conserving mode
+MAX_OVERSAMPLE = 16
+
+# Keywords describing distortions and projection parameters of the input
+# image, which do not apply to the north-aligned image (SIP polynomials,
+# projection parameters, and the native pole)
+_distortion_re = re.compile(r'^((A|B|AP|BP)_(ORDER|DMAX|\d+_\d+)|PV\d+_\d+|LONPOLE|LATPOLE)$')
+
+
+def pixel_scale(wcs):
+    # The pixel scale (in degrees) from the area of the pixels, which does
+    # not depend on the rotation of the image
+    return np.sqrt(np.abs(np.linalg.det(wcs.celestial.pixel_scale_matrix)))
+
+
+def edge_positions(nx, ny):
+    '''
+    Return pixel positions sampled along the edges of an image.
+    '''
+    tx = np.linspace(0.5, nx + 0.5, EDGE_SAMPLES)
+    ty = np.linspace(0.5, ny + 0.5, EDGE_SAMPLES)
+    xp = np.hstack([tx, tx, np.repeat(0.5, EDGE_SAMPLES), np.repeat(nx + 0.5, EDGE_SAMPLES)])
+    yp = np.hstack([np.repeat(0.5, EDGE_SAMPLES), np.repeat(ny + 0.5, EDGE_SAMPLES), ty, ty])
+    return xp, yp
+
+
+def aligned_header(header, system, lon, lat, center, scale):
+    '''
+    Return the header of a north-aligned image covering the positions (lon,
+    lat), centered on center=(lon, lat) with pixels of size scale (in
+    degrees). The projection, system and other keywords are taken from
+    header, without any SIP distortion or projection parameters.
+    '''
+
+    ctype_lon, ctype_lat = [re.sub('-SIP$', '', header[keyword]) for keyword in ['CTYPE1', 'CTYPE2']]
+    if system['inverted']:
+        ctype_lon, ctype_lat = ctype_lat, ctype_lon
+
+    new = header.copy()
+    for keyword in list(new.keys()):
+        if keyword.startswith(('CTYPE', 'CRVAL', 'CRPIX', 'CDELT', 'CROTA', 'CUNIT', 'CD1_', 'CD2_', 'PC1_', 'PC2_')) or \
+           keyword in ['PC001001', 'PC001002', 'PC002001', 'PC002002'] or \
+           _distortion_re.match(keyword):
+            del new[keyword]
+
+    # The data are already scaled, and blank pixels are NaN
+    for keyword in ['BLANK', 'BSCALE', 'BZERO']:
+        new.remove(keyword, ignore_missing=True)
+
+    new['CTYPE1'] = ctype_lon
+    new['CTYPE2'] = ctype_lat
+    new['CRVAL1'] = center[0]
+    new['CRVAL2'] = center[1]
+    new['CDELT1'] = -scale
+    new['CDELT2'] = scale
+    new['CRPIX1'] = 0.
+    new['CRPIX2'] = 0.
+
+    # Find the extent of the positions on the new grid, and shift the
+    # reference pixel so that the image starts at the first pixel
+    xn, yn = wcs_util.get_wcs(new).wcs_world2pix(lon, lat, 1)
+    finite = np.isfinite(xn) & np.isfinite(yn)
+    xn, yn = xn[finite], yn[finite]
+
+    # The tolerance avoids an extra row or column from rounding errors
+    new['NAXIS1'] = max(1, int(np.ceil(xn.max() - xn.min() - 1.e-6)))
+    new['NAXIS2'] = max(1, int(np.ceil(yn.max() - yn.min() - 1.e-6)))
+    new['CRPIX1'] = 0.5 - xn.min()
+    new['CRPIX2'] = 0.5 - yn.min()
+
+    return new
+
+
+def north_header(header, wcs=None):
+    '''
+    Return the header of a north-aligned image covering the same area of
+    sky as a 2-d image, with the same projection and pixel scale.
+
+    The edges of the input image are projected onto the new grid to find the
+    size of the output image, so images containing a celestial pole may be
+    cropped.
+    '''
+
+    if wcs is None:
+        wcs = wcs_util.get_wcs(header)
+
+    system, equinox, units = wcs_util.system(wcs)
+    if system['name'] == 'unknown':
+        raise Exception("Cannot align an image without celestial coordinates with north")
+
+    nx, ny = header['NAXIS1'], header['NAXIS2']
+    xp, yp = edge_positions(nx, ny)
+
+    lon, lat = wcs.wcs_pix2world(np.hstack([xp, [0.5 * (nx + 1)]]),
+                                 np.hstack([yp, [0.5 * (ny + 1)]]), 1)
+    if system['inverted']:
+        lon, lat = lat, lon
+
+    return aligned_header(header, system, lon[:-1], lat[:-1],
+                          (lon[-1], lat[-1]), pixel_scale(wcs))
+
+
+def _nearest(data, xi, yi):
+    '''
+    Sample an image at the nearest pixel to FITS pixel positions (xi, yi).
+    Positions outside the image are set to NaN.
+    '''
+    ny, nx = data.shape
+    ix = np.floor(xi - 0.5)
+    iy = np.floor(yi - 0.5)
+    valid = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+    values = np.empty(xi.shape, dtype=np.result_type(data.dtype, np.float32))
+    values.fill(np.nan)
+    values[valid] = data[iy[valid].astype(int), ix[valid].astype(int)]
+    return values
+
+
+def _bilinear(data, xi, yi):
+    '''
+    Interpolate an image linearly between the four nearest pixels to FITS
+    pixel positions (xi, yi). Blank neighbours are ignored, and positions
+    outside the image are set to NaN.
+    '''
+
+    ny, nx = data.shape
+    dtype = np.result_type(data.dtype, np.float32)
+
+    u = xi - 1.
+    v = yi - 1.
+    valid = (u >= -0.5) & (u <= nx - 0.5) & (v >= -0.5) & (v <= ny - 0.5)
+    u, v = u[valid], v[valid]
+
+    i0 = np.clip(np.floor(u), 0, max(nx - 2, 0)).astype(int)
+    j0 = np.clip(np.floor(v), 0, max(ny - 2, 0)).astype(int)
+    i1 = np.minimum(i0 + 1, nx - 1)
+    j1 = np.minimum(j0 + 1, ny - 1)
+    fu = np.clip(u - i0, 0., 1.)
+    fv = np.clip(v - j0, 0., 1.)
+
+    total = np.zeros(len(u), dtype=dtype)
+    weights = np.zeros(len(u), dtype=dtype)
+    for j, i, w in [(j0, i0, (1. - fu) * (1. - fv)), (j0, i1, fu * (1. - fv)),
+                    (j1, i0, (1. - fu) * fv), (j1, i1, fu * fv)]:
+        values = data[j, i]
+        finite = np.isfinite(values)
+        total[finite] += w[finite] * values[finite]
+        weights[finite] += w[finite]
+
+    result = np.empty(xi.shape, dtype=dtype)
+    result.fill(np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        result[valid] = np.where(weights > 0., total / weights, np.nan)
+    return result
+
+
+def oversample_factor(wcs_in, wcs_out):
+    ratio = pixel_scale(wcs_out) / pixel_scale(wcs_in)
+    return int(min(MAX_OVERSAMPLE, max(2, np.ceil(2. * ratio))))
+
+
+def reproject_block(data, wcs_in, wcs_out, tile, mode, oversample=None):
+    '''
+    Reproject an image onto the block (y0, y1, x0, x1) of an output grid, and
+    return the block.
+    '''
+
+    y0, y1, x0, x1 = tile
+
+    if mode == 'flux':
+
+        # The transformation is computed exactly at the corners of the output
+        # pixels, and interpolated linearly to the sub-pixels in between.
+        # Each output pixel is the mean of the input over its area, which
+        # conserves the total flux of surface brightness images.
+        xc, yc = np.meshgrid(np.arange(x0, x1 + 1) + 0.5, np.arange(y0, y1 + 1) + 0.5)
+        xc, yc = wcs_util.pix2pix(wcs_out, wcs_in, xc, yc)
+
+        total = np.zeros((y1 - y0, x1 - x0))
+        count = np.zeros((y1 - y0, x1 - x0))
+        steps = (np.arange(oversample) + 0.5) / oversample
+        for fy in steps:
+            for fx in steps:
+                xi = (1. - fx) * (1. - fy) * xc[:-1, :-1] + fx * (1. - fy) * xc[:-1, 1:] + \
+                     (1. - fx) * fy * xc[1:, :-1] + fx * fy * xc[1:, 1:]
+                yi = (1. - fx) * (1. - fy) * yc[:-1, :-1] + fx * (1. - fy) * yc[:-1, 1:] + \
+                     (1. - fx) * fy * yc[1:, :-1] + fx * fy * yc[1:, 1:]
+                values = _nearest(data, xi, yi)
+                finite = np.isfinite(values)
+                total[finite] += values[finite]
+                count[finite] += 1
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(count > 0, total / count, np.nan)
+
+    else:
+
+        xo, yo = np.meshgrid(np.arange(x0, x1) + 1., np.arange(y0, y1) + 1.)
+        xi, yi = wcs_util.pix2pix(wcs_out, wcs_in, xo, yo)
+
+        if mode == 'nearest':
+            return _nearest(data, xi, yi)
+        else:
+            return _bilinear(data, xi, yi)
+
+
+def tiles(shape, tile_size=TILE_SIZE):
+    '''
+    Return the (y0, y1, x0, x1) ranges of the tiles covering an image.
+    '''
+    ny, nx = shape
+    return [(y0, min(y0 + tile_size, ny), x0, min(x0 + tile_size, nx))
+            for y0 in range(0, ny, tile_size)
+            for x0 in range(0, nx, tile_size)]
+
+
+def map_tiles(function, tile_list, threads):
+    '''
+    Call function for each tile, in a pool of threads if threads > 1.
+    '''
+    if threads > 1 and len(tile_list) > 1:
+        pool = ThreadPool(min(threads, len(tile_list)))
+        try:
+            for _ in pool.imap_unordered(function, tile_list):
+                pass
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for tile in tile_list:
+            function(tile)
+
+
+def default_threads(shape, threads=None):
+    if threads is None:
+        return multiprocessing.cpu_count() if shape[0] * shape[1] >= PARALLEL_SIZE else 1
+    return max(1, int(threads))
+
+
+def output_array(shape, dtype):
+    '''
+    Return an empty output image, backed by a temporary memory-mapped file
+    if it has more than MEMMAP_SIZE pixels.
+    '''
+    if shape[0] * shape[1] >= MEMMAP_SIZE:
+        # The temporary file is kept open as long as the array (or any view
+        # of it) exists, and is deleted when it is closed
+        f = tempfile.TemporaryFile(prefix='aplpy_reproject_')
+        array = np.memmap(f, dtype=dtype, mode='w+', shape=shape)
+        array._file = f
+        return array
+    else:
+        return np.empty(shape, dtype=dtype)
+
+
+def reproject(data, wcs_in, wcs_out, shape_out, mode='bilinear', threads=None,
+              tile_size=TILE_SIZE, oversample=None):
+    '''
+    Reproject a 2-d image onto a new pixel grid.
+
+    Parameters
+    ----------
+
+    data : `~numpy.ndarray`
+        The image to reproject
+
+    wcs_in, wcs_out : `~aplpy_wrapper.wcs_util.WCS`
+        The WCS of the input image and of the output grid
+
+    shape_out : tuple
+        The shape (ny, nx) of the output image
+
+    mode : str, optional
+        'nearest' uses the value of the nearest input pixel, 'bilinear'
+        interpolates linearly between the four nearest input pixels, and
+        'flux' averages the input over the area of each output pixel, so
+        that the total flux is conserved.
+
+    threads : int, optional
+        The number of threads used to compute the output tiles. By default,
+        one thread per CPU is used for images larger than PARALLEL_SIZE
+        pixels.
+
+    tile_size : int, optional
+        The size of the square tiles in which the output is computed
+
+    oversample : int, optional
+        The number of sub-pixels along each axis used in flux mode. By
+        default, this is set from the ratio of the pixel scales.
+
+    The coordinates of all the pixels in each tile are converted with
+    single vectorized calls. Output images larger than MEMMAP_SIZE pixels
+    are returned as memory-mapped arrays backed by a temporary file.
+    '''
+
+    if mode not in MODES:
+        raise ValueError("mode should be one of %s" % ', '.join(MODES))
+
+    data = np.asarray(data) if not isinstance(data, np.ndarray) else data
+    if data.ndim != 2:
+        raise ValueError("Only 2-d images can be reprojected")
+
+    if mode == 'flux' and oversample is None:
+        oversample = oversample_factor(wcs_in, wcs_out)
+
+    output = output_array(shape_out, np.result_type(data.dtype, np.float32))
+
+    def work(tile):
+        y0, y1, x0, x1 = tile
+        output[y0:y1, x0:x1] = reproject_block(data, wcs_in, wcs_out, tile,
+                                               mode, oversample)
+
+    map_tiles(work, tiles(shape_out, tile_size),
+              default_threads(shape_out, threads))
+
+    return output
+
+
+def image_2d(hdu):
+    '''
+    Return the data and header of an image HDU, removing any extra
+    dimensions of size one.
+    '''
+
+    data = hdu.data
+    header = hdu.header
+
+    if data.ndim > 2:
+        if any(n > 1 for n in data.shape[:-2]):
+            raise Exception("Only 2-d images can be reprojected")
+        data = data.reshape(data.shape[-2:])
+        header = header.copy()
+        for dim in range(3, header['NAXIS'] + 1):
+            for keyword in ['NAXIS', 'CTYPE', 'CRVAL', 'CRPIX', 'CDELT', 'CUNIT']:
+                header.remove(keyword + str(dim), ignore_missing=True)
+        header['NAXIS'] = 2
+
+    return data, header
+
+
+def reproject_north(hdu, mode='bilinear', threads=None):
+    '''
+    Reproject a 2-d image HDU so that north is up, and return a new HDU.
+    '''
+
+    data, header = image_2d(hdu)
+
+    wcs_in = wcs_util.get_wcs(header)
+    header_out = north_header(header, wcs_in)
+    wcs_out = wcs_util.get_wcs(header_out)
+
+    shape_out = (header_out['NAXIS2'], header_out['NAXIS1'])
+    log.info("Reprojecting image to %i x %i pixels with north up" % (shape_out[1], shape_out[0]))
+
+    data_out = reproject(data, wcs_in, wcs_out, shape_out, mode=mode,
+                         threads=threads)
+
+    return fits.PrimaryHDU(data_out, header_out)
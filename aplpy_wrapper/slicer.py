@@ -1,5 +1,38 @@
 from __future__ import absolute_import, print_function, division
 
+import threading
+from collections import OrderedDict
+
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+
+import numpy as np
+
+# The number of slices on either side of the current one (along each
+# sliced dimension) which are loaded ahead of time
+PREFETCH_DEPTH = 2
+
+# The time (in seconds) after which the background thread exits if no
+# slices are requested. It is started again by the next request.
+IDLE_TIMEOUT = 10.
+
+
+def get_wcsaxes_slices(dimensions, slices):
+    '''
+    Return the slices argument of WCSAxes for an image extracted from a cube
+    along the given dimensions and slices.
+    '''
+    wcsaxes_slices = list(slices)
+    if dimensions[0] < dimensions[1]:
+        wcsaxes_slices.insert(dimensions[0], 'x')
+        wcsaxes_slices.insert(dimensions[1], 'y')
+    else:
+        wcsaxes_slices.insert(dimensions[1], 'y')
+        wcsaxes_slices.insert(dimensions[0], 'x')
+    return tuple(wcsaxes_slices)
+
 
 def slice_hypercube(data, header, dimensions=[0, 1], slices=[]):
     '''
@@ -33,22 +66,17 @@ def slice_hypercube(data, header, dimensions=[0, 1], slices=[]):
     else:
 
         if slices:
-            wcsaxes_slices = slices[:]
+            wcsaxes_slices = get_wcsaxes_slices(dimensions, slices)
 
             if dimensions[0] < dimensions[1]:
                 slices.insert(dimensions[0], slice(None, None, None))
                 slices.insert(dimensions[1], slice(None, None, None))
-                wcsaxes_slices.insert(dimensions[0], 'x')
-                wcsaxes_slices.insert(dimensions[1], 'y')
             else:
                 slices.insert(dimensions[1], slice(None, None, None))
                 slices.insert(dimensions[0], slice(None, None, None))
-                wcsaxes_slices.insert(dimensions[1], 'y')
-                wcsaxes_slices.insert(dimensions[0], 'x')
 
             if type(slices) == list:
                 slices = tuple(slices)
-                wcsaxes_slices = tuple(wcsaxes_slices)
 
             data = data[slices[::-1]]
 
@@ -73,3 +101,140 @@ def slice_hypercube(data, header, dimensions=[0, 1], slices=[]):
             raise Exception(message)
 
         return x_axis, y_axis, data, wcsaxes_slices
+
+
+class SlicePrefetcher(object):
+    '''
+    Extract slices from a (usually memory-mapped) cube, and load the slices
+    adjacent to the last one requested in a background thread.
+
+    Slices which have not been prefetched are returned as views of the cube,
+    without copying. Prefetched slices are read into memory by the
+    background thread, so that stepping through the cube does not wait for
+    the disk. At most 2 * depth slices along each sliced dimension are kept.
+
+    The background thread exits after IDLE_TIMEOUT seconds without requests,
+    so it does not outlive its use, but stop() should be called to release
+    the prefetched slices as soon as they are no longer needed.
+    '''
+
+    def __init__(self, data, header, dimensions=[0, 1], depth=PREFETCH_DEPTH):
+        self._data = data
+        self._header = header
+        self._dimensions = dimensions
+        self._depth = depth
+        self._planes = OrderedDict()
+        self._wanted = []
+        self._lock = threading.Lock()
+        self._queue = Queue()
+        self._thread = None
+
+        # The sizes of the sliced dimensions, in the order of the slices
+        self._sizes = [data.shape[data.ndim - 1 - dim] for dim in range(data.ndim)
+                       if dim not in dimensions]
+
+    def check(self, slices):
+        '''
+        Check that slices is a valid list of slices for the cube.
+        '''
+        if len(slices) != len(self._sizes):
+            raise ValueError("slices= should have %i values" % len(self._sizes))
+        for value, size in zip(slices, self._sizes):
+            if value < 0 or value >= size:
+                raise ValueError("slice %i is out of range (0 to %i)" % (value, size - 1))
+
+    @property
+    def sizes(self):
+        '''
+        The number of slices along each sliced dimension.
+        '''
+        return list(self._sizes)
+
+    def view(self, slices):
+        '''
+        Return a slice of the cube as a view, without prefetching.
+        '''
+        return slice_hypercube(self._data, self._header,
+                               dimensions=self._dimensions, slices=list(slices))[2]
+
+    def _neighbours(self, key):
+        keys = []
+        for offset in range(1, self._depth + 1):
+            for dim, size in enumerate(self._sizes):
+                for sign in [1, -1]:
+                    value = key[dim] + sign * offset
+                    if 0 <= value < size:
+                        keys.append(key[:dim] + (value,) + key[dim + 1:])
+        return keys
+
+    def get(self, slices):
+        '''
+        Return a slice of the cube, and start prefetching its neighbours.
+        '''
+
+        key = tuple(slices)
+
+        with self._lock:
+            plane = self._planes.get(key)
+            self._wanted = self._neighbours(key)
+            # Only keep the slices which are still wanted
+            for old in list(self._planes):
+                if old != key and old not in self._wanted:
+                    del self._planes[old]
+
+        if plane is None:
+            plane = self.view(key)
+
+        if self._depth > 0:
+            # The request is queued and the thread started under the lock, so
+            # that the thread cannot exit for being idle in between
+            with self._lock:
+                self._queue.put(True)
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run)
+                    self._thread.daemon = True
+                    self._thread.start()
+
+        return plane
+
+    def _run(self):
+        while True:
+            # Only the latest request matters
+            try:
+                requests = [self._queue.get(timeout=IDLE_TIMEOUT)]
+            except Empty:
+                with self._lock:
+                    if self._queue.empty():
+                        self._thread = None
+                        return
+                continue
+            while not self._queue.empty():
+                requests.append(self._queue.get())
+            if None in requests:
+                return
+            with self._lock:
+                keys = [key for key in self._wanted if key not in self._planes]
+            for key in keys:
+                with self._lock:
+                    if key not in self._wanted:
+                        continue
+                plane = np.array(self.view(key))
+                with self._lock:
+                    if key in self._wanted:
+                        self._planes[key] = plane
+                if not self._queue.empty():
+                    break
+
+    def stop(self):
+        '''
+        Stop the background thread.
+        '''
+        with self._lock:
+            thread = self._thread
+            if thread is not None:
+                self._queue.put(None)
+        if thread is not None:
+            thread.join()
+        with self._lock:
+            self._thread = None
+            self._planes.clear()
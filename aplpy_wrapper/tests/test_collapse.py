@@ -0,0 +1,91 @@
+from __future__ import absolute_import, print_function, division
+
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+from astropy.io import fits
+
+from .. import collapse
+
+
+def cube_hdu(shape=(6, 5, 4), stokes=False):
+    header = fits.Header()
+    header['CTYPE1'] = 'RA---TAN'
+    header['CTYPE2'] = 'DEC--TAN'
+    header['CTYPE3'] = 'VELO-LSR'
+    header['CRVAL1'] = 30.
+    header['CRVAL2'] = 40.
+    header['CRVAL3'] = 1000.
+    header['CRPIX1'] = 2.
+    header['CRPIX2'] = 3.
+    header['CRPIX3'] = 1.
+    header['CDELT1'] = -1. / 3600.
+    header['CDELT2'] = 1. / 3600.
+    header['CDELT3'] = 500.
+    header['CUNIT3'] = 'm/s'
+    header['BUNIT'] = 'K'
+    data = np.random.RandomState(0).uniform(0.5, 2., shape)
+    data[2, 1, 1] = np.nan
+    data[:, 0, 0] = np.nan
+    if stokes:
+        header['CTYPE4'] = 'STOKES'
+        header['CRVAL4'] = 1.
+        header['CRPIX4'] = 1.
+        header['CDELT4'] = 1.
+        data = data[np.newaxis]
+    return fits.PrimaryHDU(data, header)
+
+
+def test_collapse_numpy():
+
+    hdu = cube_hdu()
+    data = hdu.data
+    v = 1000. + 500. * np.arange(data.shape[0])[:, np.newaxis, np.newaxis]
+    weights = np.where(np.isfinite(data), data, 0.)
+    total = weights.sum(axis=0)
+
+    with np.errstate(invalid='ignore'):
+        expected = {'sum': np.nansum(data, axis=0),
+                    'mean': np.nanmean(data, axis=0),
+                    'max': np.nanmax(data, axis=0),
+                    'moment0': 500. * total,
+                    'moment1': (weights * v).sum(axis=0) / total}
+        expected['moment2'] = (weights * (v - expected['moment1']) ** 2).sum(axis=0) / total
+    for key in expected:
+        expected[key][0, 0] = np.nan
+
+    for operation in collapse.OPERATIONS:
+        # A small chunk size checks that the chunks are combined correctly
+        image = collapse.collapse(hdu, operation=operation, chunk_bytes=100)
+        assert image.data.shape == (5, 4)
+        assert image.header['NAXIS'] == 2
+        assert_allclose(image.data, expected[operation], rtol=1e-10)
+
+    assert collapse.collapse(hdu, operation='moment0').header['BUNIT'] == 'K m s-1'
+
+
+def test_collapse_channels():
+    hdu = cube_hdu()
+    image = collapse.collapse(hdu, operation='sum', channels=(1, 3))
+    assert_allclose(image.data[1:, 1:], np.nansum(hdu.data[1:3], axis=0)[1:, 1:])
+
+
+def test_collapse_stokes():
+    # A Stokes axis of size one is not collapsed
+    hdu = cube_hdu(stokes=True)
+    image = collapse.collapse(hdu, operation='mean')
+    with np.errstate(invalid='ignore'):
+        assert_allclose(image.data, np.nanmean(hdu.data[0], axis=0))
+
+
+def test_collapse_dimensions():
+    # Collapsing along declination shows a position-velocity image
+    hdu = cube_hdu()
+    with pytest.raises(ValueError):
+        collapse.collapse(hdu, operation='sum', dimensions=[0, 2])
+    hdu = cube_hdu()
+    hdu.header['CTYPE2'] = 'OFFSET'
+    hdu.header['CTYPE1'] = 'OFFSET'
+    image = collapse.collapse(hdu, operation='sum', dimensions=[0, 2])
+    assert image.data.shape == (6, 4)
+    assert_allclose(image.data[:, 1:], np.nansum(hdu.data, axis=1)[:, 1:])
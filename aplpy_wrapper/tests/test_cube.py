@@ -0,0 +1,101 @@
+from __future__ import absolute_import, print_function, division
+
+import os
+
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+from matplotlib.artist import Artist
+
+from .. import FITSFigure
+from .. import image_util
+from .test_collapse import cube_hdu
+
+
+def test_set_slice():
+    hdu = cube_hdu()
+    f = FITSFigure(hdu, slices=[1])
+    f.show_colorscale(vmin=0., vmax=2.)
+    assert_allclose(f._data, hdu.data[1])
+    f.set_slice(3)
+    assert f._slices == [3]
+    assert_allclose(f._data, hdu.data[3])
+    assert_allclose(f.image.get_array(), hdu.data[3])
+    assert (f.image.norm.vmin, f.image.norm.vmax) == (0., 2.)
+    f.set_slice([1])
+    assert_allclose(f.image.get_array(), hdu.data[1])
+    with pytest.raises(Exception):
+        f.set_slice(6)
+    f.close()
+
+
+def test_save_animation(tmpdir):
+    pytest.importorskip('PIL')
+    from PIL import Image
+    hdu = cube_hdu()
+    f = FITSFigure(hdu, slices=[2])
+    f.show_colorscale(vmin=0., vmax=2.)
+    pattern = os.path.join(str(tmpdir), 'frame_%03i.png')
+    f.save_animation(pattern, limits='current', threads=2)
+    sizes = [Image.open(pattern % i).size for i in range(6)]
+    assert len(set(sizes)) == 1
+    assert not os.path.exists(pattern % 6)
+    f.save_animation(os.path.join(str(tmpdir), 'cube.gif'), slices=[0, 4],
+                     limits='global')
+    gif = Image.open(os.path.join(str(tmpdir), 'cube.gif'))
+    assert gif.n_frames == 2
+    # The figure is returned to the current slice and stretch
+    assert f._slices == [2]
+    assert_allclose(f.image.get_array(), hdu.data[2])
+    assert (f.image.norm.vmin, f.image.norm.vmax) == (0., 2.)
+    with pytest.raises(ValueError):
+        f.save_animation(os.path.join(str(tmpdir), 'cube.png'))
+    with pytest.raises(ValueError):
+        f.save_animation(os.path.join(str(tmpdir), 'cube.gif'), slices=[])
+    f.close()
+
+
+class NormRecorder(Artist):
+    # Records the limits of the stretch each time the figure is drawn
+
+    def __init__(self, norm):
+        Artist.__init__(self)
+        self.norm = norm
+        self.limits = []
+
+    def draw(self, renderer):
+        self.limits.append((self.norm.vmin, self.norm.vmax))
+
+
+def test_auto_limits():
+    # The maximum is moved out by 10% of the range after the minimum is
+    assert_allclose(image_util.auto_limits(0., 10., 'linear'), (-1., 11.1))
+    assert image_util.auto_limits(0., 10., 'linear', min_auto=False) == (0., 11.)
+    assert image_util.auto_limits(0., 10., 'log') == (0., 10.)
+
+
+def test_animation_limits(tmpdir):
+    pytest.importorskip('PIL')
+    hdu = cube_hdu()
+    f = FITSFigure(hdu, slices=[2])
+    pattern = os.path.join(str(tmpdir), 'frame_%03i.png')
+
+    # The global limits are those set by show_colorscale for the cube
+    f.show_colorscale(limits='cube')
+    expected = (f.image.norm.vmin, f.image.norm.vmax)
+    f.show_colorscale(vmin=0., vmax=2.)
+    recorder = NormRecorder(f.image.norm)
+    f.ax.add_artist(recorder)
+    f.save_animation(pattern, limits='global', threads=1)
+    assert_allclose(recorder.limits, [expected] * 6)
+
+    # The limits of each frame are padded in the same way
+    statistics = f._cube_statistics()
+    recorder.limits = []
+    f.save_animation(pattern, limits='frame', threads=1)
+    expected = []
+    for i in range(6):
+        vmin, vmax = statistics.slice_limits([i], 0.25, 99.75)
+        expected.append(image_util.auto_limits(vmin, vmax, 'linear'))
+    assert_allclose(recorder.limits, expected)
+    f.close()
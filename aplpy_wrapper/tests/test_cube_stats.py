@@ -0,0 +1,34 @@
+from __future__ import absolute_import, print_function, division
+
+import numpy as np
+from numpy.testing import assert_allclose
+
+from .. import cube_stats
+from .. import slicer
+from .test_collapse import cube_hdu
+
+
+def test_sample():
+    values = np.arange(250.)
+    for n_samples in [1, 7, 100, 249, 250, 1000]:
+        assert len(cube_stats.sample(values, n_samples)) <= n_samples
+    assert len(cube_stats.sample(values, 100)) == 84
+    values[::2] = np.nan
+    assert np.all(np.isfinite(cube_stats.sample(values, 1000)))
+
+
+def test_statistics():
+    hdu = cube_hdu(shape=(4, 60, 50))
+    cube = slicer.SlicePrefetcher(hdu.data, hdu.header)
+    stats = cube_stats.CubeStatistics.compute(cube)
+    assert stats.slice_percentiles.shape == (4, len(cube_stats.SLICE_PERCENTILES))
+    assert stats.slice_percentiles.dtype == np.float32
+    for index in range(4):
+        values = hdu.data[index][np.isfinite(hdu.data[index])]
+        assert_allclose(stats.slice_limits([index], 0.25, 99.75),
+                        np.percentile(values, [0.25, 99.75]), rtol=1e-6)
+        assert_allclose(stats.slice_limits([index], 33.3, 66.6),
+                        np.percentile(values, [33.3, 66.6]), rtol=1e-2)
+    values = hdu.data[np.isfinite(hdu.data)]
+    assert_allclose(stats.limits(1., 99.), np.percentile(values, [1., 99.]), rtol=1e-6)
+    cube.stop()
@@ -0,0 +1,53 @@
+from __future__ import absolute_import, print_function, division
+
+import numpy as np
+from numpy.testing import assert_allclose
+
+from .. import frames
+
+LON = np.array([0., 45., 120., 200., 330.])
+LAT = np.array([0., -30., 60., -75., 10.])
+
+# Reference values computed with the functions used by wcs_util before
+# frames.convert (fk52gal, gal2fk5, j2000tob1950 and b1950toj2000)
+REFERENCE = {('fk5', 'galactic'): ([96.3373673511, 226.4329788247, 157.1127475137, 304.8184829254, 68.7651689325],
+                                   [-60.1884649786, -61.717679809, 31.7383717392, -12.2330515148, -34.2836165454]),
+             ('galactic', 'fk5'): ([266.4049298488, 314.7797378385, 195.5558674933, 28.7505228382, 231.808128816],
+                                   [-28.9362178518, -3.8330598388, 57.0668938575, -22.8859285463, -44.5300770671]),
+             ('fk5', 'fk4'): ([359.3594758064, 44.4730655327, 118.9384939263, 199.0156642268, 329.3839492445],
+                              [-0.2784003399, -30.1977653874, 60.1369639624, -74.7375756107, 9.759646248]),
+             ('fk4', 'fk5'): ([0.6405242036, 45.526791166, 121.0547111904, 201.0078013405, 330.6159038636],
+                              [0.2784003414, -29.8040448444, 59.8585834103, -75.2607687412, 10.2418502852])}
+
+
+def test_reference():
+    for (frame_in, frame_out), (lon, lat) in REFERENCE.items():
+        new_lon, new_lat = frames.convert(LON, LAT, frame_in, frame_out)
+        assert_allclose(new_lon, lon, atol=1e-8)
+        assert_allclose(new_lat, lat, atol=1e-8)
+
+
+def test_round_trip():
+    for frame_in in frames.FRAMES:
+        for frame_out in frames.FRAMES:
+            lon, lat = frames.convert(LON, LAT, frame_in, frame_out)
+            lon, lat = frames.convert(lon, lat, frame_out, frame_in)
+            assert_allclose((lon - LON + 180.) % 360. - 180., 0., atol=1e-7)
+            assert_allclose(lat, LAT, atol=1e-7)
+
+
+def test_shape_and_dtype():
+    lon, lat = frames.convert(LON.reshape(5, 1), 0., 'fk5', 'galactic')
+    assert lon.shape == (5, 1)
+    assert lat.shape == (5, 1)
+    lon, lat = frames.convert(LON.astype(np.float32), LAT.astype(np.float32),
+                              'fk5', 'galactic')
+    assert lon.dtype == np.float32
+    assert np.all((lon >= 0.) & (lon < 360.))
+
+
+def test_in_place():
+    lon, lat = LON.copy(), LAT.copy()
+    frames.convert(lon, lat, 'fk5', 'galactic', out=(lon, lat))
+    assert_allclose(lon, REFERENCE['fk5', 'galactic'][0], atol=1e-8)
+    assert_allclose(lat, REFERENCE['fk5', 'galactic'][1], atol=1e-8)
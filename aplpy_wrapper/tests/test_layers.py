@@ -0,0 +1,64 @@
+from __future__ import absolute_import, print_function, division
+
+from matplotlib.lines import Line2D
+
+from ..layers import LayerRegistry
+
+
+def test_add_and_order():
+    registry = LayerRegistry()
+    registry.add('a', Line2D([], []), tags=['x'])
+    registry.add('b', Line2D([], []))
+    assert registry.keys() == ['a', 'b']
+    assert registry.select(tag='x') == ['a']
+    assert registry.next_name('contour_set') == 'contour_set_1'
+    assert registry.next_name('contour_set') == 'contour_set_2'
+
+
+def test_replace():
+    registry = LayerRegistry()
+    old = Line2D([], [])
+    registry.add('a', old)
+    registry.add('a_txt', Line2D([], []), parent='a')
+    new = Line2D([], [])
+    registry.add('a', new)
+    assert registry['a'] is new
+    assert 'a_txt' not in registry
+    assert registry.record('a').companions == []
+
+
+def test_replace_companion():
+    registry = LayerRegistry()
+    registry.add('a', Line2D([], []))
+    registry.add('a_txt', Line2D([], []), parent='a')
+    registry.add('a_txt', Line2D([], []), parent='a')
+    assert registry.record('a').companions == ['a_txt']
+
+
+def test_pop():
+    registry = LayerRegistry()
+    artist = Line2D([], [])
+    registry.add('a', Line2D([], []))
+    registry.add('a_txt', artist, parent='a')
+    assert registry.pop('a_txt') is artist
+    assert registry.record('a').companions == []
+    assert registry.keys() == ['a']
+
+
+def test_pop_missing_companion():
+    registry = LayerRegistry()
+    registry.add('a', Line2D([], []))
+    registry.add('a_txt', Line2D([], []), parent='a')
+    registry.record('a').companions = []
+    registry.pop('a_txt')
+    assert registry.keys() == ['a']
+
+
+def test_rename():
+    registry = LayerRegistry()
+    registry.add('a', Line2D([], []))
+    registry.add('a_txt', Line2D([], []), parent='a')
+    registry.add('b', Line2D([], []))
+    registry.rename('a', 'c')
+    assert registry.keys() == ['c', 'a_txt', 'b']
+    assert registry.record('a_txt').parent == 'c'
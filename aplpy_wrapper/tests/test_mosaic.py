@@ -0,0 +1,63 @@
+from __future__ import absolute_import, print_function, division
+
+import os
+
+import numpy as np
+from numpy.testing import assert_allclose
+from astropy.io import fits
+
+from .. import mosaic
+from .. import wcs_util
+
+
+def image_hdu(crval1, nx=40, ny=30):
+    header = fits.Header()
+    header['NAXIS'] = 2
+    header['NAXIS1'] = nx
+    header['NAXIS2'] = ny
+    header['CTYPE1'] = 'RA---TAN'
+    header['CTYPE2'] = 'DEC--TAN'
+    header['CRVAL1'] = crval1
+    header['CRVAL2'] = 40.
+    header['CRPIX1'] = 0.5 * (nx + 1)
+    header['CRPIX2'] = 0.5 * (ny + 1)
+    header['CDELT1'] = -1. / 3600.
+    header['CDELT2'] = 1. / 3600.
+    return fits.PrimaryHDU(np.ones((ny, nx)), header)
+
+
+def test_mosaic(tmpdir):
+
+    # Two images offset by 20 pixels in right ascension, with a source in
+    # the overlap
+    offset = 20. / 3600. / np.cos(np.radians(40.))
+    left = image_hdu(30.)
+    right = image_hdu(30. - offset)
+    left.data[12:17, 28:33] += 10.
+    filenames = [os.path.join(str(tmpdir), 'left.fits'),
+                 os.path.join(str(tmpdir), 'right.fits')]
+    left.writeto(filenames[0])
+    right.writeto(filenames[1])
+    ra, dec = wcs_util.get_wcs(left.header).wcs_pix2world(31., 15., 1)
+
+    for combine in mosaic.COMBINE:
+
+        hdu, coverage = mosaic.mosaic(filenames, combine=combine, mode='flux')
+
+        # The edges of the images are not exactly on pixel boundaries of
+        # the mosaic, which can add a partially covered row and column
+        assert hdu.data.shape[0] in [30, 31]
+        assert hdu.data.shape[1] in [60, 61]
+        assert coverage.max() == 2
+        assert np.sum(coverage == 2) == 20 * 30
+
+        # The source is in the overlap, where it is combined with the
+        # background of the other image
+        wcs = wcs_util.get_wcs(hdu.header)
+        source = np.where(coverage > 0, hdu.data - 1., 0.)
+        yp, xp = np.indices(source.shape) + 1.
+        x = (source * xp).sum() / source.sum()
+        y = (source * yp).sum() / source.sum()
+        assert_allclose(wcs.wcs_pix2world(x, y, 1), (ra, dec), atol=0.05 / 3600.)
+        if combine == 'mean':
+            assert_allclose(source.sum(), 25. * 10. / 2., rtol=1e-6)
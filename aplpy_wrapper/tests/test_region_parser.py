@@ -0,0 +1,106 @@
+from __future__ import absolute_import, print_function, division
+
+import numpy as np
+from numpy.testing import assert_allclose
+from astropy.io import fits
+
+from .. import region_parser
+from .. import wcs_util
+
+
+def simple_wcs():
+    header = fits.Header()
+    header['NAXIS'] = 2
+    header['NAXIS1'] = 100
+    header['NAXIS2'] = 100
+    header['CTYPE1'] = 'RA---TAN'
+    header['CTYPE2'] = 'DEC--TAN'
+    header['CRVAL1'] = 30.
+    header['CRVAL2'] = 40.
+    header['CRPIX1'] = 50.5
+    header['CRPIX2'] = 50.5
+    header['CDELT1'] = -1. / 3600.
+    header['CDELT2'] = 1. / 3600.
+    return wcs_util.WCS(header)
+
+
+def test_positions():
+    columns = region_parser.parse(['fk5',
+                                   'circle(02:00:00,+40:30:00,3")',
+                                   'circle(2h00m00s,-40d30m00s,3")',
+                                   'circle(30.5,40.5,0.1d)'])
+    g = columns['ellipse']
+    assert_allclose(g['x'], [30., 30., 30.5])
+    assert_allclose(g['y'], [40.5, -40.5, 40.5])
+    assert_allclose(g['width'], [6. / 3600., 6. / 3600., 0.2])
+
+
+def test_frames():
+    columns = region_parser.parse(['galactic; point(10,20) # point=cross',
+                                   'image',
+                                   'box(10,20,4,6,30)'])
+    assert list(columns['point']['frame']) == ['galactic']
+    assert list(columns['point']['marker']) == ['+']
+    assert list(columns['box']['frame']) == ['image']
+    assert_allclose(columns['box']['angle'], [30.])
+    assert list(columns['box']['width_pixels']) == [True]
+    assert list(columns['box']['height_pixels']) == [True]
+
+
+def test_mixed_size_units():
+    columns = region_parser.parse(['fk5; box(30,40,10",4p,0)',
+                                   'fk5; ellipse(30,40,2p,3",0)'])
+    assert list(columns['box']['width_pixels']) == [False]
+    assert list(columns['box']['height_pixels']) == [True]
+    assert list(columns['ellipse']['width_pixels']) == [True]
+    assert list(columns['ellipse']['height_pixels']) == [False]
+    result = region_parser.to_image(columns, simple_wcs())
+    assert_allclose(result['box']['width'], [10.])
+    assert_allclose(result['box']['height'], [4.])
+    assert_allclose(result['ellipse']['width'], [4.])
+    assert_allclose(result['ellipse']['height'], [6.])
+
+
+def test_arcseconds_and_semicolons():
+    columns = region_parser.parse(['fk5; circle(30,40,3"); circle(30,40,1.5\'); text(30,40,"a;b")'])
+    assert_allclose(columns['ellipse']['width'], [6. / 3600., 3. / 60.])
+    assert list(columns['text']['text']) == ['a;b']
+
+
+def test_parentheses_in_text():
+    columns = region_parser.parse(['image; text(10,20,{a (b) c}) # color=red',
+                                   'image; circle(1,2,3) # text={d (e)}'])
+    assert list(columns['text']['text']) == ['a (b) c', 'd (e)']
+    assert list(columns['text']['color']) == ['red', 'green']
+    assert_allclose(columns['ellipse']['width'], [6.])
+
+
+def test_global_and_attributes():
+    columns = region_parser.parse(['global color=blue width=2',
+                                   'image; circle(1,2,3) # dash=1',
+                                   'image; circle(1,2,3) # color=red'])
+    g = columns['ellipse']
+    assert list(g['color']) == ['blue', 'red']
+    assert_allclose(g['linewidth'], [2., 2.])
+    assert list(g['linestyle']) == ['dashed', 'solid']
+
+
+def test_skipped():
+    columns = region_parser.parse(['# Region file format: DS9',
+                                   'image; annulus(1,2,3,4)',
+                                   'image; polygon(1,2,3,4,5,6)',
+                                   'image; # vector(1,2,3,4)'])
+    assert list(columns.keys()) == ['polygon']
+    assert_allclose(columns['polygon']['vertices'][0], [[1, 2], [3, 4], [5, 6]])
+
+
+def test_to_image():
+    columns = region_parser.parse(['fk5; circle(30,40,36")',
+                                   'image; line(1,2,3,4)'])
+    result = region_parser.to_image(columns, simple_wcs())
+    assert_allclose(result['ellipse']['x'], [50.5], atol=1e-6)
+    assert_allclose(result['ellipse']['y'], [50.5], atol=1e-6)
+    assert_allclose(result['ellipse']['width'], [72.])
+    assert_allclose(result['ellipse']['angle'], [0.], atol=1e-6)
+    assert_allclose(result['line']['x2'], [3.])
+    assert_allclose(result['line']['y2'], [4.])
@@ -0,0 +1,73 @@
+from __future__ import absolute_import, print_function, division
+
+import numpy as np
+from numpy.testing import assert_allclose
+from astropy.io import fits
+
+from .. import reproject
+from .. import wcs_util
+
+
+def rotated_hdu(angle=30., nx=60, ny=40):
+    header = fits.Header()
+    header['NAXIS'] = 2
+    header['NAXIS1'] = nx
+    header['NAXIS2'] = ny
+    header['CTYPE1'] = 'RA---TAN'
+    header['CTYPE2'] = 'DEC--TAN'
+    header['CRVAL1'] = 30.
+    header['CRVAL2'] = 40.
+    header['CRPIX1'] = 0.5 * (nx + 1)
+    header['CRPIX2'] = 0.5 * (ny + 1)
+    scale = 1. / 3600.
+    c, s = np.cos(np.radians(angle)), np.sin(np.radians(angle))
+    header['CD1_1'] = -scale * c
+    header['CD1_2'] = scale * s
+    header['CD2_1'] = scale * s
+    header['CD2_2'] = scale * c
+    data = np.zeros((ny, nx))
+    data[14:19, 34:39] = 1.
+    return fits.PrimaryHDU(data, header)
+
+
+def test_north_flux_and_position():
+    hdu = rotated_hdu()
+    wcs_in = wcs_util.get_wcs(hdu.header)
+    new = reproject.reproject_north(hdu, mode='flux')
+    wcs_out = wcs_util.get_wcs(new.header)
+    assert_allclose(new.header['CDELT1'], -1. / 3600.)
+    assert_allclose(new.header['CDELT2'], 1. / 3600.)
+    assert 'CD1_1' not in new.header
+    # Total flux is conserved, and the source stays at the same position
+    assert_allclose(np.nansum(new.data), hdu.data.sum(), rtol=1e-2)
+    yp, xp = np.indices(new.data.shape) + 1.
+    weights = np.nan_to_num(new.data)
+    x_out = (weights * xp).sum() / weights.sum()
+    y_out = (weights * yp).sum() / weights.sum()
+    ra, dec = wcs_out.wcs_pix2world(x_out, y_out, 1)
+    assert_allclose(wcs_in.wcs_pix2world(37., 17., 1), (ra, dec), atol=0.05 / 3600.)
+
+
+def test_north_sip():
+    hdu = rotated_hdu(angle=0.)
+    hdu.header['CTYPE1'] = 'RA---TAN-SIP'
+    hdu.header['CTYPE2'] = 'DEC--TAN-SIP'
+    hdu.header['A_ORDER'] = 2
+    hdu.header['A_2_0'] = 1e-5
+    hdu.header['B_ORDER'] = 2
+    hdu.header['B_0_2'] = 1e-5
+    hdu.header['AP_ORDER'] = 2
+    hdu.header['AP_2_0'] = -1e-5
+    hdu.header['BP_ORDER'] = 2
+    hdu.header['BP_0_2'] = -1e-5
+    hdu.header['LONPOLE'] = 180.
+    hdu.header['PV2_1'] = 0.
+    new = reproject.reproject_north(hdu)
+    assert new.header['CTYPE1'] == 'RA---TAN'
+    assert new.header['CTYPE2'] == 'DEC--TAN'
+    for keyword in ['A_ORDER', 'A_2_0', 'B_ORDER', 'B_0_2', 'AP_ORDER',
+                    'AP_2_0', 'BP_ORDER', 'BP_0_2', 'LONPOLE', 'PV2_1']:
+        assert keyword not in new.header
+    wcs = wcs_util.get_wcs(new.header)
+    assert wcs.sip is None
+    assert new.data.shape == (40, 60)
@@ -1,11 +1,45 @@
 from __future__ import absolute_import, print_function, division
 
-import numpy as np
+import copy
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
 
+import numpy as np
 
 from astropy import log
 from astropy.wcs import WCS as AstropyWCS
 
+from . import frames
+from .frames import precession_matrix
+
+
+# Prefixes of the header keywords which define a WCS
+WCS_KEYWORDS = ('NAXIS', 'WCSAXES', 'CTYPE', 'CRVAL', 'CRPIX', 'CDELT', 'CUNIT',
+                'CROTA', 'CD', 'PC', 'PV', 'PS', 'CNAME', 'EQUINOX', 'EPOCH',
+                'RADESYS', 'RADECSYS', 'LONPOLE', 'LATPOLE', 'MJD-OBS',
+                'DATE-OBS', 'RESTFRQ', 'RESTFREQ', 'RESTWAV', 'SPECSYS',
+                'VELREF', 'A_', 'B_', 'AP_', 'BP_')
+
+# The attributes of cached WCS objects which cannot be changed
+FROZEN_ATTRIBUTES = ('nx', 'ny', '_dimensions', '_slices')
+
+WCS_CACHE_SIZE = 32
+
+# The number of pixels along each axis used to find the mean world
+# coordinates of a slice
+MEAN_WORLD_SAMPLES = 16
+
+_wcs_cache = OrderedDict()
+_wcs_cache_lock = threading.Lock()
+
+
+# Geometry of a WCS, computed once per WCS (see WCS.geometry)
+WCSGeometry = namedtuple('WCSGeometry', ['pixel_scales', 'degperpix', 'rotation',
+                                         'system', 'equinox', 'units',
+                                         'axis_types', 'ctypes', 'cunits',
+                                         'footprint'])
+
 
 def decode_ascii(string):
     try:
@@ -18,42 +52,20 @@ class WCS(AstropyWCS):
 
     def __init__(self, *args, **kwargs):
 
-        if 'slices' in kwargs:
-            self._slices = kwargs.pop('slices')
-
-        if 'dimensions' in kwargs:
-            self._dimensions = kwargs.pop('dimensions')
+        self._slices = kwargs.pop('slices', [])
+        self._dimensions = kwargs.pop('dimensions', [0, 1])
 
         AstropyWCS.__init__(self, *args, **kwargs)
 
         # Fix common non-standard units
         self.wcs.unitfix()
 
-        # Now find the values of the coordinates in the slices - only needed if
-        # data has more than two dimensions
-        if len(self._slices) > 0:
-
-            self.nx = args[0]['NAXIS%i' % (self._dimensions[0] + 1)]
-            self.ny = args[0]['NAXIS%i' % (self._dimensions[1] + 1)]
-            xpix = np.arange(self.nx) + 1.
-            ypix = np.arange(self.ny) + 1.
-            xpix, ypix = np.meshgrid(xpix, ypix)
-            xpix, ypix = xpix.reshape(self.nx * self.ny), ypix.reshape(self.nx * self.ny)
-            s = 0
-            coords = []
-            for dim in range(self.naxis):
-                if dim == self._dimensions[0]:
-                    coords.append(xpix)
-                elif dim == self._dimensions[1]:
-                    coords.append(ypix)
-                else:
-                    coords.append(np.repeat(self._slices[s], xpix.shape))
-                    s += 1
-            coords = np.vstack(coords).transpose()
-            result = AstropyWCS.wcs_pix2world(self, coords, 1)
-            self._mean_world = np.mean(result, axis=0)
-            # result = result.transpose()
-            # result = result.reshape((result.shape[0],) + (self.ny, self.nx))
+        # Image dimensions along the displayed axes
+        if len(args) > 0 and hasattr(args[0], 'get'):
+            if args[0].get('NAXIS%i' % (self._dimensions[0] + 1)) is not None:
+                self.nx = args[0]['NAXIS%i' % (self._dimensions[0] + 1)]
+            if args[0].get('NAXIS%i' % (self._dimensions[1] + 1)) is not None:
+                self.ny = args[0]['NAXIS%i' % (self._dimensions[1] + 1)]
 
         # Now guess what 'type' of values are on each axis
         # if self.ctype_x[:4] == 'RA--' or \
@@ -80,12 +92,121 @@ class WCS(AstropyWCS):
         #     self.set_yaxis_coord_type('scalar')
         #     self.set_yaxis_coord_type('scalar')
 
+    @property
+    def _mean_world(self):
+        '''
+        The mean world coordinates over the selected slice of a cube.
+
+        This is computed the first time it is needed, from a small grid of
+        MEAN_WORLD_SAMPLES x MEAN_WORLD_SAMPLES pixels spanning the slice,
+        rather than from every pixel. For the non-displayed axes, which
+        are usually independent of the position in the slice, the result
+        is the same.
+        '''
+
+        if '_mean_world_value' not in self.__dict__:
+
+            nx = self.__dict__.get('nx', 1)
+            ny = self.__dict__.get('ny', 1)
+            xpix, ypix = np.meshgrid(np.linspace(1., nx, min(nx, MEAN_WORLD_SAMPLES)),
+                                     np.linspace(1., ny, min(ny, MEAN_WORLD_SAMPLES)))
+            xpix, ypix = xpix.ravel(), ypix.ravel()
+
+            s = 0
+            coords = []
+            for dim in range(self.naxis):
+                if dim == self._dimensions[0]:
+                    coords.append(xpix)
+                elif dim == self._dimensions[1]:
+                    coords.append(ypix)
+                else:
+                    coords.append(np.repeat(self._slices[s], xpix.shape))
+                    s += 1
+            coords = np.vstack(coords).transpose()
+            result = AstropyWCS.wcs_pix2world(self, coords, 1)
+            self.__dict__['_mean_world_value'] = np.mean(result, axis=0)
+
+        return self.__dict__['_mean_world_value']
+
+    def __setattr__(self, attribute, value):
+        if self.__dict__.get('_frozen', False) and attribute in FROZEN_ATTRIBUTES:
+            if self.__dict__.get(attribute) != value:
+                raise AttributeError("Cannot change %s of a shared WCS object - use mutable_copy() first" % attribute)
+        AstropyWCS.__setattr__(self, attribute, value)
+
+    def mutable_copy(self):
+        '''
+        Return a copy of the WCS which can be modified, even if this is a
+        shared instance from the WCS cache.
+        '''
+        wcs = copy.deepcopy(self)
+        wcs.__dict__['_frozen'] = False
+        wcs.__dict__.pop('_approx', None)
+        wcs.__dict__.pop('_mean_world_value', None)
+        wcs.__dict__.pop('_geometry', None)
+        return wcs
+
     def get_pixel_scales(self):
-        cdelt = np.matrix(self.wcs.get_cdelt())
-        pc = np.matrix(self.wcs.get_pc())
-        scale = np.array(cdelt * pc)[0,:]
+        scale = np.dot(self.wcs.get_cdelt(), self.wcs.get_pc())
         return scale[self._dimensions[0]], scale[self._dimensions[1]]
 
+    @property
+    def geometry(self):
+        '''
+        A WCSGeometry record with the pixel scales (in degrees), mean
+        degrees per pixel, rotation of the image relative to north (in
+        degrees), coordinate system, equinox and units (as returned by
+        system), axis types ('longitude', 'latitude', or 'scalar') for the
+        displayed axes, the ctype and cunit of every axis, and the world
+        coordinates of the corners of the image.
+
+        The record is computed the first time it is needed (and again if
+        the image dimensions change), and is immutable.
+        '''
+
+        nx = self.__dict__.get('nx')
+        ny = self.__dict__.get('ny')
+        geometry = self.__dict__.get('_geometry')
+
+        if geometry is None or geometry[0] != (nx, ny):
+            geometry = ((nx, ny), self._compute_geometry(nx, ny))
+            self.__dict__['_geometry'] = geometry
+
+        return geometry[1]
+
+    def _compute_geometry(self, nx, ny):
+
+        dx, dy = self._dimensions
+
+        ctypes = tuple(decode_ascii(ctype) for ctype in self.wcs.ctype)
+        cunits = tuple(self.wcs.cunit)
+
+        sx, sy = np.abs(self.get_pixel_scales())
+
+        cd = self.wcs.get_cdelt()[:, np.newaxis] * self.wcs.get_pc()
+        rotation = np.degrees(np.arctan2(-cd[dx, dy], cd[dy, dy]))
+
+        system, equinox, units = _system(ctypes[dx][0:4], ctypes[dy][0:4],
+                                         self.wcs.equinox)
+
+        axis_types = tuple(_axis_type(ctypes[d]) for d in (dx, dy))
+
+        if nx is not None and ny is not None:
+            xc = np.array([0.5, nx + 0.5, nx + 0.5, 0.5])
+            yc = np.array([0.5, 0.5, ny + 0.5, ny + 0.5])
+            if self.naxis > 2:
+                footprint = np.column_stack(_pix2world_nd(self, xc, yc))
+            else:
+                footprint = np.column_stack(self.wcs_pix2world(xc, yc, 1))
+            footprint.flags.writeable = False
+        else:
+            footprint = None
+
+        return WCSGeometry(pixel_scales=(sx, sy), degperpix=0.5 * (sx + sy),
+                           rotation=rotation, system=system, equinox=equinox,
+                           units=units, axis_types=axis_types, ctypes=ctypes,
+                           cunits=cunits, footprint=footprint)
+
     # def set_xaxis_coord_type(self, coord_type):
     #     if coord_type in ['longitude', 'latitude', 'scalar']:
     #         self.xaxis_coord_type = coord_type
@@ -108,7 +229,7 @@ class WCS(AstropyWCS):
             raise AttributeError("Attribute %s does not exist" % attribute)
 
         if attribute[:5] == 'ctype':
-            return decode_ascii(self.wcs.ctype[axis])
+            return self.geometry.ctypes[axis]
         elif attribute[:5] == 'cname':
             return decode_ascii(self.wcs.cname[axis])
         elif attribute[:5] == 'cunit':
@@ -174,235 +295,130 @@ class WCS(AstropyWCS):
     #         return result[:, self._dimensions[0]], result[:, self._dimensions[1]]
 
 
-def convert_coords(x, y, input, output):
 
-    system_in, equinox_in = input
-    system_out, equinox_out = output
+def _normalize_card(keyword, value):
+    if isinstance(value, basestring):
+        return keyword + '=' + value.strip()
+    elif isinstance(value, bool):
+        return keyword + '=' + str(value)
+    elif isinstance(value, (int, float, np.number)):
+        return keyword + '=' + repr(float(value))
+    else:
+        return keyword + '=' + str(value)
 
-    if input == output:
-        return x, y
 
-    # Need to take into account inverted coords
+def wcs_key(header, dimensions=[0, 1], slices=[], relax=True):
+    '''
+    Return a hash of the WCS keywords of a header, the dimensions and the
+    slices, which identifies the WCS built from them. The keywords are
+    sorted and values normalized, so that the order of the cards, comments,
+    and the formatting of numbers do not matter.
+    '''
+    cards = sorted(_normalize_card(keyword, header[keyword])
+                   for keyword in set(header.keys())
+                   if keyword.upper().startswith(WCS_KEYWORDS))
+    cards.append('dimensions=' + repr([int(d) for d in dimensions]))
+    cards.append('slices=' + repr([int(s) for s in slices]))
+    cards.append('relax=' + repr(relax))
+    return hashlib.sha1('\n'.join(cards).encode('utf-8')).hexdigest()
 
-    if system_in['name'] == 'galactic' and system_out['name'] == 'equatorial':
 
-        if equinox_out == 'j2000':
-            x, y = gal2fk5(x, y)
-        elif equinox_out == 'b1950':
-            x, y = gal2fk5(x, y)
-            x, y = j2000tob1950(x, y)
-        else:
-            raise Exception("Cannot convert from galactic to equatorial coordinates for equinox=%s" % equinox_out)
+def get_wcs(header, dimensions=[0, 1], slices=[], relax=True):
+    '''
+    Return the WCS for a header, dimensions and slices.
+
+    WCS objects are kept in a process-wide least-recently-used cache keyed
+    by wcs_key, so that the same WCS is only built once. The returned
+    instances are shared, so their dimensions and slices cannot be changed
+    - use mutable_copy to get a WCS which can be modified.
+    '''
 
-    elif system_in['name'] == 'equatorial' and system_out['name'] == 'galactic':
+    key = wcs_key(header, dimensions=dimensions, slices=slices, relax=relax)
 
-        if equinox_in == 'j2000':
-            x, y = fk52gal(x, y)
-        elif equinox_in == 'b1950':
-            x, y = b1950toj2000(x, y)
-            x, y = fk52gal(x, y)
-        else:
-            raise Exception("Cannot convert from equatorial to equatorial coordinates for equinox=%s" % equinox_in)
+    with _wcs_cache_lock:
+        if key in _wcs_cache:
+            wcs = _wcs_cache.pop(key)
+            _wcs_cache[key] = wcs
+            return wcs
 
-    elif system_in['name'] == 'equatorial' and system_out['name'] == 'equatorial':
+    wcs = WCS(header, dimensions=list(dimensions), slices=list(slices), relax=relax)
+    wcs.__dict__['_frozen'] = True
 
-        if equinox_in == 'b1950' and equinox_out == 'j2000':
-            x, y = b1950toj2000(x, y)
-        elif equinox_in == 'j2000' and equinox_out == 'b1950':
-            x, y = j2000tob1950(x, y)
-        elif equinox_in == equinox_out:
-            pass
-        else:
-            raise Exception("Cannot convert between equatorial coordinates for equinoxes %s and %s" % (equinox_in, equinox_out))
+    with _wcs_cache_lock:
+        # Another thread may have built the same WCS in the meantime
+        wcs = _wcs_cache.pop(key, wcs)
+        _wcs_cache[key] = wcs
+        while len(_wcs_cache) > WCS_CACHE_SIZE:
+            _wcs_cache.popitem(last=False)
 
-    else:
-        raise Exception("Cannot (yet) convert between %s, %s and %s, %s" % (system_in['name'], equinox_in, system_out['name'], equinox_out))
+    return wcs
 
-    # Take into account inverted coordinates
-    if system_in['inverted'] is system_out['inverted']:
-        return x, y
+def _frame(system, equinox):
+    '''
+    Return the name of the frames.convert frame for a (system, equinox) pair.
+    '''
+    if system['name'] == 'equatorial':
+        if equinox == 'j2000':
+            return 'fk5'
+        elif equinox == 'b1950':
+            return 'fk4'
+        else:
+            raise Exception("Cannot convert equatorial coordinates for equinox=%s" % equinox)
+    elif system['name'] in ['galactic', 'ecliptic']:
+        return system['name']
     else:
-        return y, x
+        raise Exception("Cannot (yet) convert %s coordinates" % system['name'])
 
 
-def precession_matrix(equinox1, equinox2, fk4=False):
-    "Adapted from the IDL astronomy library"
-
-    deg_to_rad = np.pi / 180.
-    sec_to_rad = deg_to_rad / 3600.
+def convert_coords(x, y, input, output, out=None):
+    '''
+    Convert coordinates between two (system, equinox) pairs, as returned by
+    system(). If out is given, it should be a tuple of two arrays in which
+    to place the results.
+    '''
 
-    t = 0.001 * (equinox2 - equinox1)
+    system_in, equinox_in = input
+    system_out, equinox_out = output
 
-    if not fk4:
+    if input == output:
+        return x, y
 
-        st = 0.001 * (equinox1 - 2000.)
+    # Take into account inverted coordinates
+    if system_in['inverted']:
+        x, y = y, x
 
-        # Compute 3 rotation angles
-        a = sec_to_rad * t * (23062.181 + st * (139.656 + 0.0139 * st) + t * (30.188 - 0.344 * st + 17.998 * t))
-        b = sec_to_rad * t * t * (79.280 + 0.410 * st + 0.205 * t) + a
-        c = sec_to_rad * t * (20043.109 - st * (85.33 + 0.217 * st) + t * (- 42.665 - 0.217 * st - 41.833 * t))
+    x, y = frames.convert(x, y, _frame(system_in, equinox_in),
+                          _frame(system_out, equinox_out), out=out)
 
+    if system_out['inverted']:
+        return y, x
     else:
-
-        st = 0.001 * (equinox1 - 1900.)
-
-        # Compute 3 rotation angles
-        a = sec_to_rad * t * (23042.53 + st * (139.75 + 0.06 * st) + t * (30.23 - 0.27 * st + 18.0 * t))
-        b = sec_to_rad * t * t * (79.27 + 0.66 * st + 0.32 * t) + a
-        c = sec_to_rad * t * (20046.85 - st * (85.33 + 0.37 * st) + t * (- 42.67 - 0.37 * st - 41.8 * t))
-
-    sina = np.sin(a)
-    sinb = np.sin(b)
-    sinc = np.sin(c)
-    cosa = np.cos(a)
-    cosb = np.cos(b)
-    cosc = np.cos(c)
-
-    r = np.matrix([[cosa * cosb * cosc - sina * sinb, sina * cosb + cosa * sinb * cosc,  cosa * sinc],
-                   [- cosa * sinb - sina * cosb * cosc, cosa * cosb - sina * sinb * cosc, - sina * sinc],
-                   [- cosb * sinc, - sinb * sinc, cosc]])
-
-    return r
-
-P1 = precession_matrix(1950., 2000.)
-P2 = precession_matrix(2000., 1950.)
+        return x, y
 
 
 def b1950toj2000(ra, dec):
     '''
     Convert B1950 to J2000 coordinates.
-
-    This routine is based on the technique described at
-    http://www.stargazing.net/kepler/b1950.html
     '''
-
-    # Convert to radians
-    ra = np.radians(ra)
-    dec = np.radians(dec)
-
-    # Convert RA, Dec to rectangular coordinates
-    x = np.cos(ra) * np.cos(dec)
-    y = np.sin(ra) * np.cos(dec)
-    z = np.sin(dec)
-
-    # Apply the precession matrix
-    x2 = P1[0, 0] * x + P1[1, 0] * y + P1[2, 0] * z
-    y2 = P1[0, 1] * x + P1[1, 1] * y + P1[2, 1] * z
-    z2 = P1[0, 2] * x + P1[1, 2] * y + P1[2, 2] * z
-
-    # Convert the new rectangular coordinates back to RA, Dec
-    ra = np.arctan2(y2, x2)
-    dec = np.arcsin(z2)
-
-    # Convert to degrees
-    ra = np.degrees(ra)
-    dec = np.degrees(dec)
-
-    # Make sure ra is between 0. and 360.
-    ra = np.mod(ra, 360.)
-    dec = np.mod(dec + 90., 180.) - 90.
-
-    return ra, dec
+    return frames.convert(ra, dec, 'fk4', 'fk5')
 
 
 def j2000tob1950(ra, dec):
     '''
     Convert J2000 to B1950 coordinates.
-
-    This routine was derived by taking the inverse of the b1950toj2000 routine
     '''
-
-    # Convert to radians
-    ra = np.radians(ra)
-    dec = np.radians(dec)
-
-    # Convert RA, Dec to rectangular coordinates
-    x = np.cos(ra) * np.cos(dec)
-    y = np.sin(ra) * np.cos(dec)
-    z = np.sin(dec)
-
-    # Apply the precession matrix
-    x2 = P2[0, 0] * x + P2[1, 0] * y + P2[2, 0] * z
-    y2 = P2[0, 1] * x + P2[1, 1] * y + P2[2, 1] * z
-    z2 = P2[0, 2] * x + P2[1, 2] * y + P2[2, 2] * z
-
-    # Convert the new rectangular coordinates back to RA, Dec
-    ra = np.arctan2(y2, x2)
-    dec = np.arcsin(z2)
-
-    # Convert to degrees
-    ra = np.degrees(ra)
-    dec = np.degrees(dec)
-
-    # Make sure ra is between 0. and 360.
-    ra = np.mod(ra, 360.)
-    dec = np.mod(dec + 90., 180.) - 90.
-
-    return ra, dec
-
-# Galactic conversion constants
-RA_NGP = np.radians(192.859508333333)
-DEC_NGP = np.radians(27.1283361111111)
-L_CP = np.radians(122.932)
-L_0 = L_CP - np.pi / 2.
-RA_0 = RA_NGP + np.pi / 2.
-DEC_0 = np.pi / 2. - DEC_NGP
+    return frames.convert(ra, dec, 'fk5', 'fk4')
 
 
 def gal2fk5(l, b):
-
-    l = np.radians(l)
-    b = np.radians(b)
-
-    sind = np.sin(b) * np.sin(DEC_NGP) + np.cos(b) * np.cos(DEC_NGP) * np.sin(l - L_0)
-
-    dec = np.arcsin(sind)
-
-    cosa = np.cos(l - L_0) * np.cos(b) / np.cos(dec)
-    sina = (np.cos(b) * np.sin(DEC_NGP) * np.sin(l - L_0) - np.sin(b) * np.cos(DEC_NGP)) / np.cos(dec)
-
-    dec = np.degrees(dec)
-
-    ra = np.arccos(cosa)
-    ra[np.where(sina < 0.)] = -ra[np.where(sina < 0.)]
-
-    ra = np.degrees(ra + RA_0)
-
-    ra = np.mod(ra, 360.)
-    dec = np.mod(dec + 90., 180.) - 90.
-
-    return ra, dec
+    return frames.convert(l, b, 'galactic', 'fk5')
 
 
 def fk52gal(ra, dec):
+    return frames.convert(ra, dec, 'fk5', 'galactic')
 
-    ra, dec = np.radians(ra), np.radians(dec)
-
-    np.sinb = np.sin(dec) * np.cos(DEC_0) - np.cos(dec) * np.sin(ra - RA_0) * np.sin(DEC_0)
-
-    b = np.arcsin(np.sinb)
-
-    cosl = np.cos(dec) * np.cos(ra - RA_0) / np.cos(b)
-    sinl = (np.sin(dec) * np.sin(DEC_0) + np.cos(dec) * np.sin(ra - RA_0) * np.cos(DEC_0)) / np.cos(b)
 
-    b = np.degrees(b)
-
-    l = np.arccos(cosl)
-    l[np.where(sinl < 0.)] = - l[np.where(sinl < 0.)]
-
-    l = np.degrees(l + L_0)
-
-    l = np.mod(l, 360.)
-    b = np.mod(b + 90., 180.) - 90.
-
-    return l, b
-
-
-def system(wcs):
-
-    xcoord = wcs.ctype_x[0:4]
-    ycoord = wcs.ctype_y[0:4]
-    equinox = wcs.wcs.equinox
+def _system(xcoord, ycoord, equinox):
 
     system = {}
 
@@ -446,19 +462,226 @@ def system(wcs):
     return system, equinox, units
 
 
+def _axis_type(ctype):
+    if ctype[:4] in ['RA--', 'GLON', 'ELON'] or ctype[1:4] == 'LON':
+        return 'longitude'
+    elif ctype[:4] in ['DEC-', 'GLAT', 'ELAT'] or ctype[1:4] == 'LAT':
+        return 'latitude'
+    else:
+        return 'scalar'
+
+
+def system(wcs):
+    if isinstance(wcs, WCS):
+        geometry = wcs.geometry
+        return dict(geometry.system), geometry.equinox, geometry.units
+    else:
+        return _system(wcs.ctype_x[0:4], wcs.ctype_y[0:4], wcs.wcs.equinox)
+
+
 def arcperpix(wcs):
     return degperpix(wcs) * 3600.
 
 
 def degperpix(wcs):
+    if isinstance(wcs, WCS):
+        return wcs.geometry.degperpix
     sx, sy = pixel_scale(wcs)
     return 0.5 * (sx + sy)
 
 
 def pixel_scale(wcs):
+    if isinstance(wcs, WCS):
+        return np.array(wcs.geometry.pixel_scales)
     return np.abs(wcs.get_pixel_scales())
 
 
+# Bulk conversions of at least this many positions use a polynomial
+# approximation of the WCS, if it is accurate to within APPROX_TOLERANCE
+# pixels over the image. Set APPROX_TOLERANCE to None to always use the
+# exact transformation.
+APPROX_SIZE = 10000
+APPROX_TOLERANCE = 0.01
+APPROX_ORDER = 3
+APPROX_SAMPLES = 24
+
+
+def set_approximation_tolerance(tolerance):
+    '''
+    Set the maximum error (in pixels) of the polynomial approximation used
+    for bulk world2pix/pix2world conversions. If the approximation of a WCS
+    is less accurate than this, the exact transformation is used. Set to
+    None to always use the exact transformation.
+    '''
+    global APPROX_TOLERANCE
+    APPROX_TOLERANCE = tolerance
+
+
+def _polynomial_powers(order):
+    return [(i, n - i) for n in range(order + 1) for i in range(n + 1)]
+
+
+class _Polynomial(object):
+    '''
+    A pair of 2D polynomials fitted by least squares, with the inputs
+    normalized to [-1, 1] over the fitted range.
+    '''
+
+    def __init__(self, x, y, values, order):
+        self.powers = _polynomial_powers(order)
+        self.center = (0.5 * (x.min() + x.max()), 0.5 * (y.min() + y.max()))
+        self.scale = (0.5 * (x.max() - x.min()) or 1., 0.5 * (y.max() - y.min()) or 1.)
+        x, y = self._normalize(x, y)
+        terms = np.column_stack([x ** i * y ** j for i, j in self.powers])
+        self.coefficients = np.linalg.lstsq(terms, np.column_stack(values), rcond=None)[0]
+
+    def _normalize(self, x, y):
+        return (x - self.center[0]) / self.scale[0], (y - self.center[1]) / self.scale[1]
+
+    def __call__(self, x, y):
+        # Each term is computed once from running powers of x and y, and
+        # accumulated into both outputs
+        x, y = self._normalize(x, y)
+        order = max(i for i, j in self.powers)
+        x_powers, y_powers = [None, x], [None, y]
+        for n in range(2, order + 1):
+            x_powers.append(x_powers[-1] * x)
+            y_powers.append(y_powers[-1] * y)
+        u = np.zeros(x.shape)
+        v = np.zeros(x.shape)
+        for (i, j), (cu, cv) in zip(self.powers, self.coefficients):
+            if i == 0 and j == 0:
+                u += cu
+                v += cv
+                continue
+            elif i == 0:
+                term = y_powers[j]
+            elif j == 0:
+                term = x_powers[i]
+            else:
+                term = x_powers[i] * y_powers[j]
+            u += cu * term
+            v += cv * term
+        return u, v
+
+
+class ApproximateTransform(object):
+    '''
+    A polynomial approximation of the pixel to world transformation of a 2D
+    WCS (and its inverse) over the footprint of an image.
+
+    The transformations are fitted to a grid of positions across the image,
+    and the maximum error in pixels (the residual attribute) is measured on
+    a second grid offset from the first. Longitudes are unwrapped around the
+    center of the image before fitting. Positions outside the fitted area
+    are always converted exactly.
+    '''
+
+    def __init__(self, wcs, nx, ny, order=APPROX_ORDER, samples=APPROX_SAMPLES):
+
+        self._wcs = wcs
+        self._lng = wcs.wcs.lng
+
+        x0, x1, y0, y1 = 0.5, nx + 0.5, 0.5, ny + 0.5
+        self._extent = (x0, x1, y0, y1)
+
+        xp, yp = np.meshgrid(np.linspace(x0, x1, samples), np.linspace(y0, y1, samples))
+        xp, yp = xp.ravel(), yp.ravel()
+        xw, yw = wcs.wcs_pix2world(xp, yp, 1)
+
+        self._reference = (xw[len(xw) // 2], yw[len(yw) // 2])
+        u, v = self._unwrap(xw, yw)
+
+        self._range = (u.min(), u.max(), v.min(), v.max())
+        self._pix2world = _Polynomial(xp, yp, (u, v), order)
+        self._world2pix = _Polynomial(u, v, (xp, yp), order)
+
+        # Measure the error at the centers of the cells of the fitting grid
+        step_x, step_y = (x1 - x0) / (samples - 1), (y1 - y0) / (samples - 1)
+        xt, yt = np.meshgrid(np.linspace(x0 + 0.5 * step_x, x1 - 0.5 * step_x, samples - 1),
+                             np.linspace(y0 + 0.5 * step_y, y1 - 0.5 * step_y, samples - 1))
+        xt, yt = xt.ravel(), yt.ravel()
+        xw, yw = wcs.wcs_pix2world(xt, yt, 1)
+
+        xa, ya = self._world2pix(*self._unwrap(xw, yw))
+        residual_world2pix = np.hypot(xa - xt, ya - yt).max()
+
+        xa, ya = wcs.wcs_world2pix(*(self._wrap(*self._pix2world(xt, yt)) + (1,)))
+        residual_pix2world = np.hypot(xa - xt, ya - yt).max()
+
+        self.residual = max(residual_world2pix, residual_pix2world)
+        if not np.isfinite(self.residual):
+            self.residual = np.inf
+
+    def _unwrap(self, xw, yw):
+        if self._lng == 0:
+            xw = np.mod(xw - self._reference[0] + 180., 360.) - 180.
+        elif self._lng == 1:
+            yw = np.mod(yw - self._reference[1] + 180., 360.) - 180.
+        return xw, yw
+
+    def _wrap(self, u, v):
+        if self._lng == 0:
+            u = np.mod(u + self._reference[0], 360.)
+        elif self._lng == 1:
+            v = np.mod(v + self._reference[1], 360.)
+        return u, v
+
+    def world2pix(self, x_world, y_world):
+        u, v = self._unwrap(x_world, y_world)
+        inside = (u >= self._range[0]) & (u <= self._range[1]) & \
+                 (v >= self._range[2]) & (v <= self._range[3])
+        x_pix, y_pix = self._world2pix(u, v)
+        if not np.all(inside):
+            outside = ~inside
+            x_pix[outside], y_pix[outside] = self._wcs.wcs_world2pix(x_world[outside],
+                                                                     y_world[outside], 1)
+        return x_pix, y_pix
+
+    def pix2world(self, x_pix, y_pix):
+        inside = (x_pix >= self._extent[0]) & (x_pix <= self._extent[1]) & \
+                 (y_pix >= self._extent[2]) & (y_pix <= self._extent[3])
+        x_world, y_world = self._wrap(*self._pix2world(x_pix, y_pix))
+        if not np.all(inside):
+            outside = ~inside
+            x_world[outside], y_world[outside] = self._wcs.wcs_pix2world(x_pix[outside],
+                                                                         y_pix[outside], 1)
+        return x_world, y_world
+
+
+def approximate_transform(wcs, n_positions):
+    '''
+    Return the polynomial approximation of a WCS, or None if the exact
+    transformation should be used for n_positions positions.
+
+    The approximation is fitted the first time it is needed for a given
+    image size, and is stored on the WCS object.
+    '''
+
+    if APPROX_TOLERANCE is None or n_positions < APPROX_SIZE or wcs.naxis != 2:
+        return None
+
+    nx = getattr(wcs, 'nx', None)
+    ny = getattr(wcs, 'ny', None)
+    if nx is None or ny is None:
+        if wcs.pixel_shape is None:
+            return None
+        nx, ny = wcs.pixel_shape
+
+    approx = wcs.__dict__.get('_approx')
+    if approx is None or approx[0] != (nx, ny):
+        with np.errstate(invalid='ignore'):
+            transform = ApproximateTransform(wcs, nx, ny)
+        log.debug("Maximum error of the WCS approximation: %g pixels" % transform.residual)
+        approx = ((nx, ny), transform)
+        wcs._approx = approx
+
+    if approx[1].residual > APPROX_TOLERANCE:
+        return None
+    else:
+        return approx[1]
+
+
 def world2pix(wcs, x_world, y_world):
     if np.isscalar(x_world) and np.isscalar(y_world):
         x_pix, y_pix = wcs.wcs_world2pix(np.array([x_world]), np.array([y_world]), 1)
@@ -467,6 +690,9 @@ def world2pix(wcs, x_world, y_world):
         x_pix, y_pix = wcs.wcs_world2pix(np.array(x_world), np.array(y_world), 1)
         return x_pix.tolist(), y_pix.tolist()
     elif isinstance(x_world, np.ndarray) and isinstance(y_world, np.ndarray):
+        approx = approximate_transform(wcs, x_world.size)
+        if approx is not None:
+            return approx.world2pix(x_world, y_world)
         return wcs.wcs_world2pix(x_world, y_world, 1)
     else:
         raise Exception("world2pix should be provided either with two scalars, two lists, or two numpy arrays")
@@ -480,6 +706,87 @@ def pix2world(wcs, x_pix, y_pix):
         x_world, y_world = wcs.wcs_pix2world(np.array(x_pix), np.array(y_pix), 1)
         return x_world.tolist(), y_world.tolist()
     elif isinstance(x_pix, np.ndarray) and isinstance(y_pix, np.ndarray):
+        approx = approximate_transform(wcs, x_pix.size)
+        if approx is not None:
+            return approx.pix2world(x_pix, y_pix)
         return wcs.wcs_pix2world(x_pix, y_pix, 1)
     else:
         raise Exception("pix2world should be provided either with two scalars, two lists, or two numpy arrays")
+
+
+def axis_world(wcs, axis, n_pixels):
+    '''
+    Return the world coordinates of the pixels along one axis of a WCS (at
+    the reference pixel of the other axes), and the unit of these
+    coordinates.
+    '''
+    pixel = np.repeat(np.array(wcs.wcs.crpix, dtype=float)[np.newaxis, :], n_pixels, axis=0)
+    pixel[:, axis] = np.arange(1, n_pixels + 1)
+    world = AstropyWCS.wcs_pix2world(wcs, pixel, 1)[:, axis]
+    return world, wcs.wcs.cunit[axis]
+
+
+def _pix2world_nd(wcs, x_pix, y_pix):
+    # Convert pixel to world coordinates for a WCS with more than two
+    # dimensions, using the pixel slices selected for the other dimensions
+    coords = []
+    s = 0
+    for dim in range(wcs.naxis):
+        if dim == wcs._dimensions[0]:
+            coords.append(x_pix)
+        elif dim == wcs._dimensions[1]:
+            coords.append(y_pix)
+        else:
+            coords.append(np.repeat(wcs._slices[s], x_pix.shape))
+            s += 1
+    result = AstropyWCS.wcs_pix2world(wcs, np.vstack(coords).transpose(), 1)
+    return result[:, wcs._dimensions[0]], result[:, wcs._dimensions[1]]
+
+
+def _world2pix_nd(wcs, x_world, y_world):
+    # Convert world to pixel coordinates for a WCS with more than two
+    # dimensions. The other world coordinates are set to their mean value
+    # over the selected slices.
+    coords = []
+    for dim in range(wcs.naxis):
+        if dim == wcs._dimensions[0]:
+            coords.append(x_world)
+        elif dim == wcs._dimensions[1]:
+            coords.append(y_world)
+        else:
+            coords.append(np.repeat(wcs._mean_world[dim], x_world.shape))
+    result = AstropyWCS.wcs_world2pix(wcs, np.vstack(coords).transpose(), 1)
+    return result[:, wcs._dimensions[0]], result[:, wcs._dimensions[1]]
+
+
+def pix2pix(wcs_in, wcs_out, x_pix, y_pix):
+    '''
+    Convert pixel positions in one image to pixel positions in another.
+
+    Each step (pixel to world, change of celestial system, and world to
+    pixel) is done with a single vectorized call for all the positions.
+    '''
+
+    x_pix = np.asarray(x_pix, dtype=float)
+    y_pix = np.asarray(y_pix, dtype=float)
+    shape = x_pix.shape
+    x_pix, y_pix = x_pix.ravel(), y_pix.ravel()
+
+    if wcs_in.naxis > 2:
+        x_world, y_world = _pix2world_nd(wcs_in, x_pix, y_pix)
+    else:
+        x_world, y_world = wcs_in.wcs_pix2world(x_pix, y_pix, 1)
+
+    system_in, equinox_in, units = system(wcs_in)
+    system_out, equinox_out, units = system(wcs_out)
+
+    x_world, y_world = convert_coords(x_world, y_world,
+                                      (system_in, equinox_in),
+                                      (system_out, equinox_out))
+
+    if wcs_out.naxis > 2:
+        x_out, y_out = _world2pix_nd(wcs_out, x_world, y_world)
+    else:
+        x_out, y_out = wcs_out.wcs_world2pix(x_world, y_world, 1)
+
+    return x_out.reshape(shape), y_out.reshape(shape)